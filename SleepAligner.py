@@ -6,21 +6,89 @@
 ## Created by: Connor Smith, Sean Babcock and Aaron Coyner
 ## OHSU BMI 552B/652B, AMIA design challenge
 
-## Datasets from sleep log data (converted externally to CSV from XLS) and actitgraphy data originally 
+## Datasets from sleep log data (CSV, or the XLS/XLSX workbook itself) and actitgraphy data originally 
 ## in CSV format
 
 ## Output:  Single .csv file aligning data by date.  Sleep log and actigraphy data pertaining to wake 
 ## and sleep times listed first with calculations of delta times.  Remaining sleep log data and 
-## Actigraphy "sleep" data appended to the end of each row.
+## Actigraphy "sleep" data appended to the end of each row.  A weekly summary of the differences
+## and missing nights is written next to it (<output>.summary.csv).
 
 
+import os
 import sys
-import csv
+import time
 from PyQt5.QtWidgets import (QWidget, QToolTip, QPushButton, QApplication, qApp, QMainWindow,
-								QLineEdit, QFileDialog, QMessageBox, QAction, QLabel)
+								QLineEdit, QFileDialog, QMessageBox, QAction, QLabel, QProgressBar,
+								QComboBox, QCheckBox)
 from PyQt5.QtGui import QFont, QIcon
 from PyQt5 import QtCore
 
+## The alignment modules (SleepEngine and what it pulls in) are imported once the window is on
+## screen, see Window.load_engine(), so they add nothing to the time it takes to show up.
+
+
+## runs SleepEngine.align_files off the GUI thread and reports progress through signals
+class AlignWorker(QtCore.QThread):
+	progress = QtCore.pyqtSignal(str, int, int)
+	finished_ok = QtCore.pyqtSignal(int)
+	cancelled = QtCore.pyqtSignal()
+	failed = QtCore.pyqtSignal(str)
+
+	def __init__(self, act_file, log_file, out_path, cache=None, parent=None, scoring=None):
+		super().__init__(parent)
+		self.act_file = act_file
+		self.log_file = log_file
+		self.out_path = out_path
+		self.cache = cache
+		self.scoring = scoring
+		self.stop = False
+		## SleepValidate.Problem list when the input files were rejected before parsing
+		self.problems = []
+		import SleepProfile
+		## stage timings and counters; set SLEEPALIGNER_PROFILE=1 to add a cProfile capture
+		self.run_report = SleepProfile.RunReport(profile=bool(os.environ.get('SLEEPALIGNER_PROFILE')))
+
+	## asks the running alignment to stop at the next progress report
+	def cancel(self):
+		self.stop = True
+
+	## progress callback handed to the engine (runs in the worker thread)
+	def on_progress(self, stage, count, total):
+		if self.stop:
+			import SleepEngine
+			raise SleepEngine.AlignCancelled()
+		self.progress.emit(stage, count, total)
+
+	def run(self):
+		import SleepEngine
+		import SleepValidate
+		try:
+			nights = SleepEngine.align_files(self.act_file, self.log_file, self.out_path, self.on_progress,
+												self.cache, self.run_report, self.scoring)
+		except SleepEngine.AlignCancelled:
+			self.cancelled.emit()
+		except SleepValidate.InputError as e:
+			self.problems = e.problems
+			self.failed.emit(str(e))
+		except Exception as e:
+			self.failed.emit(str(e))
+		else:
+			self.write_summary()
+			self.finished_ok.emit(nights)
+
+	## weekly summary table next to the output (SleepSummary.py).  The output is already written,
+	## so a failure here is a warning in the run report, not a failed run
+	def write_summary(self):
+		import SleepSummary
+		with self.run_report.stage('summary'):
+			try:
+				SleepSummary.write_summary(self.out_path)
+			except Exception as e:
+				self.run_report.warn('Summary not written: %s: %s' % (type(e).__name__, e))
+		self.run_report.finish()
+
+
 class Window(QMainWindow):
 	def __init__(self):
 		super().__init__()
@@ -96,10 +164,17 @@ class Window(QMainWindow):
 		self.out_file_name = 'result_file'
 		self.out_file = QLineEdit(self)
 		self.out_file.setFocus()
-		self.out_file.resize(350, 25)
+		self.out_file.resize(265, 25)
 		self.out_file.move(225, 175)
 		self.out_file.setText(self.out_file_name)
 
+		## output file type; parquet and feather need pyarrow
+		self.out_format = QComboBox(self)
+		self.out_format.addItems(['.csv', '.parquet', '.feather'])
+		self.out_format.setToolTip('Output file type: CSV, or typed columnar Parquet/Feather')
+		self.out_format.resize(75, 25)
+		self.out_format.move(500, 175)
+
 
 
 		## create 'run' button
@@ -109,6 +184,13 @@ class Window(QMainWindow):
 		self.btn_run.resize(self.btn_run.sizeHint())
 		self.btn_run.move(275, 225)
 
+		## score nights without Actiware intervals from the epoch data (needs numpy)
+		self.score_missing = QCheckBox('Score missing nights', self)
+		self.score_missing.setToolTip('Nights with no Actiware REST/SLEEP interval get intervals ' +
+			'scored from the epoch-by-epoch activity counts')
+		self.score_missing.resize(175, 25)
+		self.score_missing.move(25, 225)
+
 		## link button to main source code for file alignment
 		self.btn_run.clicked.connect(self.run)
 
@@ -116,11 +198,74 @@ class Window(QMainWindow):
 		self.out_file.returnPressed.connect(self.btn_run.click)
 
 
+		## create 'cancel' button, only enabled while an alignment is running
+		self.btn_cancel = QPushButton('Cancel', self)
+		self.btn_cancel.setToolTip('Stops the running alignment')
+		self.btn_cancel.resize(self.btn_run.sizeHint())
+		self.btn_cancel.move(475, 275)
+		self.btn_cancel.setEnabled(False)
+		self.btn_cancel.clicked.connect(self.cancel)
+
+		## progress of the running alignment
+		self.progress = QProgressBar(self)
+		self.progress.resize(425, 25)
+		self.progress.move(25, 275)
+		self.progress.setValue(0)
+
+		self.status = QLabel(self)
+		self.status.resize(425, 25)
+		self.status.move(25, 305)
+
+		## create 'report' button: stage timings and counters of the last run
+		self.btn_report = QPushButton('Report', self)
+		self.btn_report.setToolTip('Shows timings and counts for the last run')
+		self.btn_report.resize(self.btn_run.sizeHint())
+		self.btn_report.move(475, 305)
+		self.btn_report.setEnabled(False)
+		self.btn_report.clicked.connect(self.show_report)
+
+		## create 'preview' button: the last output file in a table
+		self.btn_preview = QPushButton('Preview', self)
+		self.btn_preview.setToolTip('Shows the last output file')
+		self.btn_preview.resize(self.btn_run.sizeHint())
+		self.btn_preview.move(475, 225)
+		self.btn_preview.setEnabled(False)
+		self.btn_preview.clicked.connect(self.show_preview)
+
+		self.worker = None
+		self.last_report = None
+		self.last_output = None
+		self.cache = None
+		self.engine_loaded = False
+
+
 		## set window title, placement and dimensions
-		self.setFixedSize(600, 275)
+		self.setFixedSize(600, 345)
 		self.setWindowTitle('Sleep Aligner v1.1')    
 		self.show()
 
+		## the rest of start up runs from the event loop, once the window is up
+		QtCore.QTimer.singleShot(0, self.window_shown)
+
+
+	## first pass of the event loop: the window is showing, load the engine behind it
+	def window_shown(self):
+		self.load_engine()
+
+
+	## imports the alignment engine and opens the parse cache (once)
+	def load_engine(self):
+		if self.engine_loaded:
+			return
+		# SleepCache imports SleepEngine
+		import SleepCache
+		## parsed input files are cached so re-runs of the same subject skip CSV parsing
+		try:
+			self.cache = SleepCache.ParseCache()
+		except OSError:
+			self.cache = None
+		self.engine_loaded = True
+
 
 	## opens file dialog for actigraphy data selection
 	def select_act(self):
@@ -139,7 +284,7 @@ class Window(QMainWindow):
 	## opens file dialog for sleep log data selection
 	def select_log(self):
 		self.log_file, _ = QFileDialog.getOpenFileName(self, 'Select Sleep Log Data File',
-			filter='Sleep log data files (*.csv)')
+			filter='Sleep log data files (*.csv *.xlsx *.xlsm *.xls)')
 
 		if self.log_file == '':
 			pass
@@ -181,435 +326,147 @@ class Window(QMainWindow):
 			reply = QMessageBox.warning(self, 'Warning!', msg, QMessageBox.Ok)
 
 
-		## if all files and folders are selected, run code...
+		## if all files and folders are selected, run code in the background...
 		else:
-
-			try:
-
-				inFile = open(self.act_file, "r")
-				actData = list(csv.reader(inFile))
-				inFile.close()
-
-				inFile = open(self.log_file, "r")
-				logData = list(csv.reader(inFile))
-				inFile.close()
-
-				# Store subset of actigraph statistics data: REST, ACTIVE, SLEEP, DAILY
-				# Capture header in actHeader
-				restList = []
-				activeList = []
-				sleepList = []
-				dailyList = []
-				for elem in actData:
-					 if len(elem) > 0:
-						 if elem[0] == "REST":
-							 restList.append(elem)
-						 elif elem[0] == "ACTIVE":
-							 activeList.append(elem)
-						 elif elem[0] == "SLEEP":
-							 sleepList.append(elem)
-						 elif elem[0] == "DAILY":
-							 dailyList.append(elem)
-						 if elem[0] == 'Interval Type':
-							 actHeader = elem
-						 if elem[0] == 'Full Name:':
-							 # or use 'Identity:' if this is the patient identity and not just actigraph
-							 ID = elem[1]
-
-				# Configure date from mm/dd/yy format to mm/dd/yyyy format
-				def date_config(inDate):
-					parts = inDate.split("/")
-					year = "20" + parts[2]
-					newDate = inDate.replace(parts[2], year)
-					return(newDate)
-
-				# Store sleep log information.  Remove header and store in logHeader
-				logHeader = logData[0]
-				logData.pop(0)
-				# Last row empty so remove
-				logData.pop(-1)
-				rowNum = 1
-				while rowNum < len(logData):
-					logData[rowNum][2] = date_config(logData[rowNum][2])
-					rowNum += 1
-
-				# Store all sleep log dates and actigraph dates to use when linking data
-				logDates = []
-				sleepDates = []
-				for row in logData:
-					inDate = row[2]
-					parts = inDate.split("/")
-					logDates.append(int(parts[1]))
-				for row in sleepList:
-					inDate = row[2]
-					parts = inDate.split("/")
-					sleepDates.append(int(parts[1]))
-
-
-				# Create linked database list
-				# Oreder: 0: sleep log data, 1: daily, 2: sleep, 3: rest, 4: active.  Date offset 5
-				#  Matcvh by date.  If either log date or actigraph date missing then fill with N/A
-				dateList = [] 
-				linkList = []
-				i = 0
-				j = 0
-				if len(logDates) >= len(sleepDates):
-					done = len(logDates) - 1
-				else:
-					done = len(sleepDates) - 1
-				skip = 0
-				while done != 0:
-					if (logDates[i] == sleepDates[j]) and skip == 0:
-						linkList.append(logData[i])
-						linkList.append(dailyList[j])
-						linkList.append(sleepList[j])
-						linkList.append(restList[j])
-						linkList.append(activeList[j])
-						dateList.append(logData[i][2])
-						i += 1
-						j += 1
-					elif (logDates[i] < sleepDates[j]) and skip == 0:
-						linkList.append(logData[i])
-						linkList.append(["N/A"])
-						linkList.append(["N/A"])
-						linkList.append(["N/A"])
-						linkList.append(["N/A"])
-						dateList.append(logData[i][2])
-						i += 1
-					elif (logDates[i] < sleepDates[j]) and skip == 1:
-						linkList.append(["N/A"])
-						linkList.append(dailyList[j])
-						linkList.append(sleepList[j])
-						linkList.append(restList[j])
-						linkList.append(activeList[j])
-						dateList.append(dailyList[j][2])
-						j += 1
-					elif (logDates[i] > sleepDates[j]) and skip == 0:
-						linkList.append(["N/A"])
-						linkList.append(dailyList[j])
-						linkList.append(sleepList[j])
-						linkList.append(restList[j])
-						linkList.append(activeList[j])
-						dateList.append(dailyList[j][2])
-						j += 1
-					elif (logDates[i] > sleepDates[j]) and skip == 1:
-						linkList.append(logData[i])
-						linkList.append(["N/A"])
-						linkList.append(["N/A"])
-						linkList.append(["N/A"])
-						linkList.append(["N/A"])
-						dateList.append(logData[i][2])
-						i += 1
-					# Check for end of list for unequal lists
-					if (i == len(logDates)) and (j < len(sleepDates) - 1):
-						i = len(logDates) - 1
-						skip = 1
-						done -= 1
-					elif (j == len(sleepDates)) and (i < len(logDates) - 1):
-						j = len(sleepDates) - 1
-						skip = 1
-						done -= 1
-					else:
-						done -= 1  
-
-				# Define all functions
-				# time builder.  Combines hours, mins, AM/PM into one string
-				def build_time(hr, min, ap):
-					time = hr + ':' + min
-					if ap == '0':
-						time = time + ' AM'
-					elif ap == '1':
-						time = time + ' PM'
-					return(time)
-
-				# Break time into hours, min, sec and remove AM/PM
-				def split_time(timeIn):
-					Tnum = timeIn.split(' ')
-					Tnum = Tnum[0].split(':')
-					hr = int(Tnum[0])
-					min = int(Tnum[1])
-					if len(Tnum) > 2:
-						sec = int(Tnum[2])
-					else: 
-						sec = 0
-					return(hr, min, sec)
-
-				# Calculate differences in two times (td1 - td2)
-				def time_diff(td1, td2):
-					# in date/time format
-					# check for N/A 
-					if (td1 == 'N/A') or (td2 == 'N/A'):
-						return('N/A')
-					
-					temp1 = td1.split(' ')
-					temp2 = td2.split(' ')
-					if len(temp1) > 2:
-						time1 = time_convert(temp1[1] + ' ' + temp1[2])
-						time2 = time_convert(temp2[1] + ' ' + temp2[2])
-					else:
-						time1 = temp1[1]
-						time2 = temp2[1]
-					#print(time1, time2)
-					h1, m1, s1 = split_time(time1)
-					h2, m2, s2 = split_time(time2)
-					date1 = temp1[0].split('/')
-					date2 = temp2[0].split('/')
-					if int(date1[1]) == int(date2[1]):
-						deltaHours = h2 - h1
-					else:
-						dd = int(date2[1]) - int(date1[1])
-						deltaHours = ((h2 - h1) + 24) + ((dd - 1) * 24)
-					# Calculation ignoring seconds at this time
-					Sout = 0
-					Tdiff = abs((deltaHours * 60) + (m2 - m1))
-					if Tdiff // 60 >= 1:
-						Hout = Tdiff // 60
-						Mout = Tdiff - ((Tdiff // 60) * 60)
-					else:
-						Hout = 0
-						Mout = Tdiff
-					timeOut = str(abs(Hout)) + ':' + str(abs(Mout)) + ':' + str(Sout)
-					return(timeOut)
-
-				# Add two times. Return as a string with AM/PM 
-				def time_add(t1, t2):
-					temp1 = t1.split(' ')
-					if len(temp1) > 1:
-						ampm = 1
-						h1, m1, s1 = split_time(temp1[0])
-					else:
-						ampm = 0
-						h1, m1, s1 = split_time(t1)
-					h2, m2, s2 = split_time(t2)
-					ht = h1 + h2
-					mt = m1 + m2
-					if mt >= 60:
-						ht += 1
-						mt = mt - 60
-					if ampm == 1:
-						if (ht == 12) & (temp1[1] == 'PM'):
-							temp1[1] = 'AM'
-						elif (ht > 12) & (temp1[1] == 'PM'):
-							ht = ht - 12
-							temp1[1] = 'AM'
-						outTime = str(ht) + ':' + str(mt) + ':' + '00' + ' ' + temp1[1]
-					else:
-						if ht == 24:
-							ht = 0
-						elif ht > 24:
-							ht = ht - 24
-						outTime = str(ht) + ':' + str(mt) + ':' + '00'
-					return(outTime)
-
-				def time_convert(timeIn):
-					# Converts standard/military time. Assumes time is a string
-					Tformat = timeIn.split(' ')
-					if len(Tformat) > 1:
-						# Standard time
-						Th, Tm, Ts = split_time(timeIn)
-						if Tformat[1] == 'PM':
-							Th = Th + 12
-						timeStr = str(Th) + ':' + str(Tm) + ':' + str(Ts)
-					else:
-						Th, Tm, Ts = split_time(timeIn)
-						if Th > 12:
-							Th = Th - 12
-							Tx = 'PM'
-						elif Th == 12:
-							Tx = 'PM'
-						else:
-							Tx = 'AM'
-						timeStr = str(Th) + ':' + str(Tm) + ':' + str(Ts) + ' ' + Tx
-					return(timeStr)
-
-				# Build date/time format.  Span dates depending on AM/PM.  Use for sleep log 
-				def append_date(Tin, D1, D2):
-					temp = Tin.split(' ')
-					if temp[1] == 'PM':
-						DTout = D1 + ' ' + Tin
-					else:
-						DTout = D2 + ' ' + Tin
-					return(DTout)
-
-				# Main
-				# build dictionary of sleep log data locations
-				logLoc = {}
-				index = 0
-				for elem in logHeader:
-					logLoc.update({elem:index})
-					index += 1
-				#print(' ')
-				#print(logLoc)
-
-				# build dictionary of actigraph data locations
-				actLoc = {}
-				index = 0
-				for elem in actHeader:
-					actLoc.update({elem:index})
-					index += 1
-				#print(' ')
-				#print(actLoc)
-
-				# build output header
-				outHeader = ['SUBJ_ID', 'DATE_START', 'DATE_END', 'LOG_ACTIVE_START', 'ACT_ACTIVE_START', 
-								'DIF_ACTIVE_START', 'LOG_BED_START', 'ACT_BED_START', 'DIF_BED_START',
-								'LOG_SLEEP_START', 'ACT_SLEEP_START', 'DIF_SLEEP_START', 'LOG_SLEEP_END',
-								'ACT_SLEEP_END', 'DIF_SLEEP_END', 'LOG_BED_END', 'ACT_BED_END',
-								'DIF_BED_END', 'LOG_SLEEP_QUALITY']
-				# Log portion
-				logSkip = [logLoc['final_awake_time'], logLoc['bedtime_hr'], logLoc['bedtime_min'], 
-							logLoc['bedtime_am_pm'], logLoc['fall_asleep_hr'], logLoc['fall_asleep_min'],
-							logLoc['try_sleep_hr'], logLoc['try_sleep_min'], logLoc['try_sleep_am_pm'], 
-							logLoc['awake_hr'], logLoc['awake_min'], logLoc['awake_am_pm'], 
-							logLoc['final_awake_time'], logLoc['sleep_quality']]
-				n = 0
-				for elem in logHeader:
-					if n in logSkip:
-						pass
-					else:
-						outHeader.append('log_'+elem)
-					n += 1
-				actSkip = [actLoc['Start Date'], actLoc['Start Time'], actLoc['End Date'], 
-							actLoc['End Time']]
-				for elem in actHeader:
-					if n in actSkip:
-						pass
-					else:
-						outHeader.append('act_'+elem)
-					n += 1
-
-				# Walk through linkList to compute output list
-				# time spans awake day1 through awake day2
-				# sleep logs look ahead to get awake from day2
-				# actigraph looks back one day to get awake time for that day (day1 - 1)
-				outList = []
-				offset = 0
-				dateIndex = 0
-				while offset < len(linkList):
-					rowList = ['Name/ID']
-					if dateIndex < len(dateList) - 1:
-						date1 = dateList[dateIndex]
-						date2 = dateList[dateIndex+1]
-					else:
-						date1 = dateList[dateIndex]
-						date2 = 'N/A'
-					# Walk through sleep log
-					newRow1 = []
-					if len(linkList[offset]) > 1:
-						# For initial awake time make date the same since this is the start of the 
-						# time period and will span midnight
-						newRow1.append(append_date(linkList[offset][logLoc['final_awake_time']], 
-										date1, date1))
-						temp = build_time(linkList[offset][logLoc['bedtime_hr']], 
-											linkList[offset][logLoc['bedtime_min']],
-											linkList[offset][logLoc['bedtime_am_pm']])
-						newRow1.append(append_date(temp, date1, date2))
-						time2 = build_time(linkList[offset][logLoc['fall_asleep_hr']], 
-											linkList[offset][logLoc['fall_asleep_min']], 'null')      
-						time1 = build_time(linkList[offset][logLoc['try_sleep_hr']], 
-											linkList[offset][logLoc['try_sleep_min']], 
-											linkList[offset][logLoc['try_sleep_am_pm']])
-						logSleep = time_add(time1, time2)
-						newRow1.append(append_date(logSleep, date1, date2))
-						if offset + 5 < len(linkList):
-							if len(linkList[offset+5]) > 1:
-								newRow1.append(append_date(linkList[offset+5][logLoc['final_awake_time']],
-															date1, date2))
-								temp = build_time(linkList[offset+5][logLoc['bed_out_hr']], 
-													linkList[offset+5][logLoc['bed_out_min']], 
-													linkList[offset+5][logLoc['bed_out_am_pm']])
-								newRow1.append(append_date(temp, date1, date2))
-								newRow1.append(linkList[offset+5][logLoc['sleep_quality']])
-							else:
-								newRow1.append('N/A')
-								newRow1.append('N/A')
-								newRow1.append('N/A')
-						else:
-							newRow1.append('N/A')
-							newRow1.append('N/A')
-							newRow1.append('N/A')
-					else:
-						newRow1 = ['N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A']
-					#print(newRow1)
-					# Walk through actigraph data
-					newRow2 = []
-					# Check if actigraph data available for the current date
-					if len(linkList[offset+1]) == 1:
-						newRow2 = ['N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A']
-					else:
-						if offset == 0:
-							# Initial date has no previous data
-							newRow2.append('N/A')
-						elif len(linkList[(offset-5)+2]) > 1:
-							newRow2.append(linkList[(offset-5)+2][actLoc['End Date']] + ' ' + 
-											linkList[(offset-5)+2][actLoc['End Time']])
-						else:
-							newRow2.append('N/A')
-						newRow2.append(linkList[offset+3][actLoc['Start Date']] + ' ' + 
-										linkList[offset+3][actLoc['Start Time']])
-						newRow2.append(linkList[offset+2][actLoc['End Date']] + ' ' + 
-										linkList[offset+2][actLoc['End Time']])
-						newRow2.append(linkList[offset+3][actLoc['End Date']] + ' ' + 
-										linkList[offset+3][actLoc['End Time']])
-						newRow2.append('N/A')
-					
-					# Combine rowLists and make calculations
-					# Calculations in columns 3, 6, 9, 12, 15
-					combRow = [ID, date1, date2]
-					for n in range(len(newRow1)-1):
-						combRow.append(newRow1[n])
-						combRow.append(newRow2[n]) 
-						combRow.append(time_diff(newRow1[n], newRow2[n]))
-					combRow.append(newRow1[-1])
-
-					# add remaining log/act data using sleep for act data (sleep offset = 2)
-					n = 0
-					if len(linkList[offset]) > 1:
-						for elem in linkList[offset]:
-							if n in logSkip:
-								pass
-							else:
-								combRow.append(elem)
-							n += 1
-					else:
-						for i in range(len(logHeader) - len(logSkip) + 1):
-							combRow.append(' ')
-					# remaining actigraph data
-					n = 0
-					for elem in linkList[offset+2]:
-						if n in actSkip:
-							pass
-						else:
-							combRow.append(elem)
-						n += 1
-					#print('Combined', combRow)
-					# add new combined row list to outList
-					outList.append(combRow)
-					dateIndex += 1
-					offset += 5
-
-				#for elem in outList:
-				#   print(elem)
-
-				# Write CSV file to read into Excel 
-				fh = open(str(self.dest_folder + '/' + self.out_file.text() + '.csv'), 'w')
-				w = csv.writer(fh, delimiter=',')
-				w.writerow(outHeader)
-				w.writerows(outList[:])
-
-				fh.close()
-
-
-			except:
-				msg = str('\tError aligning data. \n\nPlease ensure that proper actigraphy and sleep ' +
-				 			'log data sets have been selected.')
-				reply = QMessageBox.warning(self, 'Warning!', msg, QMessageBox.Ok)
-
-
+			self.load_engine()
+			self.worker = AlignWorker(self.act_file, self.log_file,
+				str(self.dest_folder + '/' + self.out_file.text() + self.out_format.currentText()),
+				self.cache, self, 'fill' if self.score_missing.isChecked() else None)
+			self.worker.progress.connect(self.show_progress)
+			self.worker.finished_ok.connect(self.run_done)
+			self.worker.cancelled.connect(self.run_cancelled)
+			self.worker.failed.connect(self.run_failed)
+
+			self.btn_run.setEnabled(False)
+			self.btn_cancel.setEnabled(True)
+			self.progress.setRange(0, 0)
+			self.status.setText('Reading data...')
+			self.worker.start()
+
+
+	## cancel button: ask the worker to stop
+	def cancel(self):
+		if self.worker is not None:
+			self.worker.cancel()
+			self.status.setText('Cancelling...')
+
+
+	## updates the progress bar from the worker's progress signal
+	def show_progress(self, stage, count, total):
+		if stage == 'rows':
+			self.status.setText('Read ' + str(count) + ' actigraphy rows')
+		elif stage == 'nights':
+			self.progress.setRange(0, total)
+			self.progress.setValue(count)
+			self.status.setText('Aligned ' + str(count) + ' of ' + str(total) + ' nights')
+		elif stage == 'bytes':
+			self.status.setText('Wrote ' + str(count) + ' bytes')
+
+
+	## puts the buttons back once the worker is done
+	def run_finished(self):
+		self.last_report = self.worker.run_report
+		self.btn_run.setEnabled(True)
+		self.btn_cancel.setEnabled(False)
+		self.btn_report.setEnabled(True)
+		self.worker = None
+
+
+	## report button: shows the last run's report
+	def show_report(self):
+		if self.last_report is None:
+			return
+		box = QMessageBox(QMessageBox.Information, 'Run Report', self.last_report.summary(),
+							QMessageBox.Ok, self)
+		box.setStyleSheet('QLabel {font-family: monospace}')
+		profile = self.last_report.profile_text()
+		if profile:
+			box.setDetailedText(profile)
+		box.exec_()
+
+
+	## preview button: opens the last output file in a table.  Rows are read as they scroll into
+	## view, so large outputs open straight away
+	def show_preview(self):
+		if self.last_output is None:
+			return
+		import SleepPreview
+		try:
+			dialog = SleepPreview.PreviewDialog(self.last_output, self)
+		except Exception as e:
+			QMessageBox.warning(self, 'Warning!', 'Could not open ' + self.last_output + ':\n\n' +
+								str(e), QMessageBox.Ok)
+			return
+		dialog.show()
+
+
+	def run_done(self, nights):
+		self.last_output = self.worker.out_path
+		self.btn_preview.setEnabled(True)
+		self.run_finished()
+		self.progress.setRange(0, 1)
+		self.progress.setValue(1)
+		text = 'Done: ' + str(nights) + ' nights aligned in ' + '%.2f s' % self.last_report.total()
+		if self.last_report.warnings:
+			text += ' (%d warning(s), see Report)' % len(self.last_report.warnings)
+		self.status.setText(text)
+
+
+	def run_cancelled(self):
+		self.run_finished()
+		self.progress.setRange(0, 1)
+		self.progress.setValue(0)
+		self.status.setText('Cancelled')
+
+
+	def run_failed(self, error):
+		problems = self.worker.problems
+		self.run_finished()
+		self.progress.setRange(0, 1)
+		self.progress.setValue(0)
+		self.status.setText('Error: ' + error)
+		msg = str('\tError aligning data. \n\nPlease ensure that proper actigraphy and sleep ' +
+		 			'log data sets have been selected.')
+		## files rejected before parsing: say what is wrong with which file
+		if problems:
+			msg = 'The selected files can not be aligned:\n\n' + '\n'.join(
+				('- ' if p.severity == 'error' else '- (warning) ') + str(p) for p in problems)
+		elif self.last_report.failedStage is not None:
+			msg += '\n\nFailed in ' + self.last_report.failedStage + ': ' + error
+		reply = QMessageBox.warning(self, 'Warning!', msg, QMessageBox.Ok)
+
+
+	## stop a running alignment before the window goes away
+	def closeEvent(self, event):
+		if self.worker is not None:
+			self.worker.cancel()
+			self.worker.wait()
+		event.accept()
+
+
+
+
+## opens the window for 'SleepAligner --startup-probe FILE' (SleepBench.py --startup): writes the
+## time the event loop first runs, with the window up, and the time start up is done (after
+## Window.window_shown) to FILE, then quits.  Zero-time timers run in the order they are started
+def probe_startup(path):
+	times = []
+	QtCore.QTimer.singleShot(0, lambda: times.append(time.time()))
+	window = Window()
+
+	def done():
+		with open(path, 'w') as fh:
+			fh.write('%.6f %.6f\n' % (times[0], time.time()))
+		qApp.quit()
+	QtCore.QTimer.singleShot(0, done)
+	return(window)
 
 
 ## runs program
 if __name__ == '__main__':
 	app = QApplication(sys.argv)
-	ex = Window()
+	if len(sys.argv) == 3 and sys.argv[1] == '--startup-probe':
+		ex = probe_startup(sys.argv[2])
+	else:
+		ex = Window()
 	sys.exit(app.exec_())
\ No newline at end of file
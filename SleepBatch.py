@@ -0,0 +1,366 @@
+## Sleep Aligner batch runner
+## Aligns a whole cohort of subjects without the GUI, one process pool job per subject.
+
+## Usage:
+##   python SleepBatch.py --dir DATA_FOLDER --out OUTPUT_FOLDER [--jobs N]
+##   python SleepBatch.py --manifest pairs.csv --out OUTPUT_FOLDER [--jobs N]
+
+## Directory mode pairs actigraphy and sleep log CSV files by the part of the file name before
+## the first '_' (e.g. 1001_actigraphy.csv and 1001_sleeplog.csv).  Actigraphy files are told
+## apart from sleep logs by looking for the 'Full Name:' / 'Interval Type' rows near the top.
+## Excel workbooks (.xlsx, .xlsm, .xls) are taken as sleep logs.
+## Manifest mode reads a CSV with 'act' and 'log' columns and an optional 'out' column.
+## --format parquet or feather writes typed columnar files instead of CSV (needs pyarrow).
+## --cohort NAME writes all subjects into one dataset, OUTPUT_FOLDER/NAME.<format>, with a
+## subject/date index next to it (see SleepCohort.py).  It is written by one process, without
+## --jobs, --incremental, --report or --profile.
+## --pipeline runs the subjects in one process, reading the next subjects' files and writing the
+## previous outputs while one is aligned (see SleepPipeline.py).  For inputs on slow or network
+## storage, where waiting on files rather than the CPU is what takes the time.
+## Every pair is checked from the top of its files before any subject is aligned (see
+## SleepValidate.py); pairs that can not be aligned are reported as failed up front.  --check only
+## does that check, listing warnings too.
+## --summary adds a multi-night summary table next to each output, <output>.summary.csv (weekly
+## by default, see SleepSummary.py).
+
+
+import os
+import sys
+import csv
+import time
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import SleepEngine
+import SleepExport
+import SleepCache
+import SleepProfile
+import SleepCohort
+import SleepPipeline
+import SleepValidate
+import SleepSummary
+
+
+## number of bytes read from the top of a file when deciding if it is actigraphy data
+SNIFF_BYTES = 65536
+
+## file extensions of input files: actigraphy exports and sleep logs are CSV, sleep logs can also
+## be Excel workbooks
+INPUT_FORMATS = ('.csv',) + SleepEngine.LOG_WORKBOOK_FORMATS
+
+
+## returns True if the file looks like an Actiware actigraphy export: a line starting with
+## 'Full Name:' or 'Interval Type,' near the top.  Aligned outputs (their act_Interval Type
+## column) and sleep logs do not match
+def is_actigraphy(path):
+	if os.path.splitext(path)[1].lower() in SleepEngine.LOG_WORKBOOK_FORMATS:
+		return(False)
+	with open(path, 'rb') as fh:
+		head = fh.read(SNIFF_BYTES)
+	return(SleepExport.find_line(head, SleepExport.FULL_NAME + SleepExport.STATS_HEADER) != -1)
+
+
+## returns True if the file is an aligned output (its first cell is SUBJ_ID), which is neither
+## kind of input
+def is_output(path):
+	if os.path.splitext(path)[1].lower() in SleepEngine.LOG_WORKBOOK_FORMATS:
+		return(False)
+	with open(path, 'rb') as fh:
+		head = fh.read(16)
+	return(head.startswith((b'SUBJ_ID,', b'"SUBJ_ID",')))
+
+
+## subject key of a data file name: the part before the first '_'
+def subject_key(name):
+	return(os.path.splitext(os.path.basename(name))[0].split('_')[0])
+
+
+## pairs actigraphy and sleep log files in a folder by subject key
+def pairs_from_dir(folder):
+	acts = {}
+	logs = {}
+	for name in sorted(os.listdir(folder)):
+		path = os.path.join(folder, name)
+		# ~$name.xlsx is the lock file of a workbook open in Excel
+		if (os.path.splitext(name)[1].lower() not in INPUT_FORMATS or name.startswith('~$') or
+				not os.path.isfile(path)):
+			continue
+		if is_output(path):
+			continue
+		key = subject_key(name)
+		if is_actigraphy(path):
+			acts[key] = path
+		else:
+			logs[key] = path
+
+	jobs = []
+	missing = []
+	for key in sorted(set(acts) | set(logs)):
+		if key in acts and key in logs:
+			jobs.append((key, acts[key], logs[key], None))
+		else:
+			missing.append(key)
+	return(jobs, missing)
+
+
+## reads (act, log, out) file triples from a manifest CSV
+def pairs_from_manifest(manifest):
+	jobs = []
+	base = os.path.dirname(os.path.abspath(manifest))
+	with open(manifest, 'r', newline='') as fh:
+		for row in csv.DictReader(fh):
+			act = os.path.join(base, row['act'])
+			log = os.path.join(base, row['log'])
+			out = row.get('out') or None
+			if out:
+				out = os.path.join(base, out)
+			key = subject_key(act)
+			jobs.append((key, act, log, out))
+	return(jobs)
+
+
+## checks the input files of (key, act, log, out) jobs.  Returns (good jobs, results of the
+## rejected ones); results are align_job() style (key, False, message, seconds, report dictionary)
+def check_jobs(jobs):
+	good = []
+	rejected = []
+	for job in jobs:
+		key, act, log, out = job
+		report = SleepProfile.RunReport()
+		report.info.update({'subject': key, 'act_file': act, 'log_file': log, 'out_file': out})
+		try:
+			with report.stage('validate'):
+				SleepValidate.validate(act, log)
+		except SleepValidate.InputError:
+			report.finish()
+			rejected.append((key, False, report.error, report.total(), report.as_dict()))
+		else:
+			good.append(job)
+	return(good, rejected)
+
+
+## prints every problem found in each job's input files.  Returns the number of pairs that can
+## not be aligned
+def check_batch(jobs, stream=sys.stdout):
+	failed = 0
+	for key, act, log, out in jobs:
+		problems = SleepValidate.check_inputs(act, log)
+		errors = [p for p in problems if p.severity == 'error']
+		failed += bool(errors)
+		stream.write('%s  %-20s %s\n' % ('FAIL' if errors else 'OK  ', key,
+						'%d problem(s)' % len(errors) if errors else 'ready to align'))
+		for problem in problems:
+			stream.write('      %-7s %-15s %s\n' % (problem.severity, problem.code, problem))
+	stream.write('\n%d subject(s), %d ready, %d with problems\n' % (len(jobs), len(jobs) - failed,
+					failed))
+	return(failed)
+
+
+## worker: aligns one subject.  Returns (key, ok, message, seconds, report dictionary)
+def align_job(job):
+	key, act, log, out, cacheDir, incremental, profile, scoring = job
+	report = SleepProfile.RunReport(profile)
+	report.info.update({'subject': key, 'act_file': act, 'log_file': log, 'out_file': out})
+	start = time.perf_counter()
+	try:
+		if cacheDir:
+			cache = SleepCache.ParseCache(cacheDir)
+		else:
+			cache = None
+		if incremental:
+			SleepEngine.align_incremental(act, log, out, cache=cache, report=report, scoring=scoring)
+		else:
+			SleepEngine.align_files(act, log, out, cache=cache, report=report, scoring=scoring)
+	except Exception as e:
+		report.finish()
+		if report.error is None:
+			report.error = '%s: %s' % (type(e).__name__, e)
+		return(key, False, report.error, time.perf_counter() - start, report.as_dict())
+	return(key, True, out, time.perf_counter() - start, report.as_dict())
+
+
+## aligns every job with a process pool and prints one line per subject.  Returns failure count
+## cacheDir is an optional SleepCache folder shared by all workers
+## incremental only adds nights that are not in the existing output files yet
+## reportPath, if given, gets a JSON run report (stage timings and counters per subject);
+## profile adds a cProfile capture to each subject's report
+## fmt is the output file type for jobs without an 'out' file: csv, parquet or feather
+## scoring ('fill' or 'replace') takes actigraphy intervals from epoch scoring (SleepScore.py)
+## depth > 0 uses SleepPipeline.run_pipeline() in this process instead of the pool (workers
+## and incremental are not used then)
+## summary is a list of SleepSummary windows: each output gets a summary table next to it, made
+## here while the workers align the next subjects
+def run_batch(jobs, outDir, workers=None, stream=sys.stdout, cacheDir=None, incremental=False,
+				reportPath=None, profile=False, fmt='csv', scoring=None, depth=0, summary=None):
+	jobs = [(key, act, log, out or os.path.join(outDir, key + '.' + fmt)) for key, act, log, out in jobs]
+	os.makedirs(outDir, exist_ok=True)
+
+	failed = 0
+	reports = []
+	start = time.perf_counter()
+	jobs, rejected = check_jobs(jobs)
+	for key, ok, msg, secs, report in rejected:
+		reports.append(report)
+		failed += 1
+		stream.write('FAIL  %-20s %7.2fs  %s\n' % (key, secs, msg))
+	pool = None
+	if depth > 0:
+		results = SleepPipeline.run_pipeline(jobs, depth, cacheDir, scoring, profile)
+	else:
+		pool = ProcessPoolExecutor(max_workers=workers)
+		results = pool.map(align_job, [job + (cacheDir, incremental, profile, scoring) for job in jobs])
+	try:
+		for key, ok, msg, secs, report in results:
+			reports.append(report)
+			if ok and summary:
+				ok, msg, secs = summarize_job(msg, summary, secs, report)
+			if ok:
+				stream.write('OK    %-20s %7.2fs  %s\n' % (key, secs, msg))
+			else:
+				failed += 1
+				stream.write('FAIL  %-20s %7.2fs  %s\n' % (key, secs, msg))
+			stream.flush()
+	finally:
+		if pool is not None:
+			pool.shutdown()
+	wall = time.perf_counter() - start
+	stream.write('\n%d subject(s), %d aligned, %d failed, wall time %.2fs\n' %
+					(len(reports), len(reports) - failed, failed, wall))
+	if reportPath:
+		write_report(reportPath, reports, wall)
+	return(failed)
+
+
+# writes the summary of a finished job's output, timed into its report dictionary.  Returns
+# (ok, message, seconds)
+def summarize_job(outPath, windows, secs, report):
+	start = time.perf_counter()
+	ok = True
+	msg = outPath
+	try:
+		SleepSummary.write_summary(outPath, windows)
+	except Exception as e:
+		ok = False
+		msg = '%s: %s' % (type(e).__name__, e)
+		report.update({'ok': False, 'error': msg, 'failed_stage': 'summary'})
+	report['stages']['summary'] = time.perf_counter() - start
+	return(ok, msg, secs + report['stages']['summary'])
+
+
+## aligns every job into one cohort dataset, outDir/name.fmt.  Returns failure count
+## summary is a list of SleepSummary windows for a summary of every subject and the cohort
+def run_cohort(jobs, outDir, name, fmt='csv', stream=sys.stdout, cacheDir=None, scoring=None,
+				depth=0, summary=None):
+	os.makedirs(outDir, exist_ok=True)
+	outPath = os.path.join(outDir, name + '.' + fmt)
+	cache = SleepCache.ParseCache(cacheDir) if cacheDir else None
+
+	def show(key, ok, msg):
+		stream.write('%s  %-20s %s\n' % ('OK  ' if ok else 'FAIL', key, msg))
+
+	start = time.perf_counter()
+	jobs, rejected = check_jobs(jobs)
+	for key, ok, msg, secs, report in rejected:
+		show(key, ok, msg)
+	rows, failed = SleepCohort.write_cohort([job[:3] for job in jobs], outPath, cache, show, scoring,
+													depth)
+	failed = len(failed) + len(rejected)
+	if summary and rows:
+		stream.write('Summary in %s\n' % SleepSummary.write_summary(outPath, summary))
+	stream.write('\n%d subject(s), %d aligned, %d failed, %d rows in %s, wall time %.2fs\n' %
+					(len(jobs) + len(rejected), len(jobs) + len(rejected) - failed, failed, rows,
+					outPath, time.perf_counter() - start))
+	return(failed)
+
+
+## writes the JSON run report: per subject reports plus stage and counter totals
+def write_report(path, reports, wall):
+	stages = {}
+	counters = {}
+	for report in reports:
+		for name, secs in report['stages'].items():
+			stages[name] = stages.get(name, 0.0) + secs
+		for name, value in report['counters'].items():
+			counters[name] = counters.get(name, 0) + value
+	out = {'wall_seconds': wall, 'subjects': len(reports),
+			'failed': sum(1 for report in reports if not report['ok']),
+			'stage_totals': stages, 'counter_totals': counters, 'runs': reports}
+	with open(path, 'w') as fh:
+		json.dump(out, fh, indent=2)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Align actigraphy and sleep log data for many subjects')
+	src = parser.add_mutually_exclusive_group(required=True)
+	src.add_argument('--dir', help='folder of actigraphy and sleep log CSV files')
+	src.add_argument('--manifest', help="CSV with 'act', 'log' and optional 'out' columns")
+	parser.add_argument('--out', help='destination folder for aligned files (not needed with --check)')
+	parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all cores)')
+	parser.add_argument('--cache', nargs='?', const=SleepCache.DEFAULT_FOLDER, default=None,
+						help='reuse parsed input files from this cache folder (default: %s)' %
+						SleepCache.DEFAULT_FOLDER)
+	parser.add_argument('--incremental', action='store_true',
+						help='only align nights missing from existing output files')
+	parser.add_argument('--report', help='write a JSON run report (stage timings, counters) to this file')
+	parser.add_argument('--profile', action='store_true', help='add a cProfile capture to the run report')
+	parser.add_argument('--format', choices=('csv', 'parquet', 'feather'), default='csv',
+						help='output file type (parquet and feather need pyarrow)')
+	parser.add_argument('--scoring', choices=('fill', 'replace'), default=None,
+						help='score sleep/wake from epoch data for nights without Actiware intervals '
+						'(fill) or for every night (replace); needs numpy')
+	parser.add_argument('--cohort', metavar='NAME',
+						help='write all subjects into one dataset NAME.<format> with a subject/date index')
+	parser.add_argument('--pipeline', type=int, nargs='?', const=SleepPipeline.DEPTH, default=0,
+						metavar='DEPTH',
+						help='overlap reading, aligning and writing subjects in one process, with up to '
+						'DEPTH subjects queued between stages (default: %d); for slow storage' %
+						SleepPipeline.DEPTH)
+	parser.add_argument('--summary', type=SleepSummary.parse_windows, nargs='?',
+						const=list(SleepSummary.DEFAULT_WINDOWS), default=None,
+						metavar='WINDOWS',
+						help="also write a multi-night summary next to each output, over windows of "
+						"this many days: 'LENGTH' or 'LENGTH/STEP' for rolling windows, comma "
+						"separated (default: 7, weekly)")
+	parser.add_argument('--check', action='store_true',
+						help='only check that each pair of input files can be aligned, and list any '
+						'problems')
+	args = parser.parse_args(argv)
+	if not args.out and not args.check:
+		parser.error('--out is required')
+	if args.pipeline and args.incremental:
+		parser.error('--pipeline can not be used with --incremental')
+	if args.cohort:
+		# a cohort is written by one process in one pass, without per subject run reports
+		unused = [name for name, given in (('--incremental', args.incremental), ('--report', args.report),
+											('--profile', args.profile), ('--jobs', args.jobs is not None))
+					if given]
+		if unused:
+			parser.error('--cohort can not be used with %s' % ', '.join(unused))
+
+	if args.dir:
+		jobs, missing = pairs_from_dir(args.dir)
+		for key in missing:
+			sys.stdout.write('SKIP  %-20s no matching actigraphy/sleep log pair\n' % key)
+	else:
+		jobs = pairs_from_manifest(args.manifest)
+
+	if not jobs:
+		sys.stdout.write('No actigraphy/sleep log pairs found\n')
+		return(1)
+	if args.check:
+		return(1 if check_batch(jobs) else 0)
+	if args.cohort:
+		return(1 if run_cohort(jobs, args.out, args.cohort, args.format, cacheDir=args.cache,
+								scoring=args.scoring, depth=args.pipeline, summary=args.summary) else 0)
+	return(1 if run_batch(jobs, args.out, args.jobs, cacheDir=args.cache,
+								incremental=args.incremental, reportPath=args.report,
+								profile=args.profile, fmt=args.format, scoring=args.scoring,
+								depth=args.pipeline, summary=args.summary) else 0)
+
+
+## runs program
+if __name__ == '__main__':
+	multiprocessing.freeze_support()
+	sys.exit(main())
@@ -0,0 +1,346 @@
+## Sleep Aligner benchmark
+## Generates synthetic Actiware-style actigraphy exports and sleep log CSVs, then times each stage
+## of the alignment engine: parse, join, time math / row building and write.
+
+## Usage:
+##   python SleepBench.py [--subjects 4] [--nights 90] [--gap-rate 0.05] [--repeat 3]
+##                        [--save results.json] [--compare baseline.json] [--tolerance 0.25]
+
+## --save writes the stage timings to a JSON file; --compare checks the run against a saved file
+## and exits with status 1 if any stage got slower than the tolerance allows.
+
+## --startup times the SleepAligner window instead: seconds from launch until the window is shown
+## ('window') and until the engine is loaded behind it ('ready').  It launches SleepAligner.py with
+## this Python, or with --exe the frozen cx_Freeze build, e.g.
+##   python SleepBench.py --startup --save startup.json
+##   python SleepBench.py --startup --exe build/exe.win-amd64-3.11/SleepAligner.exe
+## The generators can also be used on their own to make test data:
+##   SleepBench.make_subject(folder, 'S001', nights=30)
+
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import subprocess
+import tracemalloc
+
+import SleepEngine
+
+
+ACT_HEADER = ['Interval Type', 'Interval#', 'Start Date', 'Start Time', 'End Date', 'End Time',
+				'Duration', 'Off-Wrist', '%Off-Wrist', 'Total AC', 'Avg AC/min', 'Max AC',
+				'Onset Latency', 'Efficiency', 'WASO', 'Wake Time', '%Wake', 'Sleep Time', '%Sleep',
+				'#Wake Bouts', 'Avg Wake B.', '#Sleep Bouts', 'Avg Sleep B.']
+
+EPOCH_HEADER = ['Line', 'Date', 'Time', 'Off-Wrist Status', 'Activity', 'Marker', 'White Light',
+				'Red Light', 'Green Light', 'Blue Light', 'Sleep/Wake', 'Interval Status']
+
+LOG_HEADER = ['subject', 'entry', 'date', 'final_awake_time', 'bedtime_hr', 'bedtime_min',
+				'bedtime_am_pm', 'fall_asleep_hr', 'fall_asleep_min', 'try_sleep_hr', 'try_sleep_min',
+				'try_sleep_am_pm', 'awake_hr', 'awake_min', 'awake_am_pm', 'bed_out_hr', 'bed_out_min',
+				'bed_out_am_pm', 'sleep_quality', 'naps', 'caffeine', 'alcohol', 'comments']
+
+STAGES = ['parse', 'join', 'rows', 'write']
+
+# seconds a launched window gets to show up
+STARTUP_TIMEOUT = 60
+
+
+# m/d/yyyy
+def act_date(dt):
+	return(str(dt.month) + '/' + str(dt.day) + '/' + str(dt.year))
+
+
+# h:mm:ss AM/PM
+def act_time(dt):
+	return('%d:%02d:%02d %s' % (dt.hour % 12 or 12, dt.minute, dt.second, 'AM' if dt.hour < 12 else 'PM'))
+
+
+# hour, minute and am/pm ('0'/'1') fields as sleep logs store them
+def log_clock(dt):
+	return([str(dt.hour % 12 or 12), str(dt.minute), '1' if dt.hour >= 12 else '0'])
+
+
+## one synthetic night: rest, sleep and wake times around a bedtime near 10:30 PM
+def make_night(rnd, day):
+	bed = datetime.datetime.combine(day, datetime.time(22, 30)) + datetime.timedelta(minutes=rnd.randint(-90, 90))
+	sleepStart = bed + datetime.timedelta(minutes=rnd.randint(5, 45))
+	sleepEnd = sleepStart + datetime.timedelta(minutes=rnd.randint(330, 510))
+	restEnd = sleepEnd + datetime.timedelta(minutes=rnd.randint(1, 25))
+	return(bed, sleepStart, sleepEnd, restEnd)
+
+
+## writes an Actiware-style export and a sleep log CSV for one subject
+## nights are consecutive from start; each night is dropped from the log or the actigraphy with
+## probability gapRate.  epochSeconds=0 leaves out the epoch-by-epoch section
+## returns (actPath, logPath)
+def make_subject(folder, subject, nights=90, start=datetime.date(2017, 6, 12), gapRate=0.0,
+					epochSeconds=30, seed=None):
+	rnd = random.Random(subject if seed is None else seed)
+	actPath = os.path.join(folder, subject + '_actigraphy.csv')
+	logPath = os.path.join(folder, subject + '_sleeplog.csv')
+
+	stats = {'ACTIVE': [], 'REST': [], 'SLEEP': [], 'DAILY': []}
+	logRows = []
+	prevWake = None
+	for k in range(nights):
+		day = start + datetime.timedelta(days=k)
+		bed, sleepStart, sleepEnd, restEnd = make_night(rnd, day)
+
+		if rnd.random() >= gapRate:
+			n = str(len(stats['SLEEP']) + 1)
+			if prevWake is None:
+				prevWake = datetime.datetime.combine(day, datetime.time(7, 0))
+			dayStart = datetime.datetime.combine(day, datetime.time(0, 0))
+			for kind, s, e in (('ACTIVE', prevWake, bed), ('REST', bed, restEnd),
+								('SLEEP', sleepStart, sleepEnd),
+								('DAILY', dayStart, dayStart + datetime.timedelta(hours=23, minutes=59, seconds=30))):
+				minutes = int((e - s).total_seconds() // 60)
+				sleepMin = rnd.randint(300, 480)
+				stats[kind].append([kind, n, act_date(s), act_time(s), act_date(e), act_time(e),
+									str(minutes), '0', '0.00', str(rnd.randint(1000, 90000)),
+									'%.2f' % (rnd.random() * 300), str(rnd.randint(300, 1500)),
+									str(rnd.randint(0, 40)), '%.2f' % (rnd.random() * 100),
+									str(rnd.randint(0, 90)), str(rnd.randint(0, 90)),
+									'%.2f' % (rnd.random() * 20), str(sleepMin), '%.2f' % (rnd.random() * 100),
+									str(rnd.randint(0, 30)), '%.2f' % rnd.random(), str(rnd.randint(0, 30)),
+									'%.2f' % (rnd.random() * 20)])
+
+		if rnd.random() >= gapRate:
+			wake = datetime.datetime.combine(day, datetime.time(6, 30)) + datetime.timedelta(minutes=rnd.randint(0, 90))
+			tryAt = bed + datetime.timedelta(minutes=rnd.randint(0, 20))
+			bedOut = wake + datetime.timedelta(minutes=rnd.randint(0, 30))
+			logRows.append([subject, str(k + 1), '%d/%d/%02d' % (day.month, day.day, day.year % 100),
+							'%d:%02d %s' % (wake.hour % 12 or 12, wake.minute, 'AM' if wake.hour < 12 else 'PM')] +
+							log_clock(bed) + ['0', str(rnd.randint(2, 45))] + log_clock(tryAt) +
+							log_clock(wake) + log_clock(bedOut) +
+							[str(rnd.randint(1, 5)), str(rnd.randint(0, 2)), str(rnd.randint(0, 4)),
+							str(rnd.randint(0, 3)), ''])
+		prevWake = restEnd
+
+	with open(actPath, 'w', newline='') as fh:
+		w = csv.writer(fh)
+		w.writerows([['Actiware Data Export'], ['Actiware Version', '6.0.9'], [],
+						['Full Name:', subject], ['Identity:', subject], ['Gender:', ''],
+						['Date of Birth:', ''], ['Epoch Length:', str(epochSeconds)], [],
+						['-------------------- Statistics --------------------'], ACT_HEADER])
+		for kind in ('ACTIVE', 'REST', 'SLEEP', 'DAILY'):
+			w.writerows(stats[kind])
+		w.writerows([[], ['-------------------- Marker/Score List --------------------'],
+						['Marker #', 'Date', 'Time', 'Marker Type'], []])
+		if epochSeconds:
+			w.writerow(['-------------------- Epoch-by-Epoch Data --------------------'])
+			w.writerow(EPOCH_HEADER)
+			write_epochs(w, rnd, start, nights, epochSeconds)
+
+	with open(logPath, 'w', newline='') as fh:
+		w = csv.writer(fh)
+		w.writerow(LOG_HEADER)
+		w.writerows(logRows)
+		# sleep log exports end with an empty row
+		w.writerow([''] * len(LOG_HEADER))
+	return(actPath, logPath)
+
+
+# epoch-by-epoch rows: low activity at night, higher during the day
+def write_epochs(w, rnd, start, nights, epochSeconds):
+	t = datetime.datetime.combine(start, datetime.time(12, 0))
+	step = datetime.timedelta(seconds=epochSeconds)
+	line = 0
+	dateStr = act_date(t)
+	for n in range((nights * 86400) // epochSeconds):
+		line += 1
+		asleep = t.hour < 6 or t.hour >= 23
+		if asleep:
+			activity = rnd.randint(0, 8) if rnd.random() < 0.9 else rnd.randint(20, 120)
+		else:
+			activity = rnd.randint(40, 600)
+		if t.hour == 0 and t.minute == 0 and t.second == 0:
+			dateStr = act_date(t)
+		w.writerow([line, dateStr, act_time(t), 0, activity, 0, '%.2f' % (0 if asleep else rnd.random() * 900),
+					'', '', '', 0 if asleep and activity < 20 else 1, 'REST' if asleep else 'ACTIVE'])
+		t += step
+
+
+## writes subjects S001..Snnn into folder.  Returns [(subject, actPath, logPath)]
+def make_cohort(folder, subjects=4, nights=90, gapRate=0.05, epochSeconds=30):
+	os.makedirs(folder, exist_ok=True)
+	out = []
+	for n in range(subjects):
+		subject = 'S%03d' % (n + 1)
+		# spread start dates so studies cross month and year boundaries
+		start = datetime.date(2017, 11, 1) + datetime.timedelta(days=n * 11)
+		actPath, logPath = make_subject(folder, subject, nights, start, gapRate, epochSeconds)
+		out.append((subject, actPath, logPath))
+	return(out)
+
+
+## times each stage for one subject.  Returns {stage: seconds}, best of repeat runs
+def time_subject(actPath, logPath, outPath, repeat=3):
+	best = {}
+	for r in range(repeat):
+		t0 = time.perf_counter()
+		ID, actHeader, restList, activeList, sleepList, dailyList = SleepEngine.read_actigraphy(actPath)
+		logHeader, logData = SleepEngine.read_log(logPath)
+		t1 = time.perf_counter()
+		nights = SleepEngine.link_nights(logData, restList, activeList, sleepList, dailyList)
+		t2 = time.perf_counter()
+		outHeader, outList = SleepEngine.build_rows(ID, logHeader, actHeader, nights)
+		t3 = time.perf_counter()
+		SleepEngine.write_csv(outPath, outHeader, outList)
+		t4 = time.perf_counter()
+		for stage, secs in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+			best[stage] = min(best.get(stage, secs), secs)
+	return(best, len(outList))
+
+
+## peak traced memory (bytes) of one full align_files run
+def peak_memory(actPath, logPath, outPath):
+	tracemalloc.start()
+	try:
+		SleepEngine.align_files(actPath, logPath, outPath)
+		current, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return(peak)
+
+
+## runs the benchmark over a generated cohort.  Returns the results dictionary
+def run_bench(folder, subjects, nights, gapRate, epochSeconds, repeat, stream=sys.stdout):
+	stream.write('Generating %d subject(s) x %d nights...\n' % (subjects, nights))
+	cohort = make_cohort(folder, subjects, nights, gapRate, epochSeconds)
+	inBytes = sum(os.path.getsize(a) + os.path.getsize(l) for s, a, l in cohort)
+
+	totals = dict((stage, 0.0) for stage in STAGES)
+	rows = 0
+	peak = 0
+	for subject, actPath, logPath in cohort:
+		outPath = os.path.join(folder, subject + '_aligned.csv')
+		best, count = time_subject(actPath, logPath, outPath, repeat)
+		for stage in STAGES:
+			totals[stage] += best[stage]
+		rows += count
+		peak = max(peak, peak_memory(actPath, logPath, outPath))
+
+	total = sum(totals.values())
+	results = {'subjects': subjects, 'nights': nights, 'gap_rate': gapRate,
+				'epoch_seconds': epochSeconds, 'input_bytes': inBytes, 'rows': rows,
+				'stages': totals, 'total': total, 'peak_memory': peak,
+				'nights_per_second': rows / total if total else 0.0,
+				'input_mb_per_second': (inBytes / 1e6) / total if total else 0.0}
+
+	stream.write('\n%-8s %10s %8s\n' % ('stage', 'seconds', 'share'))
+	for stage in STAGES:
+		stream.write('%-8s %10.4f %7.1f%%\n' % (stage, totals[stage], 100.0 * totals[stage] / total if total else 0))
+	stream.write('%-8s %10.4f\n\n' % ('total', total))
+	stream.write('%d rows, %.0f nights/s, %.1f MB input/s, peak memory %.1f MB per subject\n' %
+					(rows, results['nights_per_second'], results['input_mb_per_second'], peak / 1e6))
+	return(results)
+
+
+## seconds from launching command until its window is shown and until its engine is loaded, read
+## from the file SleepAligner.py writes when launched with --startup-probe FILE.  Best of repeat
+## launches
+def time_startup(command, repeat=3):
+	best = {}
+	with tempfile.TemporaryDirectory() as folder:
+		stampPath = os.path.join(folder, 'startup.txt')
+		for r in range(repeat):
+			if os.path.exists(stampPath):
+				os.remove(stampPath)
+			t0 = time.time()
+			subprocess.run(command + ['--startup-probe', stampPath], timeout=STARTUP_TIMEOUT, check=True)
+			with open(stampPath, 'r') as fh:
+				shown, ready = [float(x) for x in fh.read().split()]
+			for stage, secs in (('window', shown - t0), ('ready', ready - t0)):
+				best[stage] = min(best.get(stage, secs), secs)
+	return(best)
+
+
+## times the window start up of SleepAligner.py, or of the frozen executable exe.  Returns the
+## results dictionary
+def run_startup(exe, repeat, stream=sys.stdout):
+	if exe:
+		command = [os.path.abspath(exe)]
+	else:
+		command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SleepAligner.py')]
+	stream.write('Starting %s %d time(s)...\n' % (' '.join(command), repeat))
+	best = time_startup(command, repeat)
+	results = {'startup': 'frozen' if exe else 'script', 'stages': best, 'total': best['ready']}
+
+	stream.write('\n%-8s %10s\n' % ('stage', 'seconds'))
+	for stage in ('window', 'ready'):
+		stream.write('%-8s %10.4f\n' % (stage, best[stage]))
+	return(results)
+
+
+## compares results with a saved baseline.  Returns the list of stages that regressed
+def compare(results, baseline, tolerance, stream=sys.stdout):
+	slower = []
+	stream.write('\n%-8s %10s %10s %8s\n' % ('stage', 'baseline', 'now', 'change'))
+	for stage in list(results['stages']) + ['total']:
+		if stage == 'total':
+			old = baseline['total']
+			new = results['total']
+		else:
+			old = baseline['stages'].get(stage)
+			new = results['stages'][stage]
+		if not old:
+			continue
+		change = (new - old) / old
+		flag = ''
+		if change > tolerance:
+			flag = '  SLOWER'
+			slower.append(stage)
+		stream.write('%-8s %10.4f %10.4f %+7.1f%%%s\n' % (stage, old, new, change * 100, flag))
+	return(slower)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark the sleep alignment engine on synthetic data')
+	parser.add_argument('--subjects', type=int, default=4)
+	parser.add_argument('--nights', type=int, default=90)
+	parser.add_argument('--gap-rate', type=float, default=0.05,
+						help='chance that a night is missing from the log or the actigraphy')
+	parser.add_argument('--epoch-seconds', type=int, default=30, help='0 leaves out epoch data')
+	parser.add_argument('--repeat', type=int, default=3, help='timed runs per subject (best is kept)')
+	parser.add_argument('--data', help='folder for generated files (default: temporary folder)')
+	parser.add_argument('--save', help='write results to this JSON file')
+	parser.add_argument('--compare', help='baseline JSON file from an earlier --save')
+	parser.add_argument('--tolerance', type=float, default=0.25,
+						help='allowed slowdown against the baseline (0.25 = 25%%)')
+	parser.add_argument('--startup', action='store_true',
+						help='time the window start up instead of the engine')
+	parser.add_argument('--exe', help='with --startup: frozen SleepAligner executable to time')
+	args = parser.parse_args(argv)
+
+	if args.startup:
+		results = run_startup(args.exe, args.repeat)
+	elif args.data:
+		results = run_bench(args.data, args.subjects, args.nights, args.gap_rate, args.epoch_seconds,
+							args.repeat)
+	else:
+		with tempfile.TemporaryDirectory() as folder:
+			results = run_bench(folder, args.subjects, args.nights, args.gap_rate, args.epoch_seconds,
+								args.repeat)
+
+	if args.save:
+		with open(args.save, 'w') as fh:
+			json.dump(results, fh, indent=2)
+	if args.compare:
+		with open(args.compare, 'r') as fh:
+			baseline = json.load(fh)
+		if compare(results, baseline, args.tolerance):
+			return(1)
+	return(0)
+
+
+## runs program
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,144 @@
+## Sleep Aligner parsed-input cache
+## Keeps the parsed actigraphy statistics (ID, header, REST/ACTIVE/SLEEP/DAILY rows) and parsed
+## sleep log tables on disk, so re-running the same subject skips CSV parsing.
+
+## Entries are keyed by a SHA-1 of the file contents.  A small index maps each file path, size
+## and modification time to its hash, so an unchanged file is found without re-hashing it.  A
+## touched or copied file with the same contents still hits the cache after one re-hash.
+## Entries are zlib compressed pickles.  When the folder grows past maxBytes the least recently
+## used entries are removed.
+
+## Usage:
+##   cache = SleepCache.ParseCache()
+##   SleepEngine.align_files(actFile, logFile, outPath, cache=cache)
+
+
+import os
+import json
+import zlib
+import pickle
+import hashlib
+
+import SleepEngine
+
+
+## bump when SleepEngine's parsed output changes so old entries are ignored
+CACHE_VERSION = 3
+
+DEFAULT_FOLDER = os.path.join(os.path.expanduser('~'), '.sleepaligner_cache')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+HASH_CHUNK = 1024 * 1024
+
+
+class ParseCache(object):
+	def __init__(self, folder=None, maxBytes=DEFAULT_MAX_BYTES):
+		if folder is None:
+			folder = os.environ.get('SLEEPALIGNER_CACHE', DEFAULT_FOLDER)
+		self.folder = folder
+		self.maxBytes = maxBytes
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(folder, exist_ok=True)
+
+
+	## parsed actigraphy file, same result as SleepEngine.read_actigraphy()
+	def read_actigraphy(self, path, progress=None):
+		return(self.get(path, 'act', lambda: SleepEngine.read_actigraphy(path, progress)))
+
+
+	## parsed sleep log file, same result as SleepEngine.read_log()
+	def read_log(self, path):
+		return(self.get(path, 'log', lambda: SleepEngine.read_log(path)))
+
+
+	## returns the cached entry of this kind for path, or calls parse() and stores its result
+	def get(self, path, kind, parse):
+		digest = self.file_hash(path)
+		entry = os.path.join(self.folder, '%s-%s-v%d.bin' % (digest, kind, CACHE_VERSION))
+		try:
+			with open(entry, 'rb') as fh:
+				data = pickle.loads(zlib.decompress(fh.read()))
+		except (OSError, EOFError, zlib.error, pickle.UnpicklingError):
+			data = None
+		if data is not None:
+			self.hits += 1
+			# mark as recently used
+			os.utime(entry)
+			return(data)
+
+		self.misses += 1
+		data = parse()
+		self.store(entry, zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+		self.evict()
+		return(data)
+
+
+	## content hash of a file, taken from the index if path, size and mtime are unchanged
+	def file_hash(self, path):
+		path = os.path.abspath(path)
+		st = os.stat(path)
+		index = self.load_index()
+		known = index.get(path)
+		if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+			return(known[2])
+
+		sha = hashlib.sha1()
+		with open(path, 'rb') as fh:
+			for chunk in iter(lambda: fh.read(HASH_CHUNK), b''):
+				sha.update(chunk)
+		digest = sha.hexdigest()
+		index[path] = [st.st_size, st.st_mtime_ns, digest]
+		self.store(self.index_path(), json.dumps(index).encode('utf-8'))
+		return(digest)
+
+
+	def index_path(self):
+		return(os.path.join(self.folder, 'index.json'))
+
+
+	def load_index(self):
+		try:
+			with open(self.index_path(), 'r') as fh:
+				return(json.load(fh))
+		except (OSError, ValueError):
+			return({})
+
+
+	# writes through a temporary file so other processes never see half an entry
+	def store(self, path, data):
+		tmpPath = '%s.%d.tmp' % (path, os.getpid())
+		with open(tmpPath, 'wb') as fh:
+			fh.write(data)
+		os.replace(tmpPath, path)
+
+
+	## removes least recently used entries until the cache fits in maxBytes
+	def evict(self):
+		entries = []
+		total = 0
+		for name in os.listdir(self.folder):
+			if name.endswith('.bin'):
+				path = os.path.join(self.folder, name)
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				entries.append((st.st_mtime, st.st_size, path))
+				total += st.st_size
+		entries.sort()
+		for mtime, size, path in entries:
+			if total <= self.maxBytes:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+
+
+	## removes every entry and the index
+	def clear(self):
+		for name in os.listdir(self.folder):
+			if name.endswith('.bin') or name == 'index.json':
+				os.remove(os.path.join(self.folder, name))
@@ -0,0 +1,261 @@
+## Sleep Aligner cohort dataset
+## Aligns every subject of a cohort into one dataset file instead of one file per subject.
+## Subjects whose sleep log or actigraphy exports have different columns are mapped onto one
+## unified header: the fixed alignment columns, then every log_ column and every act_ column seen
+## in any subject, in first seen order.  Cells a subject does not have are left empty.
+
+## Rows are written a chunk of nights at a time and grouped by subject (a Parquet row group or
+## Feather record batch never holds two subjects), so memory does not grow with cohort size.
+## Next to the dataset, <dataset>.index.csv lists SUBJ_ID, DATE_START, the row number and the
+## block holding each row: its byte offset in a CSV dataset, or its row group / record batch
+## number in a Parquet or Feather dataset.
+
+## Usage:
+##   python SleepBatch.py --dir DATA_FOLDER --out OUTPUT_FOLDER --cohort study --format parquet
+##   rows = SleepCohort.lookup('OUTPUT_FOLDER/study.parquet', '1001', '6/12/2017')
+
+
+import io
+import os
+import csv
+import tempfile
+
+import SleepEngine
+import SleepCache
+import SleepPipeline
+
+
+# SUBJ_ID ... LOG_SLEEP_QUALITY: the columns every subject has
+FIXED_COLUMNS = 19
+
+INDEX_HEADER = ['SUBJ_ID', 'DATE_START', 'ROW', 'BLOCK']
+
+
+## unified header of a list of per subject output headers
+def unify_headers(headers):
+	outHeader = list(headers[0][:FIXED_COLUMNS])
+	seen = set(outHeader)
+	logCols = []
+	actCols = []
+	for header in headers:
+		for name in header[FIXED_COLUMNS:]:
+			if name not in seen:
+				seen.add(name)
+				if name.startswith('log_'):
+					logCols.append(name)
+				else:
+					actCols.append(name)
+	return(outHeader + logCols + actCols)
+
+
+## for each unified column, its position in a subject's header (None if the subject lacks it)
+def column_map(header, outHeader):
+	where = {}
+	for n, name in enumerate(header):
+		where.setdefault(name, n)
+	return([where.get(name) for name in outHeader])
+
+
+def remap_rows(rows, colMap):
+	out = []
+	for row in rows:
+		out.append([row[n] if n is not None and n < len(row) else '' for n in colMap])
+	return(out)
+
+
+## CSV dataset written through a binary buffer so each row's byte offset is known
+## (same write_rows/size/close/abort interface as SleepColumnar.ColumnarWriter)
+class CsvWriter(object):
+	def __init__(self, outPath, outHeader):
+		self.outPath = outPath
+		self.tmpPath = outPath + '.part'
+		self.fh = open(self.tmpPath, 'wb', buffering=SleepEngine.WRITE_BUFFER)
+		self.text = io.StringIO()
+		self.w = csv.writer(self.text, delimiter=',')
+		self.rows = 0
+		self.put(outHeader)
+
+
+	def put(self, row):
+		self.w.writerow(row)
+		self.fh.write(self.text.getvalue().encode('utf-8'))
+		self.text.seek(0)
+		self.text.truncate(0)
+
+
+	## writes a list of rows and returns the byte offset of each
+	def write_rows(self, rows):
+		offsets = []
+		for row in rows:
+			offsets.append(self.fh.tell())
+			self.put(row)
+		self.rows += len(rows)
+		return(offsets)
+
+
+	def size(self):
+		return(self.fh.tell())
+
+
+	def close(self):
+		self.fh.close()
+		os.replace(self.tmpPath, self.outPath)
+
+
+	def abort(self):
+		self.fh.close()
+		os.remove(self.tmpPath)
+
+
+def open_writer(outPath, outHeader):
+	if os.path.splitext(outPath)[1].lower() in SleepEngine.COLUMNAR_FORMATS:
+		import SleepColumnar
+		return(SleepColumnar.ColumnarWriter(outPath, outHeader))
+	return(CsvWriter(outPath, outHeader))
+
+
+# parsed (and optionally scored) inputs of one subject
+def read_subject(act, log, cache, scoring):
+	actData, logData = SleepEngine.read_inputs(act, log, cache=cache)
+	if scoring:
+		actData = SleepEngine.score_inputs(act, actData, scoring, cache)
+	return(actData, logData)
+
+
+def index_path(outPath):
+	return(outPath + '.index.csv')
+
+
+## aligns every (key, act, log) job into one dataset at outPath, format picked by its extension
+## (.csv, .parquet or .feather), and writes its index.  Subjects are read twice (once for their
+## headers), so a cache is used; without one a temporary cache is made for the run.
+## progress(key, ok, message) is called once per subject
+## scoring is passed on to SleepEngine.score_inputs()
+## depth > 0 reads the next subjects and writes the previous ones on threads while one is aligned
+## (see SleepPipeline.py), with up to depth subjects queued between them
+## Returns (rows written, list of (key, error) for subjects left out)
+def write_cohort(jobs, outPath, cache=None, progress=None, scoring=None, depth=0):
+	if cache is None:
+		with tempfile.TemporaryDirectory(prefix='sleepcohort') as folder:
+			return(write_cohort(jobs, outPath, SleepCache.ParseCache(folder), progress, scoring, depth))
+
+	def read(job):
+		return(read_subject(job[1], job[2], cache, scoring))
+
+	# first pass: every subject's output header
+	subjects = []
+	failed = []
+	for (key, act, log), data, e in SleepPipeline.prefetch(read, jobs, depth):
+		if e is not None:
+			failed.append((key, '%s: %s' % (type(e).__name__, e)))
+			if progress:
+				progress(key, False, failed[-1][1])
+			continue
+		actData, logData = data
+		subjects.append((key, act, log, SleepEngine.build_header(logData[0], actData[1])[0]))
+	if not subjects:
+		return(0, failed)
+	outHeader = unify_headers([header for key, act, log, header in subjects])
+
+	# second pass: rows, a chunk at a time
+	writer = open_writer(outPath, outHeader)
+	tmpIndex = index_path(outPath) + '.part'
+	ih = open(tmpIndex, 'w', newline='')
+	index = csv.writer(ih, delimiter=',')
+
+	def write(rows):
+		start = writer.rows
+		for n, (row, block) in enumerate(zip(rows, blocks(writer.write_rows(rows), rows))):
+			index.writerow([row[0], row[1], start + n, block])
+
+	try:
+		index.writerow(INDEX_HEADER)
+		with SleepPipeline.Stage(depth, 'write') as stage:
+			for (key, act, log, header), data, e in SleepPipeline.prefetch(read, subjects, depth):
+				colMap = column_map(header, outHeader)
+				count = 0
+				try:
+					if e is not None:
+						raise e
+					actData, logData = data
+					ID, actHeader, restList, activeList, sleepList, dailyList = actData
+					nights = SleepEngine.link_nights(logData[1], restList, activeList, sleepList,
+														dailyList)
+					for chunk in SleepEngine.row_chunks(ID, logData[0], actHeader, nights):
+						stage.put(write, remap_rows(chunk, colMap))
+						count += len(chunk)
+				except Exception as e:
+					# row_chunks() parses every night before its first chunk, so a bad sleep log or
+					# actigraphy row fails before any of the subject's rows are queued and the
+					# subject can be left out.  Rows already written can not be taken back
+					if count:
+						raise
+					failed.append((key, '%s: %s' % (type(e).__name__, e)))
+					if progress:
+						stage.put(progress, key, False, failed[-1][1])
+					continue
+				if progress:
+					stage.put(progress, key, True, '%d nights' % count)
+		ih.close()
+	except BaseException:
+		ih.close()
+		os.remove(tmpIndex)
+		writer.abort()
+		raise
+	writer.close()
+	os.replace(tmpIndex, index_path(outPath))
+	return(writer.rows, failed)
+
+
+# per row blocks from write_rows(): a list of CSV offsets, or one batch number for all rows
+def blocks(written, rows):
+	if isinstance(written, list):
+		return(written)
+	return([written] * len(rows))
+
+
+## reads a dataset index: {SUBJ_ID: [(date ordinal, row, block), ...]} in file order
+def load_index(outPath):
+	index = {}
+	with open(index_path(outPath), 'r', newline='') as fh:
+		reader = csv.reader(fh)
+		next(reader)
+		for subj, day, row, block in reader:
+			index.setdefault(subj, []).append((SleepEngine.date_ordinal(day), int(row), int(block)))
+	return(index)
+
+
+## rows of one subject (all nights, or only the night starting on day 'm/d/yyyy') from a cohort
+## dataset.  CSV datasets give lists of strings; Parquet/Feather datasets give dictionaries of
+## typed values.  index is an optional load_index() result to reuse across lookups
+def lookup(outPath, subject, day=None, index=None):
+	if index is None:
+		index = load_index(outPath)
+	entries = index.get(subject, [])
+	if day is not None:
+		want = SleepEngine.date_ordinal(day)
+		entries = [entry for entry in entries if entry[0] == want]
+	if not entries:
+		return([])
+
+	if os.path.splitext(outPath)[1].lower() in SleepEngine.COLUMNAR_FORMATS:
+		import SleepColumnar
+		# a batch holds consecutive rows of one subject, so its first indexed row is its start
+		starts = {}
+		for entry in index[subject]:
+			starts.setdefault(entry[2], entry[1])
+		batches = {}
+		out = []
+		for day, row, block in entries:
+			if block not in batches:
+				batches[block] = SleepColumnar.read_batch(outPath, block)
+			out.append(batches[block][row - starts[block]])
+		return(out)
+
+	out = []
+	with open(outPath, 'r', newline='') as fh:
+		for day, row, block in entries:
+			fh.seek(block)
+			out.append(next(csv.reader(fh)))
+	return(out)
+
@@ -0,0 +1,180 @@
+## Sleep Aligner columnar output
+## Writes the aligned rows as a Parquet or Feather (Arrow IPC) file instead of CSV, so cohort
+## loads (e.g. pandas.read_parquet) need no text parsing.  Columns are typed:
+##   DATE_START, DATE_END          date32
+##   LOG_* / ACT_* time stamps     timestamp[ms]
+##   DIF_*                         duration[s]
+##   everything else               string, as in the CSV
+## 'N/A' and unreadable cells are stored as nulls.
+
+## pyarrow is an optional dependency, only imported when a columnar file is written.
+
+## Usage:
+##   SleepEngine.align_files(actFile, logFile, 'subject.parquet')
+##   SleepEngine.align_files(actFile, logFile, 'subject.feather')
+
+
+import os
+import datetime
+
+import SleepEngine
+
+
+# Rows per Parquet row group / Feather record batch
+BATCH_ROWS = 4096
+
+# LOG_* / ACT_* columns that are not time stamps
+NOT_STAMPS = ('LOG_SLEEP_QUALITY',)
+
+
+class ColumnarUnavailable(Exception):
+	pass
+
+
+def import_pyarrow():
+	try:
+		import pyarrow
+		import pyarrow.ipc
+		import pyarrow.parquet
+	except ImportError:
+		raise ColumnarUnavailable('Parquet and Feather output need the pyarrow package '
+									'(pip install pyarrow)')
+	return(pyarrow)
+
+
+# 'm/d/yyyy' -> date
+def parse_date(cell):
+	try:
+		return(datetime.date.fromordinal(SleepEngine.date_ordinal(cell)))
+	except ValueError:
+		return(None)
+
+
+# 'm/d/yyyy h:m[:s] AM' -> datetime
+def parse_stamp(cell):
+	try:
+		day, clock = cell.split(' ', 1)
+		return(datetime.datetime.fromordinal(SleepEngine.date_ordinal(day)) +
+				datetime.timedelta(seconds=SleepEngine.clock_seconds(clock)))
+	except (ValueError, TypeError, IndexError):
+		return(None)
+
+
+# 'h:m:s' -> timedelta
+def parse_duration(cell):
+	try:
+		hr, min, sec = SleepEngine.split_time(cell)
+	except (ValueError, IndexError):
+		return(None)
+	return(datetime.timedelta(hours=hr, minutes=min, seconds=sec))
+
+
+def parse_text(cell):
+	return(cell)
+
+
+## Arrow schema and one cell parser per output column
+def column_types(pa, outHeader):
+	fields = []
+	parsers = []
+	for name in outHeader:
+		if name in ('DATE_START', 'DATE_END'):
+			fields.append(pa.field(name, pa.date32()))
+			parsers.append(parse_date)
+		elif name.startswith('DIF_'):
+			fields.append(pa.field(name, pa.duration('s')))
+			parsers.append(parse_duration)
+		elif name.startswith(('LOG_', 'ACT_')) and name not in NOT_STAMPS:
+			fields.append(pa.field(name, pa.timestamp('ms')))
+			parsers.append(parse_stamp)
+		else:
+			fields.append(pa.field(name, pa.string()))
+			parsers.append(parse_text)
+	return(pa.schema(fields), parsers)
+
+
+# one record batch from a list of rows; rows shorter than the header are padded with nulls
+def make_batch(pa, schema, parsers, rows):
+	arrays = []
+	for col, parse in enumerate(parsers):
+		cells = []
+		for row in rows:
+			cell = row[col] if col < len(row) else 'N/A'
+			cells.append(None if cell == 'N/A' else parse(cell))
+		arrays.append(pa.array(cells, type=schema.field(col).type))
+	return(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+
+## Parquet or Feather file (picked by the extension of outPath) written one batch at a time.
+## Each write_rows() call becomes one Parquet row group / Feather record batch.  The file goes to
+## outPath + '.part' and is only put in place by close()
+class ColumnarWriter(object):
+	def __init__(self, outPath, outHeader):
+		self.pa = import_pyarrow()
+		self.schema, self.parsers = column_types(self.pa, outHeader)
+		self.outPath = outPath
+		self.tmpPath = outPath + '.part'
+		if os.path.splitext(outPath)[1].lower() == '.parquet':
+			self.writer = self.pa.parquet.ParquetWriter(self.tmpPath, self.schema)
+		else:
+			self.writer = self.pa.ipc.new_file(self.tmpPath, self.schema)
+		self.batches = 0
+		self.rows = 0
+
+
+	## writes a list of rows as one batch and returns its batch number
+	def write_rows(self, rows):
+		self.writer.write_batch(make_batch(self.pa, self.schema, self.parsers, rows))
+		self.batches += 1
+		self.rows += len(rows)
+		return(self.batches - 1)
+
+
+	## bytes written so far
+	def size(self):
+		return(os.path.getsize(self.tmpPath))
+
+
+	def close(self):
+		self.writer.close()
+		os.replace(self.tmpPath, self.outPath)
+
+
+	## closes and removes the unfinished file
+	def abort(self):
+		self.writer.close()
+		os.remove(self.tmpPath)
+
+
+## writes output header and rows (any iterable) to a Parquet or Feather file, picked by the
+## extension of outPath.  Returns the number of rows written
+## Like SleepEngine.write_csv, the file is only put in place once complete
+def write_columnar(outPath, outHeader, rows, progress=None):
+	writer = ColumnarWriter(outPath, outHeader)
+	try:
+		batch = []
+		for row in rows:
+			batch.append(row)
+			if len(batch) == BATCH_ROWS:
+				writer.write_rows(batch)
+				batch = []
+				if progress:
+					progress('bytes', writer.size(), 0)
+		if batch:
+			writer.write_rows(batch)
+		if progress:
+			progress('bytes', writer.size(), 0)
+	except BaseException:
+		writer.abort()
+		raise
+	writer.close()
+	return(writer.rows)
+
+
+## reads batch number n of a Parquet or Feather file as a list of row dictionaries
+def read_batch(path, n):
+	pa = import_pyarrow()
+	if os.path.splitext(path)[1].lower() == '.parquet':
+		return(pa.parquet.ParquetFile(path).read_row_group(n).to_pylist())
+	with pa.memory_map(path) as source:
+		return(pa.ipc.open_file(source).get_batch(n).to_pylist())
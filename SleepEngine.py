@@ -0,0 +1,832 @@
+## Sleep Aligner alignment engine
+## Alignment code used by the SleepAligner window and the headless batch runner (SleepBatch.py).
+## Nothing in here imports PyQt5, so it can be run from scripts and worker processes.
+
+## Library use:
+##   outHeader, outList = SleepEngine.align(actData, logData)
+## where actData and logData are lists of CSV rows (lists of strings), e.g. from read_csv().
+
+## Progress:  the align functions take an optional progress(stage, count, total) callback, called
+## with stage 'rows' (actigraphy rows parsed), 'nights' (nights aligned, total = all nights) and
+## 'bytes' (output bytes written).  total is 0 when it is not known.  The callback can raise
+## AlignCancelled to stop a run part way through.
+
+## Instrumentation:  align_files and align_incremental also take report=, a SleepProfile.RunReport
+## that collects stage timings, counters and an optional cProfile capture.
+
+## Scoring:  scoring='fill' or 'replace' takes REST/ACTIVE/SLEEP intervals scored from the epoch
+## activity counts (SleepScore.py) for nights Actiware has none for, or for every night.
+
+
+import os
+import sys
+import csv
+import bisect
+import datetime
+import operator
+import functools
+
+import SleepProfile
+
+
+# Column holding the date in sleep log rows and in actigraph statistics rows ('Start Date')
+LOG_DATE = 2
+ACT_DATE = 2
+# 'Start Time', 'End Date' and 'End Time' columns of actigraph statistics rows
+ACT_TIME = 3
+ACT_END_DATE = 4
+ACT_END_TIME = 5
+
+# How often (in rows) the 'rows' and 'bytes' progress stages are reported
+PROGRESS_ROWS = 2000
+
+# Nights per chunk of output rows when streaming to a file
+CHUNK_NIGHTS = 512
+
+# Output file buffer size
+WRITE_BUFFER = 1024 * 1024
+
+
+## raised from a progress callback to cancel an alignment
+class AlignCancelled(Exception):
+	pass
+
+
+# Stand-in row for a missing sleep log or actigraph entry.  One shared instance for every gap
+NA_ROW = ('N/A',)
+
+
+# Break time into hours, min, sec and remove AM/PM
+def split_time(timeIn):
+	Tnum = timeIn.split(' ')
+	Tnum = Tnum[0].split(':')
+	hr = int(Tnum[0])
+	min = int(Tnum[1])
+	if len(Tnum) > 2:
+		sec = int(Tnum[2])
+	else: 
+		sec = 0
+	return(hr, min, sec)
+
+# Day number of an m/d/y or m/d/yyyy date string.  Cached since every night repeats the same dates
+@functools.lru_cache(maxsize=4096)
+def date_ordinal(inDate):
+	month, day, year = inDate.split('/')
+	year = int(year)
+	if year < 100:
+		year += 2000
+	return(datetime.date(year, int(month), int(day)).toordinal())
+
+
+# Seconds past midnight of an 'h:m[:s] [AM/PM]' time string.  Cached like date_ordinal()
+@functools.lru_cache(maxsize=4096)
+def clock_seconds(timeIn):
+	parts = timeIn.split(' ')
+	hr, min, sec = split_time(parts[0])
+	if len(parts) > 1:
+		hr = hr % 12
+		if parts[1] == 'PM':
+			hr += 12
+	return((hr * 3600) + (min * 60) + sec)
+
+
+# Seconds past midnight of sleep log hour, minute and AM/PM ('0' AM, '1' PM) fields
+@functools.lru_cache(maxsize=4096)
+def log_clock(hr, min, ap):
+	hr = int(hr)
+	if ap == '0':
+		hr = hr % 12
+	elif ap == '1':
+		hr = (hr % 12) + 12
+	return((hr * 3600) + (int(min) * 60))
+
+
+# Seconds since 1/1/0001 of a sleep log clock time.  PM times fall on day1, AM times on day2
+def log_seconds(clock, day1, day2):
+	if clock >= 43200:
+		return((day1 * 86400) + clock)
+	return((day2 * 86400) + clock)
+
+
+## Seconds since 1/1/0001 of a date and time string pair
+def stamp_seconds(date, clock):
+	return((date_ordinal(date) * 86400) + clock_seconds(clock))
+
+
+# Seconds since 1/1/0001 of an actigraph row's date and time columns, None if the row is missing
+def act_seconds(row, dateCol, timeCol):
+	if len(row) == 1:
+		return(None)
+	return(stamp_seconds(row[dateCol], row[timeCol]))
+
+
+## Night (date ordinal of its evening) an actigraph statistics row belongs to.  REST and SLEEP
+## intervals go with the day on whose noon-to-noon span they start, so a sleep starting after
+## midnight stays with the evening before; an ACTIVE interval goes with the night its end (the
+## following rest) falls in, and a DAILY row with the night starting on its calendar day
+def interval_night(row):
+	if row[0] == 'DAILY':
+		return(date_ordinal(row[ACT_DATE]))
+	if row[0] == 'ACTIVE':
+		date, clock = row[ACT_END_DATE], row[ACT_END_TIME]
+	else:
+		date, clock = row[ACT_DATE], row[ACT_TIME]
+	if not clock.strip():
+		return(date_ordinal(date))
+	return((stamp_seconds(date, clock) - 43200) // 86400)
+
+
+## 'h:mm AM' (or 'h:mm:ss AM' with seconds=True) time of day of a time in seconds
+def format_clock(secs, seconds=False):
+	hr, secs = divmod(secs % 86400, 3600)
+	min, sec = divmod(secs, 60)
+	ampm = 'AM' if hr < 12 else 'PM'
+	if seconds:
+		return('%d:%02d:%02d %s' % (hr % 12 or 12, min, sec, ampm))
+	return('%d:%02d %s' % (hr % 12 or 12, min, ampm))
+
+
+## 'm/d/yyyy h:mm AM' text of a time in seconds since 1/1/0001, or N/A for None.  Times are only
+## turned into text here, when rows are written
+def format_stamp(secs, seconds=False):
+	if secs is None:
+		return('N/A')
+	return(format_date(secs // 86400) + ' ' + format_clock(secs, seconds))
+
+
+# Computes a whole DIF_* column at once: |act - log| as 'h:m:s'.  Both columns hold seconds
+# since 1/1/0001 (None if missing), so differences also span month and year boundaries.
+# With numpy already loaded (scoring or columnar output imported it) the differences and their
+# hours/minutes/seconds are worked out on arrays.  numpy is not imported just for this: a column
+# is at most CHUNK_NIGHTS values, and the import takes far longer than it would save.  The text
+# is formatted per cell either way, which is faster than numpy's string functions
+def diff_column(logSecs, actSecs):
+	np = sys.modules.get('numpy')
+	if np is None or not logSecs:
+		return(diff_column_py(logSecs, actSecs))
+	# None becomes NaN; seconds since 1/1/0001 are exact in a float64
+	difs = np.abs(np.array(actSecs, dtype=float) - np.array(logSecs, dtype=float))
+	missing = np.isnan(difs)
+	hours, rest = np.divmod(np.where(missing, 0, difs).astype(np.int64), 3600)
+	mins, secs = np.divmod(rest, 60)
+	return(['N/A' if gap else '%d:%d:%d' % hms
+			for gap, hms in zip(missing.tolist(), zip(hours.tolist(), mins.tolist(), secs.tolist()))])
+
+
+# diff_column() without numpy
+def diff_column_py(logSecs, actSecs):
+	difs = []
+	for s1, s2 in zip(logSecs, actSecs):
+		if (s1 is None) or (s2 is None):
+			difs.append('N/A')
+		else:
+			Hout, rest = divmod(abs(s2 - s1), 3600)
+			Mout, Sout = divmod(rest, 60)
+			difs.append(str(Hout) + ':' + str(Mout) + ':' + str(Sout))
+	return(difs)
+
+
+## reads a CSV file into a list of rows
+def read_csv(path):
+	with open(path, 'r') as inFile:
+		return(list(csv.reader(inFile)))
+
+
+## splits actigraphy rows into ID, header and REST, ACTIVE, SLEEP, DAILY statistics rows
+## actData can be any iterable of rows (e.g. a csv.reader).  Rows are classified as they are read
+## and reading stops at the end of the statistics section, so epoch data is never tokenized
+def split_actigraphy(actData, progress=None):
+	ID = None
+	actHeader = None
+	# Store subset of actigraph statistics data: REST, ACTIVE, SLEEP, DAILY
+	# Capture header in actHeader
+	restList = []
+	activeList = []
+	sleepList = []
+	dailyList = []
+	rowCount = 0
+	for elem in actData:
+		rowCount += 1
+		if progress and rowCount % PROGRESS_ROWS == 0:
+			progress('rows', rowCount, 0)
+		if len(elem) > 0:
+			if elem[0] == "REST":
+				restList.append(elem)
+			elif elem[0] == "ACTIVE":
+				activeList.append(elem)
+			elif elem[0] == "SLEEP":
+				sleepList.append(elem)
+			elif elem[0] == "DAILY":
+				dailyList.append(elem)
+			elif elem[0] == 'Interval Type':
+				actHeader = elem
+			elif elem[0] == 'Full Name:':
+				# or use 'Identity:' if this is the patient identity and not just actigraph
+				ID = elem[1]
+			elif actHeader is not None and is_section_end(elem[0]):
+				# next section (marker list, epoch-by-epoch data) starts; statistics are done
+				break
+
+	if progress:
+		progress('rows', rowCount, 0)
+	if actHeader is None:
+		raise ValueError('No Interval Type header found in actigraphy data')
+	return(ID, actHeader, restList, activeList, sleepList, dailyList)
+
+
+# Actiware section banners look like '-------------------- Epoch-by-Epoch Data --------------------'
+# The epoch table header starts with 'Line' if the banner is missing
+def is_section_end(cell):
+	return(cell.startswith('-----') or cell == 'Line')
+
+
+## reads an actigraphy export and returns the split_actigraphy() result.  The file is memory
+## mapped and only its statistics rows are tokenized (see SleepExport.py)
+def read_actigraphy(path, progress=None):
+	import SleepExport
+	return(SleepExport.read_actigraphy(path, progress))
+
+
+## splits sleep log rows into header and data rows (dates rewritten as m/d/yyyy)
+def split_log(logData):
+	# Store sleep log information.  Remove header and store in logHeader
+	# Rows are copied so the caller's data is left untouched
+	logHeader = logData[0]
+	# CSV exports end with an empty row: drop trailing rows with every cell blank
+	end = len(logData)
+	while end > 1 and not any(cell.strip() for cell in logData[end - 1]):
+		end -= 1
+	logData = [list(row) for row in logData[1:end]]
+	for row in logData:
+		if len(row) > LOG_DATE and row[LOG_DATE].strip():
+			row[LOG_DATE] = format_date(date_ordinal(row[LOG_DATE]))
+	return(logHeader, logData)
+
+
+# sleep log file extensions read as Excel workbooks (see SleepWorkbook.py); anything else is CSV
+LOG_WORKBOOK_FORMATS = ('.xlsx', '.xlsm', '.xls')
+
+
+## reads a sleep log file (CSV or Excel workbook) and returns the split_log() result
+def read_log(path):
+	if os.path.splitext(path)[1].lower() in LOG_WORKBOOK_FORMATS:
+		import SleepWorkbook
+		return(split_log(SleepWorkbook.read_rows(path)))
+	return(split_log(read_csv(path)))
+
+
+## One aligned night.  day is the date ordinal and log, daily, sleep, rest and active are the
+## source rows (NA_ROW when missing).  The remaining fields are times in seconds since 1/1/0001,
+## None when missing, filled in by parse_times():
+##   logWake      final_awake_time on day          actRestStart  REST start
+##   logBed       bedtime                          actRestEnd    REST end
+##   logSleep     try_sleep + fall_asleep          actSleepEnd   SLEEP end
+##   logBedOut    bed_out (morning of day)
+class Night(object):
+	__slots__ = ('day', 'log', 'daily', 'sleep', 'rest', 'active',
+					'logWake', 'logBed', 'logSleep', 'logBedOut',
+					'actRestStart', 'actRestEnd', 'actSleepEnd')
+
+	def __init__(self, day, log=NA_ROW, daily=NA_ROW, sleep=NA_ROW, rest=NA_ROW, active=NA_ROW):
+		self.day = day
+		self.log = log
+		self.daily = daily
+		self.sleep = sleep
+		self.rest = rest
+		self.active = active
+		self.logWake = None
+		self.logBed = None
+		self.logSleep = None
+		self.logBedOut = None
+		self.actRestStart = None
+		self.actRestEnd = None
+		self.actSleepEnd = None
+
+	## parses this night's log and actigraph times using the header column dictionaries
+	def parse_times(self, logLoc, actLoc):
+		day = self.day
+		log = self.log
+		if len(log) > 1:
+			self.logWake = (day * 86400) + clock_seconds(log[logLoc['final_awake_time']])
+			self.logBed = log_seconds(log_clock(log[logLoc['bedtime_hr']], log[logLoc['bedtime_min']],
+											log[logLoc['bedtime_am_pm']]), day, day + 1)
+			self.logSleep = (log_seconds(log_clock(log[logLoc['try_sleep_hr']],
+											log[logLoc['try_sleep_min']], log[logLoc['try_sleep_am_pm']]),
+											day, day + 1) +
+								log_clock(log[logLoc['fall_asleep_hr']], log[logLoc['fall_asleep_min']], 'null'))
+			self.logBedOut = log_seconds(log_clock(log[logLoc['bed_out_hr']], log[logLoc['bed_out_min']],
+											log[logLoc['bed_out_am_pm']]), day - 1, day)
+		self.actRestStart = act_seconds(self.rest, actLoc['Start Date'], actLoc['Start Time'])
+		self.actRestEnd = act_seconds(self.rest, actLoc['End Date'], actLoc['End Time'])
+		self.actSleepEnd = act_seconds(self.sleep, actLoc['End Date'], actLoc['End Time'])
+
+
+# Stand-in for a missing neighbouring night (no rows, no times).  One shared instance
+NA_NIGHT = Night(0)
+
+
+## joins sleep log rows and actigraph rows on the full calendar date
+## returns one Night per date, sorted by day.  Works on unsorted input; if a date shows up more
+## than once the later row wins.  Actigraph rows are keyed by their own night (interval_night()),
+## so a missing or extra REST, ACTIVE or DAILY row only leaves its own night without it.  Nights
+## come from the sleep log and the SLEEP intervals
+def link_nights(logData, restList, activeList, sleepList, dailyList):
+	nightByDay = {}
+	for row in logData:
+		if len(row) > LOG_DATE and row[LOG_DATE].strip():
+			day = date_ordinal(row[LOG_DATE])
+			nightByDay[day] = Night(day, log=row)
+
+	restByDay = dict((interval_night(row), row) for row in restList)
+	activeByDay = dict((interval_night(row), row) for row in activeList)
+	dailyByDay = dict((interval_night(row), row) for row in dailyList)
+	for row in sleepList:
+		day = interval_night(row)
+		night = nightByDay.get(day)
+		if night is None:
+			night = nightByDay[day] = Night(day)
+		night.daily = dailyByDay.get(day, NA_ROW)
+		night.sleep = row
+		night.rest = restByDay.get(day, NA_ROW)
+		night.active = activeByDay.get(day, NA_ROW)
+
+	return([nightByDay[day] for day in sorted(nightByDay)])
+
+
+# m/d/yyyy string for a date ordinal
+@functools.lru_cache(maxsize=4096)
+def format_date(day):
+	date = datetime.date.fromordinal(day)
+	return(str(date.month) + '/' + str(date.day) + '/' + str(date.year))
+
+
+## compiles the columns of a width-wide row that are not in skip into one itemgetter call.
+## Returns a function giving the kept cells of a row as a tuple; short rows are padded with ''
+def projection(width, skip):
+	keep = [n for n in range(width) if n not in skip]
+	if len(keep) == 0:
+		getter = lambda row: ()
+	elif len(keep) == 1:
+		single = operator.itemgetter(keep[0])
+		getter = lambda row: (single(row),)
+	else:
+		getter = operator.itemgetter(*keep)
+
+	def pick(row):
+		if len(row) < width:
+			row = list(row) + [''] * (width - len(row))
+		return(getter(row))
+	return(pick)
+
+
+## builds the output header, the column dictionaries and the projections picking the remaining
+## sleep log and SLEEP interval columns of a row (in outHeader order).
+## Returns (outHeader, logLoc, actLoc, logPick, actPick)
+def build_header(logHeader, actHeader):
+	# build dictionary of sleep log data locations
+	logLoc = {}
+	index = 0
+	for elem in logHeader:
+		logLoc.update({elem:index})
+		index += 1
+	#print(' ')
+	#print(logLoc)
+
+	# build dictionary of actigraph data locations
+	actLoc = {}
+	index = 0
+	for elem in actHeader:
+		actLoc.update({elem:index})
+		index += 1
+	#print(' ')
+	#print(actLoc)
+
+	# build output header
+	outHeader = ['SUBJ_ID', 'DATE_START', 'DATE_END', 'LOG_ACTIVE_START', 'ACT_ACTIVE_START', 
+					'DIF_ACTIVE_START', 'LOG_BED_START', 'ACT_BED_START', 'DIF_BED_START',
+					'LOG_SLEEP_START', 'ACT_SLEEP_START', 'DIF_SLEEP_START', 'LOG_SLEEP_END',
+					'ACT_SLEEP_END', 'DIF_SLEEP_END', 'LOG_BED_END', 'ACT_BED_END',
+					'DIF_BED_END', 'LOG_SLEEP_QUALITY']
+	# Log portion
+	logSkip = {logLoc['final_awake_time'], logLoc['bedtime_hr'], logLoc['bedtime_min'], 
+				logLoc['bedtime_am_pm'], logLoc['fall_asleep_hr'], logLoc['fall_asleep_min'],
+				logLoc['try_sleep_hr'], logLoc['try_sleep_min'], logLoc['try_sleep_am_pm'], 
+				logLoc['awake_hr'], logLoc['awake_min'], logLoc['awake_am_pm'], 
+				logLoc['sleep_quality']}
+	logPick = projection(len(logHeader), logSkip)
+	outHeader.extend(['log_'+elem for elem in logPick(logHeader)])
+	# Act portion
+	actSkip = {actLoc['Start Date'], actLoc['Start Time'], actLoc['End Date'], 
+				actLoc['End Time']}
+	actPick = projection(len(actHeader), actSkip)
+	outHeader.extend(['act_'+elem for elem in actPick(actHeader)])
+	return(outHeader, logLoc, actLoc, logPick, actPick)
+
+
+## builds the output header and one output row per night from link_nights()
+## days is an optional set of date ordinals: only those nights get output rows (the other nights
+## are still used as neighbours)
+def build_rows(ID, logHeader, actHeader, nights, progress=None, days=None):
+	outList = []
+	for chunk in row_chunks(ID, logHeader, actHeader, nights, progress, days):
+		outList.extend(chunk)
+	return(build_header(logHeader, actHeader)[0], outList)
+
+
+## output rows one at a time, for streaming them to a file.  Same arguments as build_rows()
+def iter_rows(ID, logHeader, actHeader, nights, progress=None, days=None):
+	for chunk in row_chunks(ID, logHeader, actHeader, nights, progress, days):
+		for row in chunk:
+			yield(row)
+
+
+## yields the output rows in lists of up to CHUNK_NIGHTS nights.  The DIF_* columns are computed
+## a chunk at a time
+def row_chunks(ID, logHeader, actHeader, nights, progress=None, days=None):
+	outHeader, logLoc, actLoc, logPick, actPick = build_header(logHeader, actHeader)
+	# cells for a night without a sleep log entry / SLEEP interval
+	logBlank = [' '] * len(logPick(logHeader))
+	actBlank = ['N/A'] * len(actPick(actHeader))
+
+	# Walk through nights to compute output list
+	# time spans awake day1 through awake day2
+	# sleep logs look ahead to get awake from day2
+	# actigraph looks back one day to get awake time for that day (day1 - 1)
+	# Only the neighbouring calendar days are used; across a gap those values are N/A
+	outList = []
+	logSecs = [[], [], [], [], []]
+	actSecs = [[], [], [], [], []]
+	done = 0
+	if days is None:
+		wanted = range(len(nights))
+	else:
+		wanted = [k for k in range(len(nights)) if nights[k].day in days]
+	# parse the wanted nights and their neighbours
+	parsed = set()
+	for k in wanted:
+		for m in (k - 1, k, k + 1):
+			if 0 <= m < len(nights) and m not in parsed:
+				nights[m].parse_times(logLoc, actLoc)
+				parsed.add(m)
+	for k in wanted:
+		night = nights[k]
+		day = night.day
+		log = night.log
+		if k > 0 and nights[k-1].day == day - 1:
+			prevNight = nights[k-1]
+		else:
+			prevNight = NA_NIGHT
+		if k < len(nights) - 1 and nights[k+1].day == day + 1:
+			nextNight = nights[k+1]
+		else:
+			nextNight = NA_NIGHT
+
+		# Sleep log times.  Wake and bed out come from the next night's log (the morning after)
+		if len(log) > 1:
+			logTimes = (night.logWake, night.logBed, night.logSleep, nextNight.logWake, nextNight.logBedOut)
+			nextLog = nextNight.log
+			quality = nextLog[logLoc['sleep_quality']] if len(nextLog) > 1 else 'N/A'
+		else:
+			logTimes = (None, None, None, None, None)
+			quality = 'N/A'
+
+		# Actigraph times, if actigraph data is available for the current date
+		if len(night.sleep) == 1:
+			actTimes = (None, None, None, None, None)
+		else:
+			actTimes = (prevNight.actSleepEnd, night.actRestStart, night.actSleepEnd, night.actRestEnd, None)
+
+		# Combine.  Times are formatted here; calculations in columns 5, 8, 11, 14, 17 are
+		# filled in below, one column at a time
+		combRow = [ID, format_date(day), format_date(day + 1)]
+		for n in range(5):
+			combRow.append(format_stamp(logTimes[n]))
+			combRow.append(format_stamp(actTimes[n], True))
+			combRow.append('N/A')
+			logSecs[n].append(logTimes[n])
+			actSecs[n].append(actTimes[n])
+		combRow.append(quality)
+
+		# add remaining log/act data using sleep for act data
+		if len(log) > 1:
+			combRow.extend(logPick(log))
+		else:
+			combRow.extend(logBlank)
+		# remaining actigraph data
+		if len(night.sleep) > 1:
+			combRow.extend(actPick(night.sleep))
+		else:
+			combRow.extend(actBlank)
+		# add new combined row list to outList
+		outList.append(combRow)
+		done += 1
+		if progress:
+			progress('nights', done, len(wanted))
+		if len(outList) == CHUNK_NIGHTS:
+			yield(fill_diffs(outList, logSecs, actSecs))
+			outList = []
+			logSecs = [[], [], [], [], []]
+			actSecs = [[], [], [], [], []]
+
+	if outList:
+		yield(fill_diffs(outList, logSecs, actSecs))
+
+
+# Calculate differences in log and actigraph times (DIF_ACTIVE_START ... DIF_BED_END), one
+# column at a time.  Returns outList
+def fill_diffs(outList, logSecs, actSecs):
+	for n in range(5):
+		col = 5 + (n * 3)
+		for row, dif in zip(outList, diff_column(logSecs[n], actSecs[n])):
+			row[col] = dif
+	return(outList)
+
+
+## aligns actigraphy rows and sleep log rows by date.  Returns (outHeader, outList)
+def align(actData, logData, progress=None):
+	return(align_split(split_actigraphy(actData, progress), split_log(logData), progress))
+
+
+## aligns already split data: act from split_actigraphy()/read_actigraphy(), log from split_log()
+def align_split(act, log, progress=None):
+	ID, actHeader, restList, activeList, sleepList, dailyList = act
+	logHeader, logData = log
+	nights = link_nights(logData, restList, activeList, sleepList, dailyList)
+	return(build_rows(ID, logHeader, actHeader, nights, progress))
+
+
+## writes output header and rows to a CSV file.  rows can be any iterable (e.g. iter_rows()),
+## each row is written as soon as it arrives.  Returns the number of rows written
+## The rows go to a temporary file that replaces outPath once complete, so a failed or
+## cancelled run never leaves a half written result behind
+def write_csv(outPath, outHeader, rows, progress=None):
+	# Write CSV file to read into Excel 
+	tmpPath = outPath + '.part'
+	count = 0
+	fh = open(tmpPath, 'w', newline='', buffering=WRITE_BUFFER)
+	try:
+		w = csv.writer(fh, delimiter=',')
+		w.writerow(outHeader)
+		for row in rows:
+			w.writerow(row)
+			count += 1
+			if progress and count % PROGRESS_ROWS == 0:
+				progress('bytes', fh.tell(), 0)
+		if progress:
+			progress('bytes', fh.tell(), 0)
+		fh.close()
+	except BaseException:
+		fh.close()
+		os.remove(tmpPath)
+		raise
+	os.replace(tmpPath, outPath)
+	return(count)
+
+
+## file extensions written in a columnar format (see SleepColumnar.py); anything else is CSV
+COLUMNAR_FORMATS = ('.parquet', '.feather')
+
+
+## writes the output in the format given by outPath's extension.  Returns the number of rows
+def write_output(outPath, outHeader, rows, progress=None):
+	if os.path.splitext(outPath)[1].lower() in COLUMNAR_FORMATS:
+		# pyarrow is only needed (and imported) for columnar output
+		import SleepColumnar
+		return(SleepColumnar.write_columnar(outPath, outHeader, rows, progress))
+	return(write_csv(outPath, outHeader, rows, progress))
+
+
+## reads and parses both input files, through cache (a SleepCache.ParseCache) if given.
+## Returns (act, log) as from read_actigraphy() and read_log()
+## The files are checked from their first few KB before anything is parsed; a pair that can not
+## be aligned raises SleepValidate.InputError listing what is wrong (see SleepValidate.py)
+def read_inputs(actFile, logFile, progress=None, cache=None, report=SleepProfile.NULL_REPORT):
+	import SleepValidate
+	with report.stage('validate'):
+		warnings = SleepValidate.validate(actFile, logFile)
+	for problem in warnings:
+		report.warn(str(problem))
+	with report.stage('parse_actigraphy'):
+		if cache is None:
+			act = read_actigraphy(actFile, progress)
+		else:
+			act = cache.read_actigraphy(actFile, progress)
+	with report.stage('parse_log'):
+		if cache is None:
+			log = read_log(logFile)
+		else:
+			log = cache.read_log(logFile)
+	report.set('act_stat_rows', len(act[2]) + len(act[3]) + len(act[4]) + len(act[5]))
+	report.set('log_rows', len(log[1]))
+	if cache is not None:
+		report.set('cache_hits', cache.hits)
+		report.set('cache_misses', cache.misses)
+	return(act, log)
+
+
+## replaces (scoring='replace') or fills in (scoring='fill') the REST/ACTIVE/SLEEP intervals of
+## act with ones scored from the export's epoch data (see SleepScore.py).  Returns the new act
+def score_inputs(actFile, act, scoring, cache=None, report=SleepProfile.NULL_REPORT):
+	# numpy is only needed (and imported) when scoring is asked for
+	import SleepScore
+	with report.stage('score'):
+		if cache is None:
+			scored = SleepScore.score_export(actFile, act[1])
+		else:
+			scored = cache.get(actFile, 'scored-' + SleepScore.DEFAULT_ALGORITHM,
+								lambda: SleepScore.score_export(actFile, act[1]))
+		act = SleepScore.merge_intervals(act, scored, scoring)
+	report.set('scored_nights', len(scored[2]))
+	return(act)
+
+
+# wraps a progress callback so the report also gets the actigraphy rows read and bytes written
+def counting_progress(progress, report):
+	def track(stage, count, total):
+		if stage == 'rows':
+			report.set('act_rows_read', count)
+		elif stage == 'bytes':
+			report.set('bytes_written', count)
+		if progress:
+			progress(stage, count, total)
+	return(track)
+
+
+# night counters: matched on both sides, sleep log only, actigraphy only
+def count_nights(nights, report):
+	matched = 0
+	logOnly = 0
+	actOnly = 0
+	for night in nights:
+		if len(night.log) > 1 and len(night.sleep) > 1:
+			matched += 1
+		elif len(night.log) > 1:
+			logOnly += 1
+		else:
+			actOnly += 1
+	report.set('nights', len(nights))
+	report.set('nights_matched', matched)
+	report.set('nights_missing_actigraphy', logOnly)
+	report.set('nights_missing_log', actOnly)
+
+
+# DIF_* cell counters: computed, and N/A because one side is missing.  Passes the rows through,
+# so it can sit between iter_rows() and a writer
+def count_cells(rows, report):
+	computed = 0
+	count = 0
+	for row in rows:
+		count += 1
+		for col in (5, 8, 11, 14, 17):
+			if row[col] != 'N/A':
+				computed += 1
+		yield(row)
+	report.set('rows', count)
+	report.set('dif_cells_computed', computed)
+	report.set('dif_cells_na', (count * 5) - computed)
+
+
+## reads an earlier output file.  Returns (header, rows, offsets) where offsets[n] is the byte
+## position in the file where rows[n] starts
+def read_output(path):
+	offsets = []
+	position = [0]
+	def lines(fh):
+		for line in fh:
+			position[0] += len(line)
+			yield(line.decode('utf-8'))
+	with open(path, 'rb') as fh:
+		reader = csv.reader(lines(fh))
+		header = next(reader, None)
+		rows = []
+		while True:
+			start = position[0]
+			row = next(reader, None)
+			if row is None:
+				break
+			if len(row) > 1:
+				rows.append(row)
+				offsets.append(start)
+	return(header, rows, offsets)
+
+
+# copies the first length bytes of src to dst (all of them if length is None)
+def copy_bytes(src, dst, length=None):
+	while length is None or length > 0:
+		chunk = src.read(WRITE_BUFFER if length is None else min(length, WRITE_BUFFER))
+		if not chunk:
+			break
+		dst.write(chunk)
+		if length is not None:
+			length -= len(chunk)
+
+
+## incremental update of an existing output file: only nights whose DATE_START is not in outPath
+## yet are aligned, plus the existing nights next to them (their next-morning sleep log values
+## and previous-night actigraph wake time depend on the new night).  When the changes are all at
+## the end of the file the rows before them are copied and the rest appended; otherwise the existing rows are
+## merged with the new ones and the file is rewritten.  Nights that are already in the file are
+## not re-aligned, so corrections to old nights need a full align_files() run.
+## Falls back to align_files() if outPath does not exist, is not a CSV file or its columns differ.
+## returns the number of rows written
+def align_incremental(actFile, logFile, outPath, progress=None, cache=None, report=None,
+						scoring=None):
+	if not os.path.exists(outPath) or os.path.splitext(outPath)[1].lower() in COLUMNAR_FORMATS:
+		return(align_files(actFile, logFile, outPath, progress, cache, report, scoring))
+	if report is None:
+		report = SleepProfile.NULL_REPORT
+	else:
+		progress = counting_progress(progress, report)
+
+	act, log = read_inputs(actFile, logFile, progress, cache, report)
+	if scoring:
+		act = score_inputs(actFile, act, scoring, cache, report)
+	ID, actHeader, restList, activeList, sleepList, dailyList = act
+	logHeader, logData = log
+	with report.stage('join'):
+		nights = link_nights(logData, restList, activeList, sleepList, dailyList)
+	count_nights(nights, report)
+
+	with report.stage('read_output'):
+		oldHeader, oldRows, offsets = read_output(outPath)
+	oldDays = [date_ordinal(row[1]) for row in oldRows]
+	known = set(oldDays)
+	newDays = set(night.day for night in nights if night.day not in known)
+	if not newDays:
+		report.finish()
+		return(0)
+	days = set(newDays)
+	for day in newDays:
+		for other in (day - 1, day + 1):
+			if other in known:
+				days.add(other)
+
+	with report.stage('rows'):
+		outHeader, outList = build_rows(ID, logHeader, actHeader, nights, progress, days)
+	outList = list(count_cells(outList, report))
+	if outHeader != oldHeader:
+		return(align_files(actFile, logFile, outPath, progress, cache, report, scoring))
+
+	with report.stage('write'):
+		rebuilt = {}
+		for row in outList:
+			rebuilt[date_ordinal(row[1])] = row
+		if oldDays == sorted(oldDays):
+			# rows before the first changed night stay as they are: their bytes are copied as they
+			# are and only the rest is written.  This goes to a copy that replaces the file when it
+			# is complete, so an interrupted run leaves the old output in place
+			cut = bisect.bisect_left(oldDays, min(days))
+			tail = {}
+			for n in range(cut, len(oldRows)):
+				tail[oldDays[n]] = oldRows[n]
+			tail.update(rebuilt)
+			tmpPath = outPath + '.part'
+			fh = open(tmpPath, 'w', newline='', buffering=WRITE_BUFFER)
+			try:
+				with open(outPath, 'rb') as old:
+					copy_bytes(old, fh.buffer, offsets[cut] if cut < len(offsets) else None)
+				w = csv.writer(fh, delimiter=',')
+				w.writerows([tail[day] for day in sorted(tail)])
+				fh.close()
+			except BaseException:
+				fh.close()
+				os.remove(tmpPath)
+				raise
+			os.replace(tmpPath, outPath)
+		else:
+			merged = {}
+			for day, row in zip(oldDays, oldRows):
+				merged[day] = row
+			merged.update(rebuilt)
+			write_csv(outPath, outHeader, [merged[day] for day in sorted(merged)], progress)
+	report.finish()
+	return(len(outList))
+
+
+## aligns actigraphy data file and sleep log data file by date and writes the result to outPath
+## cache is an optional SleepCache.ParseCache used instead of parsing the files again
+## returns the number of aligned rows
+## report is an optional SleepProfile.RunReport
+## scoring ('fill' or 'replace') takes actigraphy intervals from epoch scoring, see score_inputs()
+def align_files(actFile, logFile, outPath, progress=None, cache=None, report=None, scoring=None):
+	if report is None:
+		report = SleepProfile.NULL_REPORT
+	else:
+		progress = counting_progress(progress, report)
+
+	act, log = read_inputs(actFile, logFile, progress, cache, report)
+	if scoring:
+		act = score_inputs(actFile, act, scoring, cache, report)
+	ID, actHeader, restList, activeList, sleepList, dailyList = act
+	logHeader, logData = log
+	with report.stage('join'):
+		nights = link_nights(logData, restList, activeList, sleepList, dailyList)
+	count_nights(nights, report)
+	# rows are written as they are built, so rows and write share one stage
+	outHeader = build_header(logHeader, actHeader)[0]
+	with report.stage('rows_write'):
+		count = write_output(outPath, outHeader,
+								count_cells(iter_rows(ID, logHeader, actHeader, nights, progress), report),
+								progress)
+	report.finish()
+	return(count)
@@ -0,0 +1,242 @@
+## Sleep Aligner memory mapped actigraphy export reader
+## An Actiware export is a few metadata rows, then sections each starting with a banner row such as
+## '-------------------- Statistics --------------------': the Interval Type statistics table, a
+## marker list and, taking up most of the file, the epoch-by-epoch data.  The export is memory
+## mapped and sections are found by searching the raw bytes, so only the statistics rows are ever
+## decoded and tokenized, wherever they sit in the file.  Epoch data is available through
+## epochs(), a view that decodes rows only as they are asked for.
+
+## Rows are taken to be one line each (no quoted line breaks), as Actiware writes them.
+
+## Usage:
+##   with SleepExport.ActigraphyExport(path) as export:
+##       ID, actHeader, restList, activeList, sleepList, dailyList = export.statistics()
+##       epochs = export.epochs()
+##       print(len(epochs), epochs.header, epochs[0])
+
+
+import csv
+import mmap
+import array
+
+import SleepEngine
+
+
+BANNER = (b'-----', b'"-----')
+STATS_HEADER = (b'Interval Type,', b'"Interval Type",')
+EPOCH_HEADER = (b'Line,', b'"Line",')
+FULL_NAME = (b'Full Name:', b'"Full Name:"')
+
+# bytes of epoch data split into rows at a time by EpochView.raw_column()
+BLOCK_BYTES = 8 * 1024 * 1024
+
+
+# offset of the first line at or after start beginning with one of prefixes, or -1
+# Once one prefix is found the others are only looked for before it, so the search never reads
+# further into the file than it has to
+def find_line(mm, prefixes, start=0, end=None):
+	if end is None:
+		end = len(mm)
+	found = -1
+	for prefix in prefixes:
+		if (start == 0 or mm[start-1:start] == b'\n') and mm[start:start + len(prefix)] == prefix:
+			return(start)
+		pos = mm.find(b'\n' + prefix, start, end)
+		if pos != -1:
+			found = pos + 1
+			end = pos
+	return(found)
+
+
+# offset just past the line starting at pos
+def next_line(mm, pos, end=None):
+	if end is None:
+		end = len(mm)
+	nl = mm.find(b'\n', pos, end)
+	return(end if nl == -1 else nl + 1)
+
+
+# cells of one raw line
+def split_line(line):
+	line = line.rstrip(b'\r\n').decode('utf-8', 'replace')
+	if '"' not in line:
+		return(line.split(','))
+	return(next(csv.reader([line])))
+
+
+class ActigraphyExport(object):
+	def __init__(self, path):
+		self.path = path
+		self.fh = open(path, 'rb')
+		try:
+			# ValueError for an empty file, OSError for things that cannot be mapped (pipes)
+			self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+		except BaseException:
+			self.fh.close()
+			raise
+		self.bannerIndex = None
+
+
+	def __enter__(self):
+		return(self)
+
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+	## unmaps the file; views from epochs() can not be used after this
+	def close(self):
+		self.mm.close()
+		self.fh.close()
+
+
+	## [(section name, offset of its banner row)] for every section, in file order.  Built on
+	## first use, with one pass over the raw bytes
+	def sections(self):
+		if self.bannerIndex is None:
+			self.bannerIndex = []
+			pos = find_line(self.mm, BANNER)
+			while pos != -1:
+				end = next_line(self.mm, pos)
+				name = self.mm[pos:end].decode('utf-8', 'replace').strip(' -,"\r\n')
+				self.bannerIndex.append((name, pos))
+				pos = find_line(self.mm, BANNER, end)
+		return(self.bannerIndex)
+
+
+	# (start, end) byte range of the table whose header row starts with one of prefixes; it ends at
+	# the next banner or epoch table header.  None if there is no such table
+	def table(self, prefixes):
+		start = find_line(self.mm, prefixes)
+		if start == -1:
+			return(None)
+		end = find_line(self.mm, BANNER + EPOCH_HEADER, next_line(self.mm, start))
+		return(start, len(self.mm) if end == -1 else end)
+
+
+	## ID, header and REST, ACTIVE, SLEEP, DAILY rows, same as SleepEngine.split_actigraphy()
+	def statistics(self, progress=None):
+		rows = []
+		pos = find_line(self.mm, FULL_NAME)
+		if pos != -1:
+			rows.append(split_line(self.mm[pos:next_line(self.mm, pos)]))
+		span = self.table(STATS_HEADER)
+		if span is not None:
+			rows.extend(split_line(line) for line in self.mm[span[0]:span[1]].splitlines())
+		return(SleepEngine.split_actigraphy(rows, progress))
+
+
+	## lazy view of the epoch-by-epoch table, or None if the export has none
+	def epochs(self):
+		start = find_line(self.mm, EPOCH_HEADER)
+		if start == -1:
+			return(None)
+		end = find_line(self.mm, BANNER, next_line(self.mm, start))
+		return(EpochView(self.mm, start, len(self.mm) if end == -1 else end))
+
+
+## epoch-by-epoch rows of an export, decoded only when asked for.  Iterating streams the rows;
+## len() and indexing build an offset index of the rows on first use (8 bytes per row)
+class EpochView(object):
+	def __init__(self, mm, start, end):
+		self.mm = mm
+		self.first = next_line(mm, start, end)
+		self.end = end
+		self.header = split_line(mm[start:self.first])
+		self.offsets = None
+
+
+	# (start, end) of each non-empty line
+	def spans(self):
+		mm = self.mm
+		pos = self.first
+		while pos < self.end:
+			nl = mm.find(b'\n', pos, self.end)
+			stop = self.end if nl == -1 else nl
+			if stop > pos and mm[pos:stop] != b'\r':
+				yield(pos, stop)
+			pos = stop + 1
+
+
+	def __iter__(self):
+		for start, stop in self.spans():
+			yield(split_line(self.mm[start:stop]))
+
+
+	def index(self):
+		if self.offsets is None:
+			self.offsets = array.array('q')
+			for start, stop in self.spans():
+				self.offsets.append(start)
+			self.offsets.append(self.end)
+		return(self.offsets)
+
+
+	def __len__(self):
+		return(len(self.index()) - 1)
+
+
+	def __getitem__(self, n):
+		offsets = self.index()
+		if n < 0:
+			n += len(offsets) - 1
+		if not 0 <= n < len(offsets) - 1:
+			raise IndexError('epoch row out of range')
+		return(split_line(self.mm[offsets[n]:next_line(self.mm, offsets[n], self.end)]))
+
+
+	## cells of one named column, streamed
+	def column(self, name):
+		col = self.header.index(name)
+		for row in self:
+			yield(row[col] if col < len(row) else '')
+
+
+	## last row, or None if there are no rows
+	def last_row(self):
+		stop = self.end
+		while stop > self.first:
+			start = self.mm.rfind(b'\n', self.first, stop - 1) + 1
+			if start == 0:
+				start = self.first
+			line = self.mm[start:stop].strip(b'\r\n')
+			if line:
+				return(split_line(line))
+			stop = start
+		return(None)
+
+
+	## one named column as lists of undecoded bytes cells, a block of rows at a time.  Much
+	## faster than column() for numeric columns, e.g. numpy.array(cells).astype(float)
+	def raw_column(self, name, blockBytes=BLOCK_BYTES):
+		col = self.header.index(name)
+		pos = self.first
+		while pos < self.end:
+			stop = min(self.end, pos + blockBytes)
+			if stop < self.end:
+				stop = next_line(self.mm, stop, self.end)
+			block = self.mm[pos:stop]
+			pos = stop
+			if b'"' in block:
+				yield([row[col].encode('utf-8') if col < len(row) else b''
+						for row in map(split_line, block.splitlines()) if row != ['']])
+				continue
+			cells = []
+			for line in block.split(b'\n'):
+				if line and line != b'\r':
+					parts = line.split(b',', col + 1)
+					cells.append(parts[col].rstrip(b'\r') if col < len(parts) else b'')
+			yield(cells)
+
+
+## reads the statistics of an actigraphy export through a memory map, or by streaming the file
+## if it cannot be mapped.  Same result as SleepEngine.split_actigraphy()
+def read_actigraphy(path, progress=None):
+	try:
+		export = ActigraphyExport(path)
+	except (ValueError, OSError):
+		with open(path, 'r') as inFile:
+			return(SleepEngine.split_actigraphy(csv.reader(inFile), progress))
+	with export:
+		return(export.statistics(progress))
@@ -0,0 +1,222 @@
+## Sleep Aligner pipelined runs
+## Overlaps the three parts of aligning a list of subjects: a thread reads (and parses) the input
+## files of the next subjects while the current subject is aligned, and another thread writes the
+## output of the previous ones.  The queues between them hold at most DEPTH subjects, so a slow
+## stage holds back the others instead of letting parsed inputs or built rows pile up in memory.
+## On slow or network storage a run then takes about as long as its slowest stage rather than the
+## sum of all of them.  Everything runs in one process; SleepBatch.py --jobs uses processes instead.
+
+## Usage:
+##   python SleepBatch.py --dir DATA_FOLDER --out OUTPUT_FOLDER --pipeline
+##   for key, ok, msg, secs, report in SleepPipeline.run_pipeline(jobs):
+##       ...
+## where jobs are (key, act, log, out) and the results are the same as SleepBatch.align_job()'s.
+
+
+import queue
+import threading
+
+import SleepEngine
+import SleepCache
+import SleepProfile
+
+
+# subjects waiting between two stages
+DEPTH = 2
+
+# seconds between checks for a stopped pipeline while a queue is full
+POLL_SECONDS = 0.1
+
+
+# puts item on a bounded queue, giving up once stop is set.  Returns False if it gave up
+def put_until(q, item, stop):
+	while not stop.is_set():
+		try:
+			q.put(item, timeout=POLL_SECONDS)
+			return(True)
+		except queue.Full:
+			pass
+	return(False)
+
+
+## calls func(item) for each item on a background thread, at most depth items ahead of the
+## caller, and yields (item, result, error) in item order.  error is the exception func raised
+## (result is then None).  Closing the generator early stops the thread.  depth 0 calls func
+## in the caller's thread, one item at a time
+def prefetch(func, items, depth=DEPTH):
+	if depth <= 0:
+		for item in items:
+			try:
+				result = func(item)
+			except Exception as e:
+				yield((item, None, e))
+			else:
+				yield((item, result, None))
+		return
+
+	items = list(items)
+	out = queue.Queue(depth)
+	stop = threading.Event()
+
+	def run():
+		for item in items:
+			try:
+				result = (item, func(item), None)
+			except Exception as e:
+				result = (item, None, e)
+			if not put_until(out, result, stop):
+				return
+
+	thread = threading.Thread(target=run, name='prefetch', daemon=True)
+	thread.start()
+	try:
+		for n in range(len(items)):
+			yield(out.get())
+	finally:
+		stop.set()
+		thread.join()
+
+
+## runs the calls given to put() on a background thread, in order, with at most depth calls
+## waiting.  An exception in a call stops the stage and is raised again from the next put() or
+## from close().  depth 0 runs each call right away in the caller's thread
+class Stage(object):
+	def __init__(self, depth=DEPTH, name='stage'):
+		self.calls = queue.Queue(max(depth, 1))
+		self.stop = threading.Event()
+		self.error = None
+		self.thread = None
+		if depth > 0:
+			self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+			self.thread.start()
+
+
+	def __enter__(self):
+		return(self)
+
+
+	def __exit__(self, excType, exc, tb):
+		if excType is None:
+			self.close()
+		else:
+			self.abort()
+
+
+	def run(self):
+		while True:
+			call = self.calls.get()
+			if call is None or self.stop.is_set():
+				return
+			try:
+				call[0](*call[1:])
+			except BaseException as e:
+				self.error = e
+				self.stop.set()
+				return
+
+
+	## queues func(*args); blocks while depth calls are already waiting
+	def put(self, func, *args):
+		if self.thread is None:
+			func(*args)
+		elif not put_until(self.calls, (func,) + args, self.stop) or self.error is not None:
+			self.raise_error()
+
+
+	## waits for the queued calls to finish
+	def close(self):
+		if self.thread is not None:
+			put_until(self.calls, None, self.stop)
+			self.thread.join()
+		self.raise_error()
+
+
+	## drops the queued calls and waits for the running one
+	def abort(self):
+		self.stop.set()
+		if self.thread is not None:
+			# the thread may be waiting for a call: empty the queue and wake it with None.  Only
+			# the caller puts calls, so there is room for it once the queue is empty
+			while True:
+				try:
+					self.calls.get_nowait()
+				except queue.Empty:
+					break
+			self.calls.put_nowait(None)
+			self.thread.join()
+
+
+	def raise_error(self):
+		if self.error is not None:
+			raise self.error
+
+
+# read stage of run_pipeline(): (report, act, log, error) of one job; error is a message or None
+def read_job(job, cache, scoring, profile):
+	key, act, log, out = job
+	report = SleepProfile.RunReport(profile)
+	report.info.update({'subject': key, 'act_file': act, 'log_file': log, 'out_file': out})
+	try:
+		actData, logData = SleepEngine.read_inputs(act, log, cache=cache, report=report)
+		if scoring:
+			actData = SleepEngine.score_inputs(act, actData, scoring, cache, report)
+	except Exception as e:
+		return(report, None, None, '%s: %s' % (type(e).__name__, e))
+	return(report, actData, logData, None)
+
+
+# align stage: the output header and rows of one subject, built in memory for the write stage
+def align_data(report, actData, logData):
+	ID, actHeader, restList, activeList, sleepList, dailyList = actData
+	logHeader, logData = logData
+	with report.stage('join'):
+		nights = SleepEngine.link_nights(logData, restList, activeList, sleepList, dailyList)
+	SleepEngine.count_nights(nights, report)
+	with report.stage('rows'):
+		outHeader, outList = SleepEngine.build_rows(ID, logHeader, actHeader, nights)
+		outList = list(SleepEngine.count_cells(outList, report))
+	return(outHeader, outList)
+
+
+## aligns (key, act, log, out) jobs with reads, alignment and writes overlapped.  Yields one
+## SleepBatch.align_job() style result (key, ok, message, seconds, report dictionary) per job, in
+## job order.  seconds is the time spent on the subject's stages, not counting time it waited in a
+## queue.  depth 0 runs the stages one after the other.  cacheDir, scoring and profile are as
+## for SleepBatch.run_batch()
+def run_pipeline(jobs, depth=DEPTH, cacheDir=None, scoring=None, profile=False):
+	cache = SleepCache.ParseCache(cacheDir) if cacheDir else None
+	done = queue.Queue()
+
+	# write stage.  Failed subjects pass through it too, so results stay in job order
+	def write(key, report, outPath, outHeader, outList, error):
+		if error is None:
+			try:
+				with report.stage('write'):
+					SleepEngine.write_output(outPath, outHeader, outList)
+			except Exception as e:
+				error = '%s: %s' % (type(e).__name__, e)
+		report.finish()
+		if error is not None and report.error is None:
+			report.error = error
+		done.put((key, error is None, error or outPath, sum(report.stages.values()), report.as_dict()))
+
+	jobs = list(jobs)
+	yielded = 0
+	with Stage(depth, 'write') as writer:
+		for job, data, error in prefetch(lambda job: read_job(job, cache, scoring, profile), jobs, depth):
+			key, act, log, out = job
+			report, actData, logData, error = data
+			outHeader = outList = None
+			if error is None:
+				try:
+					outHeader, outList = align_data(report, actData, logData)
+				except Exception as e:
+					error = '%s: %s' % (type(e).__name__, e)
+			writer.put(write, key, report, out, outHeader, outList, error)
+			data = actData = logData = outList = None
+			while not done.empty():
+				yield(done.get())
+				yielded += 1
+	while yielded < len(jobs):
+		yield(done.get())
+		yielded += 1
@@ -0,0 +1,324 @@
+## Sleep Aligner result preview
+## Shows an aligned output file (CSV, Parquet or Feather) in a table inside the app, without
+## loading it.  Only the rows the view asks for are read: CSV files get an index of the byte
+## offset of every BLOCK_ROWS-th row, built a slice at a time while the preview is open, and rows
+## are parsed a block at a time when they scroll into view.  Parquet and Feather files are read a
+## row group / record batch at a time.  At most CACHE_BLOCKS blocks are kept, so memory stays the
+## same however long the file is.
+## 'N/A' cells are greyed out and DIF_* cells over the highlight threshold are marked in red.
+
+## Usage:
+##   dialog = SleepPreview.PreviewDialog('result_file.csv', parent)
+##   dialog.show()
+
+
+import os
+import csv
+import array
+import bisect
+import collections
+
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QTableView, QLabel, QSpinBox, QHeaderView
+from PyQt5.QtGui import QColor, QBrush
+from PyQt5 import QtCore
+
+import SleepEngine
+
+
+# rows per CSV index entry and per parsed block
+BLOCK_ROWS = 256
+
+# parsed blocks kept in memory
+CACHE_BLOCKS = 16
+
+# CSV rows indexed per fetchMore() call
+FETCH_ROWS = 4096
+
+# default DIF_* highlight threshold, minutes
+LARGE_DIF_MINUTES = 60
+
+NA_BRUSH = QBrush(QColor('#eeeeee'))
+NA_TEXT = QBrush(QColor('#888888'))
+LARGE_DIF_BRUSH = QBrush(QColor('#f4c7c3'))
+
+
+## rows of an output CSV file, indexed as far as scan() has got
+class CsvSource(object):
+	def __init__(self, path):
+		self.path = path
+		self.scanFile = open(path, 'rb')
+		self.readFile = open(path, 'rb')
+		self.position = 0
+		self.reader = csv.reader(self.lines(self.scanFile))
+		self.header = next(self.reader, None) or []
+		# byte offset of rows 0, BLOCK_ROWS, 2 * BLOCK_ROWS, ...
+		self.starts = array.array('q')
+		self.count = 0
+		self.complete = False
+		self.blocks = collections.OrderedDict()
+
+
+	# decoded lines of fh, keeping self.position at the start of the next line
+	def lines(self, fh):
+		for line in fh:
+			self.position += len(line)
+			yield(line.decode('utf-8', 'replace'))
+
+
+	## indexes up to n more rows.  Returns the number of rows indexed so far
+	def scan(self, n):
+		stop = self.count + n
+		while not self.complete and self.count < stop:
+			start = self.position
+			row = next(self.reader, None)
+			if row is None:
+				self.complete = True
+			elif row:
+				if self.count % BLOCK_ROWS == 0:
+					self.starts.append(start)
+				self.count += 1
+		return(self.count)
+
+
+	## row n (as a list of strings); n must be below count
+	def row(self, n):
+		block, k = divmod(n, BLOCK_ROWS)
+		rows = self.blocks.get(block)
+		if rows is None:
+			self.readFile.seek(self.starts[block])
+			rows = []
+			for row in csv.reader(line.decode('utf-8', 'replace') for line in self.readFile):
+				if row:
+					rows.append(row)
+					if len(rows) == BLOCK_ROWS:
+						break
+			self.blocks[block] = rows
+			if len(self.blocks) > CACHE_BLOCKS:
+				self.blocks.popitem(last=False)
+		else:
+			self.blocks.move_to_end(block)
+		return(rows[k])
+
+
+	def close(self):
+		self.scanFile.close()
+		self.readFile.close()
+
+
+## rows of an output Parquet or Feather file, read a row group / record batch at a time
+class ColumnarSource(object):
+	def __init__(self, path):
+		import SleepColumnar
+		pa = SleepColumnar.import_pyarrow()
+		self.path = path
+		if os.path.splitext(path)[1].lower() == '.parquet':
+			self.file = pa.parquet.ParquetFile(path)
+			self.header = self.file.schema_arrow.names
+			sizes = [self.file.metadata.row_group(n).num_rows for n in range(self.file.num_row_groups)]
+			self.read = lambda n: self.file.read_row_group(n)
+			self.map = None
+		else:
+			self.map = pa.memory_map(path)
+			self.file = pa.ipc.open_file(self.map)
+			self.header = self.file.schema.names
+			sizes = [self.file.get_batch(n).num_rows for n in range(self.file.num_record_batches)]
+			self.read = lambda n: self.file.get_batch(n)
+		# first row of each batch
+		self.firsts = []
+		self.count = 0
+		for size in sizes:
+			self.firsts.append(self.count)
+			self.count += size
+		self.complete = True
+		self.seconds = [name.startswith('ACT_') for name in self.header]
+		self.blocks = collections.OrderedDict()
+
+
+	def scan(self, n):
+		return(self.count)
+
+
+	def row(self, n):
+		batch = bisect.bisect_right(self.firsts, n) - 1
+		rows = self.blocks.get(batch)
+		if rows is None:
+			rows = [[cell_text(value, seconds) for value, seconds in zip(row, self.seconds)]
+					for row in zip(*[column.to_pylist() for column in self.read(batch).columns])]
+			self.blocks[batch] = rows
+			if len(self.blocks) > CACHE_BLOCKS:
+				self.blocks.popitem(last=False)
+		else:
+			self.blocks.move_to_end(batch)
+		return(rows[n - self.firsts[batch]])
+
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+
+
+# CSV style text of a typed columnar value
+def cell_text(value, seconds=False):
+	if value is None:
+		return('N/A')
+	if hasattr(value, 'total_seconds'):
+		hr, rest = divmod(int(value.total_seconds()), 3600)
+		return('%d:%d:%d' % (hr, rest // 60, rest % 60))
+	if hasattr(value, 'hour'):
+		return(SleepEngine.format_date(value.toordinal()) + ' ' +
+				SleepEngine.format_clock((value.hour * 3600) + (value.minute * 60) + value.second, seconds))
+	if hasattr(value, 'toordinal'):
+		return(SleepEngine.format_date(value.toordinal()))
+	return(str(value))
+
+
+## the source for an output file, by its extension
+def open_source(path):
+	if os.path.splitext(path)[1].lower() in SleepEngine.COLUMNAR_FORMATS:
+		return(ColumnarSource(path))
+	return(CsvSource(path))
+
+
+## table model over a CsvSource/ColumnarSource.  Rows are added with Qt's fetchMore() as the
+## CSV index grows
+class ResultModel(QtCore.QAbstractTableModel):
+	def __init__(self, source, parent=None):
+		super().__init__(parent)
+		self.source = source
+		self.header = source.header
+		self.difCols = set(n for n, name in enumerate(self.header) if name.startswith('DIF_'))
+		self.largeDif = LARGE_DIF_MINUTES * 60
+		self.loaded = 0
+
+
+	def rowCount(self, parent=QtCore.QModelIndex()):
+		return(0 if parent.isValid() else self.loaded)
+
+
+	def columnCount(self, parent=QtCore.QModelIndex()):
+		return(0 if parent.isValid() else len(self.header))
+
+
+	def canFetchMore(self, parent=QtCore.QModelIndex()):
+		return(not parent.isValid() and (not self.source.complete or self.loaded < self.source.count))
+
+
+	def fetchMore(self, parent=QtCore.QModelIndex()):
+		if parent.isValid():
+			return
+		count = self.source.scan(FETCH_ROWS)
+		if count > self.loaded:
+			self.beginInsertRows(QtCore.QModelIndex(), self.loaded, count - 1)
+			self.loaded = count
+			self.endInsertRows()
+
+
+	# text of one cell
+	def cell(self, row, col):
+		cells = self.source.row(row)
+		return(cells[col] if col < len(cells) else '')
+
+
+	def data(self, index, role=QtCore.Qt.DisplayRole):
+		if not index.isValid():
+			return(None)
+		if role == QtCore.Qt.DisplayRole:
+			return(self.cell(index.row(), index.column()))
+		if role in (QtCore.Qt.BackgroundRole, QtCore.Qt.ForegroundRole):
+			text = self.cell(index.row(), index.column())
+			if text == 'N/A':
+				return(NA_BRUSH if role == QtCore.Qt.BackgroundRole else NA_TEXT)
+			if role == QtCore.Qt.BackgroundRole and index.column() in self.difCols and \
+					dif_seconds(text) >= self.largeDif:
+				return(LARGE_DIF_BRUSH)
+		return(None)
+
+
+	def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+		if role != QtCore.Qt.DisplayRole:
+			return(None)
+		if orientation == QtCore.Qt.Horizontal:
+			return(self.header[section] if section < len(self.header) else None)
+		return(str(section + 1))
+
+
+	## sets the DIF_* highlight threshold (minutes) and repaints
+	def set_large_dif(self, minutes):
+		self.largeDif = minutes * 60
+		if self.loaded:
+			self.dataChanged.emit(self.index(0, 0), self.index(self.loaded - 1, len(self.header) - 1),
+									[QtCore.Qt.BackgroundRole])
+
+
+# seconds of a DIF_* cell ('h:m:s'), -1 if it is not a time
+def dif_seconds(text):
+	try:
+		hr, min, sec = SleepEngine.split_time(text)
+	except (ValueError, IndexError):
+		return(-1)
+	return((hr * 3600) + (min * 60) + sec)
+
+
+## non-modal window with the preview of one output file
+class PreviewDialog(QDialog):
+	def __init__(self, path, parent=None):
+		super().__init__(parent)
+		self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+		self.setWindowTitle('Preview - ' + os.path.basename(path))
+		self.resize(900, 500)
+		self.source = open_source(path)
+		self.model = ResultModel(self.source, self)
+
+		self.table = QTableView(self)
+		self.table.setModel(self.model)
+		self.table.setWordWrap(False)
+		# fixed row heights, so the view never measures rows it does not show
+		self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+		self.table.verticalHeader().setDefaultSectionSize(self.table.fontMetrics().height() + 6)
+		self.table.horizontalHeader().setDefaultSectionSize(140)
+
+		self.rows = QLabel(self)
+		self.threshold = QSpinBox(self)
+		self.threshold.setRange(1, 24 * 60)
+		self.threshold.setValue(LARGE_DIF_MINUTES)
+		self.threshold.setSuffix(' min')
+		self.threshold.setToolTip('DIF_* values of at least this much are marked in red')
+		self.threshold.valueChanged.connect(self.model.set_large_dif)
+
+		bar = QHBoxLayout()
+		bar.addWidget(self.rows)
+		bar.addStretch(1)
+		bar.addWidget(QLabel('Highlight differences over', self))
+		bar.addWidget(self.threshold)
+		layout = QVBoxLayout(self)
+		layout.addWidget(self.table)
+		layout.addLayout(bar)
+
+		## the CSV index is built a slice at a time from the event loop, so the window stays
+		## responsive and the scroll bar grows to the full file
+		self.indexer = QtCore.QTimer(self)
+		self.indexer.timeout.connect(self.index_more)
+		self.model.fetchMore()
+		self.show_count()
+		if self.model.canFetchMore():
+			self.indexer.start(0)
+
+
+	def index_more(self):
+		self.model.fetchMore()
+		self.show_count()
+		if not self.model.canFetchMore():
+			self.indexer.stop()
+
+
+	def show_count(self):
+		text = '{:,} rows'.format(self.model.loaded)
+		if not self.source.complete:
+			text += ' (counting...)'
+		self.rows.setText(text)
+
+
+	def closeEvent(self, event):
+		self.indexer.stop()
+		self.source.close()
+		event.accept()
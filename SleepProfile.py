@@ -0,0 +1,159 @@
+## Sleep Aligner run instrumentation
+## A RunReport collects named stage timers, counters and (optionally) a cProfile capture for one
+## alignment run.  SleepEngine.align_files fills one in when it is passed as report=; the window
+## shows it after a run and SleepBatch.py writes it out as JSON (--report).
+
+## Usage:
+##   report = SleepProfile.RunReport(profile=True)
+##   SleepEngine.align_files(actFile, logFile, outPath, report=report)
+##   print(report.summary())
+##   json.dump(report.as_dict(), fh)
+
+
+import io
+import time
+import contextlib
+
+
+# number of functions listed in the profile part of a report
+PROFILE_LINES = 25
+
+
+class RunReport(object):
+	def __init__(self, profile=False):
+		self.stages = {}
+		self.order = []
+		self.counters = {}
+		self.info = {}
+		self.warnings = []
+		self.error = None
+		self.failedStage = None
+		self.profiler = None
+		if profile:
+			# cProfile and pstats are only loaded when a capture is asked for (slow to import)
+			import cProfile
+			self.profiler = cProfile.Profile()
+		self.started = time.perf_counter()
+		self.finished = None
+
+
+	## times the code inside a 'with report.stage(name):' block.  Time adds up if a stage name is
+	## used more than once.  An exception inside the block is recorded along with the stage name
+	@contextlib.contextmanager
+	def stage(self, name):
+		if name not in self.stages:
+			self.stages[name] = 0.0
+			self.order.append(name)
+		if self.profiler is not None:
+			self.profiler.enable()
+		start = time.perf_counter()
+		try:
+			yield
+		except BaseException as e:
+			if self.failedStage is None:
+				self.failedStage = name
+				self.error = '%s: %s' % (type(e).__name__, e)
+			raise
+		finally:
+			self.stages[name] += time.perf_counter() - start
+			if self.profiler is not None:
+				self.profiler.disable()
+
+
+	## adds n to a named counter
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+
+	## sets a counter to a value
+	def set(self, name, value):
+		self.counters[name] = value
+
+
+	## notes something about the run that did not stop it (e.g. an input file warning)
+	def warn(self, message):
+		self.warnings.append(message)
+
+
+	## marks the end of the run
+	def finish(self):
+		self.finished = time.perf_counter()
+
+
+	def total(self):
+		end = self.finished if self.finished is not None else time.perf_counter()
+		return(end - self.started)
+
+
+	## the top functions of the cProfile capture as text, or '' if profiling is off
+	def profile_text(self, lines=PROFILE_LINES):
+		if self.profiler is None:
+			return('')
+		import pstats
+		out = io.StringIO()
+		try:
+			stats = pstats.Stats(self.profiler, stream=out)
+		except TypeError:
+			# nothing was profiled
+			return('')
+		stats.sort_stats('cumulative').print_stats(lines)
+		return(out.getvalue())
+
+
+	## machine readable form of the report (for JSON)
+	def as_dict(self):
+		out = dict(self.info)
+		out['ok'] = self.error is None
+		out['error'] = self.error
+		out['failed_stage'] = self.failedStage
+		out['warnings'] = list(self.warnings)
+		out['total_seconds'] = self.total()
+		out['stages'] = dict((name, self.stages[name]) for name in self.order)
+		out['counters'] = dict(self.counters)
+		if self.profiler is not None:
+			out['profile'] = self.profile_text()
+		return(out)
+
+
+	## human readable form of the report
+	def summary(self):
+		lines = []
+		if self.error is not None:
+			lines.append('Failed in %s: %s' % (self.failedStage, self.error))
+			lines.append('')
+		for message in self.warnings:
+			lines.append('Warning: ' + message)
+		if self.warnings:
+			lines.append('')
+		total = self.total()
+		lines.append('%-18s %9s %7s' % ('Stage', 'Seconds', 'Share'))
+		for name in self.order:
+			share = 100.0 * self.stages[name] / total if total else 0.0
+			lines.append('%-18s %9.4f %6.1f%%' % (name, self.stages[name], share))
+		lines.append('%-18s %9.4f' % ('total', total))
+		lines.append('')
+		for name in sorted(self.counters):
+			lines.append('%-26s %d' % (name, self.counters[name]))
+		return('\n'.join(lines))
+
+
+## stands in for a RunReport when none is wanted; every call is a no-op
+class NullReport(object):
+	@contextlib.contextmanager
+	def stage(self, name):
+		yield
+
+	def count(self, name, n=1):
+		pass
+
+	def set(self, name, value):
+		pass
+
+	def warn(self, message):
+		pass
+
+	def finish(self):
+		pass
+
+
+NULL_REPORT = NullReport()
@@ -0,0 +1,245 @@
+## Sleep Aligner epoch scoring
+## Scores the epoch-by-epoch activity counts of an Actiware export as sleep or wake and derives
+## REST, SLEEP and ACTIVE intervals from them, laid out like the export's own Interval Type
+## statistics rows.  SleepEngine uses them in place of (scoring='replace') or in addition to
+## (scoring='fill', only for nights Actiware has no SLEEP interval for) the exported intervals, so
+## they feed the same ACT_* columns.
+
+## Scoring is a weighted moving sum of activity counts, done with one numpy correlation over the
+## whole recording:
+##   actiware      Actiware (Oakley) rule: the epoch's count plus 1/5 of the counts within one
+##                 minute and 1/25 of those within two minutes; wake above THRESHOLD counts
+##   cole-kripke   Cole-Kripke (1992) 1 minute weights over minutes -4..+2, counts per minute
+##                 scaled by 1/100 and capped at 300; sleep when the sum is below 1
+## Off-wrist (NaN or empty) epochs are scored as wake.
+
+## Per noon-to-noon night, runs of at least MIN_BOUT minutes of sleep are grouped into periods
+## (wake gaps up to MAX_GAP minutes) and the period with the most sleep is the main sleep interval.
+## The REST interval is the SLEEP interval widened while the 10 minute mean activity stays under
+## REST_LEVEL.  numpy is only needed when scoring is asked for.
+
+## Usage:
+##   SleepEngine.align_files(actFile, logFile, outPath, scoring='fill')
+##   rest, active, sleep, nights = SleepScore.score_export(actFile)
+
+
+import numpy as np
+
+import SleepEngine
+import SleepExport
+
+
+DEFAULT_ALGORITHM = 'actiware'
+
+# Actiware 'medium' wake threshold
+THRESHOLD = 40.0
+# Cole-Kripke weights for minutes -4 .. +2, and their scale
+COLE_KRIPKE = (106, 54, 58, 76, 230, 74, 67)
+COLE_KRIPKE_SCALE = 0.001 / 100
+
+# minutes
+MIN_BOUT = 10
+MAX_GAP = 60
+REST_WINDOW = 10
+
+# mean counts per epoch under which the REST interval is widened
+REST_LEVEL = 20.0
+
+
+class ScoringError(Exception):
+	pass
+
+
+## epoch length (seconds), first epoch time (seconds since 1/1/0001) and activity counts of an
+## export's epoch-by-epoch table
+def read_epochs(path):
+	with SleepExport.ActigraphyExport(path) as export:
+		epochs = export.epochs()
+		if epochs is None:
+			raise ScoringError('No epoch-by-epoch data in %s' % path)
+		if not set(('Date', 'Time', 'Activity')) <= set(epochs.header):
+			raise ScoringError('Epoch data needs Date, Time and Activity columns')
+		dateCol = epochs.header.index('Date')
+		timeCol = epochs.header.index('Time')
+		rows = []
+		for row in epochs:
+			rows.append(row)
+			if len(rows) == 2:
+				break
+		if len(rows) < 2:
+			raise ScoringError('Too few epochs to score in %s' % path)
+		last = epochs.last_row()
+		stamps = [SleepEngine.stamp_seconds(row[dateCol], row[timeCol]) for row in rows + [last]]
+		counts = []
+		for cells in epochs.raw_column('Activity'):
+			cells = np.array(cells)
+			cells[cells == b''] = b'nan'
+			counts.append(cells.astype(float))
+		counts = np.concatenate(counts)
+
+	epoch = stamps[1] - stamps[0]
+	if epoch <= 0 or stamps[2] - stamps[0] != epoch * (len(counts) - 1):
+		raise ScoringError('Epoch data is not evenly spaced')
+	return(epoch, stamps[0], counts)
+
+
+# weighted moving sum: out[i] = sum(weights[k] * counts[i + k - before])
+def window_sum(counts, weights, before):
+	after = len(weights) - before - 1
+	padded = np.concatenate((np.zeros(before), counts, np.zeros(after)))
+	return(np.correlate(padded, np.asarray(weights, dtype=float), 'valid'))
+
+
+## True for each epoch scored as sleep
+def score(counts, epoch, algorithm=DEFAULT_ALGORITHM, threshold=THRESHOLD):
+	missing = np.isnan(counts)
+	counts = np.where(missing, 0.0, counts)
+	if algorithm == 'actiware':
+		reach = 120 // epoch
+		weights = [1.0 / 5 if abs(k) * epoch <= 60 else 1.0 / 25 for k in range(-reach, reach + 1)]
+		weights[reach] = 1.0
+		asleep = window_sum(counts, weights, reach) <= threshold
+	elif algorithm == 'cole-kripke':
+		# per minute counts: sum the epochs of each minute, or spread longer epochs
+		if epoch <= 60 and 60 % epoch == 0:
+			per = 60 // epoch
+			size = (len(counts) + per - 1) // per
+			minutes = np.zeros(size * per)
+			minutes[:len(counts)] = counts
+			minutes = minutes.reshape(size, per).sum(axis=1)
+			sums = window_sum(np.minimum(minutes, 30000.0), COLE_KRIPKE, 4) * COLE_KRIPKE_SCALE
+			asleep = np.repeat(sums < 1.0, per)[:len(counts)]
+		else:
+			minutes = counts * (60.0 / epoch)
+			sums = window_sum(np.minimum(minutes, 30000.0), COLE_KRIPKE, 4) * COLE_KRIPKE_SCALE
+			asleep = sums < 1.0
+	else:
+		raise ScoringError('Unknown scoring algorithm: %s' % algorithm)
+	return(asleep & ~missing)
+
+
+# (start, end) epoch index pairs of the runs of True in a boolean array, end exclusive
+def runs(flags):
+	edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+	return(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+
+## main sleep interval of each night: [(night, start epoch, end epoch, epochs asleep)], end
+## exclusive.  night is the date ordinal of the day on whose noon-to-noon span the period starts
+def sleep_periods(asleep, epoch, start):
+	starts, ends = runs(asleep)
+	keep = (ends - starts) * epoch >= MIN_BOUT * 60
+	starts = starts[keep]
+	ends = ends[keep]
+	if len(starts) == 0:
+		return([])
+
+	# group bouts separated by short wake gaps into periods
+	split = np.flatnonzero((starts[1:] - ends[:-1]) * epoch > MAX_GAP * 60) + 1
+	firsts = np.concatenate(([0], split))
+	lasts = np.concatenate((split, [len(starts)])) - 1
+	sleepIn = np.add.reduceat(ends - starts, firsts)
+	# night of a period: the day on whose noon-to-noon span it starts
+	nights = (start + (starts[firsts] * epoch) - 43200) // 86400
+
+	best = {}
+	for night, first, last, amount in zip(nights.tolist(), firsts.tolist(), lasts.tolist(),
+											sleepIn.tolist()):
+		if night not in best or amount > best[night][3]:
+			best[night] = (night, int(starts[first]), int(ends[last]), amount)
+	return([best[night] for night in sorted(best)])
+
+
+## True for each epoch whose REST_WINDOW mean activity is at or above REST_LEVEL
+def active_epochs(counts, epoch):
+	width = max(1, (REST_WINDOW * 60) // epoch)
+	return(np.convolve(np.nan_to_num(counts), np.ones(width) / width, 'same') >= REST_LEVEL)
+
+
+## widens a sleep interval to the rest interval around it
+def rest_bounds(active, begin, end):
+	before = np.flatnonzero(active[:begin])
+	after = np.flatnonzero(active[end:])
+	restStart = before[-1] + 1 if len(before) else 0
+	restEnd = end + after[0] if len(after) else len(active)
+	return(int(restStart), int(restEnd))
+
+
+# Actiware style date and time cells of a time in seconds since 1/1/0001
+def date_time(secs):
+	secs = int(secs)
+	return(SleepEngine.format_date(secs // 86400), SleepEngine.format_clock(secs, True))
+
+
+# one statistics row in actHeader layout
+def interval_row(actHeader, kind, n, startSecs, endSecs, extra=()):
+	row = [''] * len(actHeader)
+	cells = [('Interval Type', kind), ('Interval#', str(n))]
+	cells.extend(zip(('Start Date', 'Start Time'), date_time(startSecs)))
+	cells.extend(zip(('End Date', 'End Time'), date_time(endSecs)))
+	cells.append(('Duration', '%.2f' % ((endSecs - startSecs) / 60.0)))
+	cells.extend(extra)
+	for name, value in cells:
+		if name in actHeader:
+			row[actHeader.index(name)] = value
+	return(row)
+
+
+## scores an export and returns its (REST, ACTIVE, SLEEP) interval rows, one of each per night,
+## in the layout of actHeader (the export's Interval Type header), and the night (date ordinal)
+## of each
+def score_export(path, actHeader=None, algorithm=DEFAULT_ALGORITHM):
+	if actHeader is None:
+		actHeader = SleepEngine.read_actigraphy(path)[1]
+	epoch, start, counts = read_epochs(path)
+	asleep = score(counts, epoch, algorithm)
+	active = active_epochs(counts, epoch)
+
+	restList = []
+	activeList = []
+	sleepList = []
+	nights = []
+	activeFrom = 0
+	for n, (night, begin, end, amount) in enumerate(sleep_periods(asleep, epoch, start)):
+		restStart, restEnd = rest_bounds(active, begin, end)
+		duration = (end - begin) * epoch / 60.0
+		sleepMin = amount * epoch / 60.0
+		restList.append(interval_row(actHeader, 'REST', n + 1, start + restStart * epoch,
+										start + restEnd * epoch))
+		activeList.append(interval_row(actHeader, 'ACTIVE', n + 1, start + activeFrom * epoch,
+										start + restStart * epoch))
+		sleepList.append(interval_row(actHeader, 'SLEEP', n + 1, start + begin * epoch,
+										start + end * epoch,
+										[('Sleep Time', '%.2f' % sleepMin),
+										('Wake Time', '%.2f' % (duration - sleepMin)),
+										('Efficiency', '%.2f' % (100.0 * sleepMin / duration))]))
+		nights.append(night)
+		activeFrom = restEnd
+	return(restList, activeList, sleepList, nights)
+
+
+## the split_actigraphy() result act with its REST/ACTIVE/SLEEP intervals taken from scored
+## (a score_export() result).  mode 'replace' uses only the scored intervals; 'fill' keeps the
+## exported ones and adds scored ones for nights without an exported SLEEP interval.  Nights are
+## matched by night ordinal (SleepEngine.interval_night() for the exported rows), so a sleep
+## starting after midnight is still the evening's night.  DAILY rows are kept either way
+def merge_intervals(act, scored, mode):
+	ID, actHeader, restList, activeList, sleepList, dailyList = act
+	restScored, activeScored, sleepScored, nights = scored
+	if mode == 'replace':
+		return(ID, actHeader, list(restScored), list(activeScored), list(sleepScored), dailyList)
+	if mode != 'fill':
+		raise ScoringError('Unknown scoring mode: %s' % mode)
+
+	night = SleepEngine.interval_night
+	rests = dict((night(row), row) for row in restList)
+	actives = dict((night(row), row) for row in activeList)
+	sleeps = dict((night(row), row) for row in sleepList)
+	for day, rest, active, sleep in zip(nights, restScored, activeScored, sleepScored):
+		if day not in sleeps:
+			rests[day] = rest
+			actives[day] = active
+			sleeps[day] = sleep
+
+	return(ID, actHeader, [rests[day] for day in sorted(rests)], [actives[day] for day in sorted(actives)],
+			[sleeps[day] for day in sorted(sleeps)], dailyList)
@@ -0,0 +1,338 @@
+## Sleep Aligner alignment server
+## A long running local service for scripts that align one subject at a time: it keeps a pool of
+## worker processes with the engine already imported and takes alignment jobs over HTTP, so a job
+## costs the alignment itself plus a few milliseconds instead of a new Python process each time.
+## Only listens on localhost unless told otherwise.  Since any local program (or web page) can
+## reach it, POST requests must be sent as application/json, requests from a foreign web page
+## (an Origin header other than the server's own) are refused, and outputs are only written under
+## --out-root.
+
+## Usage:
+##   python SleepServer.py [--port 8765] [--workers N] [--max-jobs N] [--wait 30] [--cache]
+##                         [--out-root FOLDER]
+## Stops on Ctrl+C or SIGTERM, letting running jobs finish.
+##   answer = SleepServer.request('/align', {'act': actFile, 'log': logFile, 'out': outPath})
+
+## Requests (JSON in, JSON out):
+##   POST /align    {"act": path, "log": path, "out": path, optional "subject", "scoring" ('fill' or
+##                  'replace') and "incremental"} aligns files like SleepBatch.py; the output type
+##                  follows out's extension and out must be under --out-root (403 otherwise).
+##                  Answer: {"ok", "message", "seconds", "report"}
+##   POST /align    {"act_rows": [[...], ...], "log_rows": [[...], ...]} aligns CSV rows sent
+##                  inline.  Answer: {"ok", "header", "rows"} (or "message" if it failed)
+##   GET  /metrics  jobs done, failed and turned away, jobs running, latency percentiles and
+##                  jobs per second
+##   GET  /health   {"ok": true, "workers": N}
+## At most --max-jobs jobs run at once.  Further jobs wait up to --wait seconds for a free slot
+## and are then turned away with status 503.  A POST body that is not application/json is refused
+## with 415, a foreign Origin with 403.
+
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import collections
+import multiprocessing
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import SleepBatch
+import SleepCache
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_URL = 'http://%s:%d' % (DEFAULT_HOST, DEFAULT_PORT)
+
+# seconds a job waits for a free slot before it is turned away
+DEFAULT_WAIT = 30.0
+
+# latest jobs the latency percentiles are taken over
+LATENCY_SAMPLES = 1000
+
+# host names a request's Origin may have besides --host (the server's own pages)
+LOCAL_NAMES = ('localhost', '127.0.0.1', '::1')
+
+
+# worker process start up: import the engine before the first job arrives (SleepBatch imports
+# SleepEngine, SleepCache and SleepProfile)
+def warm_worker():
+	import SleepBatch
+
+
+# no-op job used to start the workers
+def ping():
+	return(os.getpid())
+
+
+## worker: aligns inline CSV rows.  Returns (ok, header or message, rows)
+def align_rows(actData, logData):
+	import SleepEngine
+	try:
+		outHeader, outList = SleepEngine.align(actData, logData)
+	except Exception as e:
+		return(False, '%s: %s' % (type(e).__name__, e), None)
+	return(True, outHeader, outList)
+
+
+# p-th percentile (0-100) of a sorted list
+def percentile(values, p):
+	if not values:
+		return(0.0)
+	return(values[min(len(values) - 1, int(len(values) * p / 100.0))])
+
+
+## job counts and latencies, shared by the request threads
+class Metrics(object):
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.done = 0
+		self.failed = 0
+		self.rejected = 0
+		self.running = 0
+		self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+		self.waits = collections.deque(maxlen=LATENCY_SAMPLES)
+
+
+	def begin(self):
+		with self.lock:
+			self.running += 1
+
+
+	## records a finished job: latency is the request's total time, wait the part spent waiting
+	## for a slot
+	def end(self, ok, latency, wait):
+		with self.lock:
+			self.running -= 1
+			if ok:
+				self.done += 1
+			else:
+				self.failed += 1
+			self.latencies.append(latency)
+			self.waits.append(wait)
+
+
+	def reject(self):
+		with self.lock:
+			self.rejected += 1
+
+
+	def as_dict(self):
+		with self.lock:
+			latencies = sorted(self.latencies)
+			waits = sorted(self.waits)
+			uptime = time.time() - self.started
+			return({'uptime_seconds': uptime, 'jobs_done': self.done, 'jobs_failed': self.failed,
+					'jobs_rejected': self.rejected, 'jobs_running': self.running,
+					'jobs_per_second': (self.done + self.failed) / uptime if uptime else 0.0,
+					'latency_ms': {'p50': 1000 * percentile(latencies, 50),
+									'p95': 1000 * percentile(latencies, 95),
+									'max': 1000 * (latencies[-1] if latencies else 0.0)},
+					'wait_ms': {'p50': 1000 * percentile(waits, 50), 'p95': 1000 * percentile(waits, 95)},
+					'samples': len(latencies)})
+
+
+class AlignServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, workers=None, maxJobs=None, wait=DEFAULT_WAIT, cacheDir=None,
+					stream=None, outRoot=None):
+		super().__init__(address, AlignHandler)
+		self.workers = workers or os.cpu_count() or 1
+		self.slots = threading.BoundedSemaphore(maxJobs or self.workers)
+		self.wait = wait
+		self.cacheDir = cacheDir
+		# outputs are only written under this folder (default: the current folder)
+		self.outRoot = os.path.realpath(outRoot or os.getcwd())
+		self.stream = stream
+		self.metrics = Metrics()
+		self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker)
+		# start every worker now, so the first jobs do not wait for process start up
+		for future in [self.pool.submit(ping) for n in range(self.workers)]:
+			future.result()
+
+
+	## runs one job in the pool under the concurrency limit.  Returns (status, answer)
+	def run_job(self, func, *args):
+		received = time.perf_counter()
+		if not self.slots.acquire(timeout=self.wait):
+			self.metrics.reject()
+			return(503, {'ok': False, 'message': 'Busy: no free job slot within %g seconds' % self.wait})
+		waited = time.perf_counter() - received
+		self.metrics.begin()
+		ok = False
+		try:
+			answer = func(self.pool, *args)
+			ok = answer['ok']
+		except Exception as e:
+			answer = {'ok': False, 'message': '%s: %s' % (type(e).__name__, e)}
+		finally:
+			self.slots.release()
+			self.metrics.end(ok, time.perf_counter() - received, waited)
+		return(200, answer)
+
+
+	## True if an output path is inside outRoot (after following links)
+	def allowed_output(self, path):
+		if not isinstance(path, str):
+			return(False)
+		path = os.path.realpath(path)
+		return(os.path.commonpath([path, self.outRoot]) == self.outRoot)
+
+
+	## True if a request's Origin header (None if it has none) is this server's own
+	def allowed_origin(self, origin):
+		if origin is None:
+			return(True)
+		parts = urllib.parse.urlsplit(origin)
+		try:
+			port = parts.port
+		except ValueError:
+			return(False)
+		return(parts.scheme == 'http' and port == self.server_port and
+				parts.hostname in LOCAL_NAMES + (self.server_address[0],))
+
+
+	def server_close(self):
+		super().server_close()
+		self.pool.shutdown()
+
+
+# file job: SleepBatch.align_job() in the pool
+def file_job(pool, body, cacheDir):
+	act = body['act']
+	log = body['log']
+	job = (body.get('subject') or SleepBatch.subject_key(act), act, log, body['out'], cacheDir,
+			bool(body.get('incremental')), False, body.get('scoring'))
+	key, ok, msg, secs, report = pool.submit(SleepBatch.align_job, job).result()
+	return({'ok': ok, 'message': msg, 'seconds': secs, 'report': report})
+
+
+# inline rows job
+def rows_job(pool, body):
+	ok, header, rows = pool.submit(align_rows, body['act_rows'], body['log_rows']).result()
+	if not ok:
+		return({'ok': False, 'message': header})
+	return({'ok': True, 'header': header, 'rows': rows})
+
+
+class AlignHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def answer(self, status, body):
+		data = json.dumps(body).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+
+	def do_GET(self):
+		if self.path == '/metrics':
+			self.answer(200, self.server.metrics.as_dict())
+		elif self.path == '/health':
+			self.answer(200, {'ok': True, 'workers': self.server.workers})
+		else:
+			self.answer(404, {'ok': False, 'message': 'Unknown path: %s' % self.path})
+
+
+	def do_POST(self):
+		if not self.server.allowed_origin(self.headers.get('Origin')):
+			self.answer(403, {'ok': False, 'message': 'Requests from other sites are not accepted'})
+			return
+		if self.headers.get_content_type() != 'application/json':
+			self.answer(415, {'ok': False, 'message': 'Send the request body as application/json'})
+			return
+		try:
+			length = int(self.headers.get('Content-Length', 0))
+			body = json.loads(self.rfile.read(length).decode('utf-8'))
+		except ValueError as e:
+			self.answer(400, {'ok': False, 'message': 'Bad JSON: %s' % e})
+			return
+		if self.path != '/align':
+			self.answer(404, {'ok': False, 'message': 'Unknown path: %s' % self.path})
+		elif not isinstance(body, dict):
+			self.answer(400, {'ok': False, 'message': 'Expected a JSON object'})
+		elif 'act_rows' in body and 'log_rows' in body:
+			self.answer(*self.server.run_job(rows_job, body))
+		elif all(body.get(name) for name in ('act', 'log', 'out')):
+			if body.get('scoring') not in (None, 'fill', 'replace'):
+				self.answer(400, {'ok': False, 'message': "scoring must be 'fill' or 'replace'"})
+			elif not self.server.allowed_output(body['out']):
+				self.answer(403, {'ok': False, 'message': 'out must be under %s' % self.server.outRoot})
+			else:
+				self.answer(*self.server.run_job(file_job, body, self.server.cacheDir))
+		else:
+			self.answer(400, {'ok': False, 'message': 'Give act, log and out paths, or act_rows and '
+								'log_rows'})
+
+
+	def log_message(self, format, *args):
+		if self.server.stream is not None:
+			self.server.stream.write('%s  %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), format % args))
+			self.server.stream.flush()
+
+
+## sends one request to a running server and returns its decoded JSON answer (also for error
+## statuses).  body None makes a GET request
+def request(path, body=None, url=DEFAULT_URL, timeout=None):
+	import urllib.error
+	import urllib.request
+	data = None if body is None else json.dumps(body).encode('utf-8')
+	req = urllib.request.Request(url + path, data=data, headers={'Content-Type': 'application/json'})
+	try:
+		with urllib.request.urlopen(req, timeout=timeout) as resp:
+			return(json.loads(resp.read().decode('utf-8')))
+	except urllib.error.HTTPError as e:
+		return(json.loads(e.read().decode('utf-8')))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Serve sleep alignment jobs from warm worker processes')
+	parser.add_argument('--host', default=DEFAULT_HOST,
+						help='address to listen on (default: %s, this machine only).  Anything that can '
+						'reach the address can read the input files and write under --out-root' % DEFAULT_HOST)
+	parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='default: %d' % DEFAULT_PORT)
+	parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+	parser.add_argument('--max-jobs', type=int, default=None,
+						help='jobs running at once (default: one per worker)')
+	parser.add_argument('--wait', type=float, default=DEFAULT_WAIT,
+						help='seconds a job may wait for a free slot (default: %g)' % DEFAULT_WAIT)
+	parser.add_argument('--cache', nargs='?', const=SleepCache.DEFAULT_FOLDER, default=None,
+						help='reuse parsed input files from this cache folder (default: %s)' %
+						SleepCache.DEFAULT_FOLDER)
+	parser.add_argument('--out-root', default=None,
+						help='outputs may only be written under this folder (default: the current folder)')
+	parser.add_argument('--quiet', action='store_true', help='do not log each request')
+	args = parser.parse_args(argv)
+
+	server = AlignServer((args.host, args.port), args.workers, args.max_jobs, args.wait, args.cache,
+							None if args.quiet else sys.stdout, args.out_root)
+	if args.host not in LOCAL_NAMES:
+		sys.stderr.write('Warning: listening on %s; other machines can send jobs\n' % args.host)
+	sys.stdout.write('Serving on http://%s:%d with %d worker(s), writing under %s\n' %
+						(args.host, server.server_port, server.workers, server.outRoot))
+	sys.stdout.flush()
+	# SIGTERM (a service manager stopping the server) ends serve_forever() like Ctrl+C.  shutdown()
+	# waits for the serving loop, which runs in this thread, so it is called from another one
+	signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+	return(0)
+
+
+## runs program
+if __name__ == '__main__':
+	multiprocessing.freeze_support()
+	sys.exit(main())
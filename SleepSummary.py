@@ -0,0 +1,282 @@
+## Sleep Aligner multi-night summaries
+## Summarizes an aligned output file over windows of days, per subject and, for cohort outputs, for
+## the whole cohort.  For each window it gives:
+##   DAYS                    calendar days in the window (from the subject's first output night;
+##                           subject-days added up in cohort rows)
+##   LOG_MISSING/ACT_MISSING days without a sleep log entry / actigraphy interval
+##   BOTH                    nights with both
+##   DIF_*_N                 nights with a value in that DIF_* column
+##   DIF_*_MEAN, DIF_*_VAR   mean (minutes) and sample variance (minutes squared) of the column
+##   DIF_*_AGREE             share of those nights where log and actigraphy agree within
+##                           AGREE_MINUTES
+## The table is written next to the output as <output>.summary.csv.
+
+## Windows are given as 'LENGTH' (days, one window after the other: '7' is weekly) or
+## 'LENGTH/STEP' (a new window every STEP days: '7/1' is a rolling week starting on every day),
+## plus one 'all' window over the whole record.  Windows count days from each subject's first
+## night (DAY_FIRST/DAY_LAST are those study days); the cohort ('ALL') rows add up the subjects'
+## windows with the same study days.  Windows at the end of a record can be shorter (see DAYS).
+
+## Each subject's nights are laid out as arrays indexed by day, and every statistic is kept as a
+## running (prefix) sum over them: any window is then one subtraction per statistic, so all the
+## windows of a subject take time proportional to its days plus the number of windows, however long
+## or overlapping they are.  The sums are whole seconds in integers, so the variance is exact.
+
+## Usage:
+##   python SleepSummary.py result_file.csv [--windows 7,28,7/1] [--agree 30]
+##   SleepSummary.write_summary('result_file.csv', [(7, 7), (7, 1)])
+
+
+import os
+import sys
+import csv
+import array
+import argparse
+import itertools
+
+import SleepEngine
+
+
+DIF_COLUMNS = ('DIF_ACTIVE_START', 'DIF_BED_START', 'DIF_SLEEP_START', 'DIF_SLEEP_END', 'DIF_BED_END')
+
+# a night has a sleep log entry / actigraphy interval if any of these is filled in
+LOG_COLUMNS = ('LOG_ACTIVE_START', 'LOG_BED_START', 'LOG_SLEEP_START')
+ACT_COLUMNS = ('ACT_BED_START', 'ACT_SLEEP_START')
+
+# weekly windows
+DEFAULT_WINDOWS = ((7, 7),)
+
+# log and actigraphy times agree if they are at most this far apart
+AGREE_MINUTES = 30
+
+# SUBJ_ID of the cohort rows
+COHORT_ID = 'ALL'
+
+SUMMARY_HEADER = (['SUBJ_ID', 'WINDOW', 'DAY_FIRST', 'DAY_LAST', 'DATE_FIRST', 'DATE_LAST', 'DAYS',
+					'LOG_MISSING', 'ACT_MISSING', 'BOTH'] +
+					[name + suffix for name in DIF_COLUMNS for suffix in ('_N', '_MEAN', '_VAR', '_AGREE')])
+
+# statistics kept per day: nights with a log entry, with an actigraphy interval, with both, then
+# count, sum, sum of squares and agreeing count for each DIF_* column
+STATS = 3 + (4 * len(DIF_COLUMNS))
+
+
+def summary_path(outPath):
+	return(outPath + '.summary.csv')
+
+
+## [(length, step)] from a '7,28,7/1' style window list.  Raises ValueError
+def parse_windows(text):
+	windows = []
+	for part in text.split(','):
+		length, _, step = part.strip().partition('/')
+		length = int(length)
+		step = int(step) if step else length
+		if length < 1 or step < 1:
+			raise ValueError('Window lengths and steps must be at least 1 day: %r' % part)
+		windows.append((length, step))
+	return(windows)
+
+
+# label of a window in the WINDOW column
+def window_label(length, step):
+	if step == length:
+		return(str(length))
+	return('%d/%d' % (length, step))
+
+
+# seconds of a DIF_* cell ('h:m:s' text or a timedelta), None if missing
+def dif_seconds(value):
+	if value is None or value == 'N/A' or value == '':
+		return(None)
+	if hasattr(value, 'total_seconds'):
+		return(int(value.total_seconds()))
+	hr, min, sec = SleepEngine.split_time(value)
+	return((hr * 3600) + (min * 60) + sec)
+
+
+# date ordinal of a DATE_START cell (m/d/yyyy text or a date)
+def day_number(value):
+	if hasattr(value, 'toordinal'):
+		return(value.toordinal())
+	return(SleepEngine.date_ordinal(value))
+
+
+# True if a LOG_*/ACT_* cell holds a time
+def filled(value):
+	return(value is not None and value != 'N/A' and value != '' and value != ' ')
+
+
+# the columns of an output file that a summary needs, as {name: values}.  CSV files are streamed;
+# Parquet and Feather files only have those columns read
+def read_columns(path):
+	names = ['SUBJ_ID', 'DATE_START'] + list(LOG_COLUMNS + ACT_COLUMNS + DIF_COLUMNS)
+	if os.path.splitext(path)[1].lower() in SleepEngine.COLUMNAR_FORMATS:
+		import SleepColumnar
+		pa = SleepColumnar.import_pyarrow()
+		if os.path.splitext(path)[1].lower() == '.parquet':
+			table = pa.parquet.read_table(path, columns=names)
+		else:
+			with pa.memory_map(path) as source:
+				table = pa.ipc.open_file(source).read_all().select(names)
+		return(dict((name, table.column(name).to_pylist()) for name in names))
+
+	with open(path, 'r', newline='') as fh:
+		reader = csv.reader(fh)
+		header = next(reader, None) or []
+		missing = [name for name in names if name not in header]
+		if missing:
+			raise ValueError('Not an aligned output file: no %s column' % ', '.join(missing))
+		cols = [header.index(name) for name in names]
+		values = dict((name, []) for name in names)
+		lists = [values[name] for name in names]
+		for row in reader:
+			if len(row) > 1:
+				for out, col in zip(lists, cols):
+					out.append(row[col])
+	return(values)
+
+
+## {subject: [(day, hasLog, hasAct, (DIF seconds or None, ...)), ...]} of an output file, in
+## file order
+def read_nights(path):
+	columns = read_columns(path)
+	logCols = [columns[name] for name in LOG_COLUMNS]
+	actCols = [columns[name] for name in ACT_COLUMNS]
+	difCols = [columns[name] for name in DIF_COLUMNS]
+	subjects = {}
+	for n, (subject, date) in enumerate(zip(columns['SUBJ_ID'], columns['DATE_START'])):
+		subjects.setdefault(subject or '', []).append((day_number(date),
+								any(filled(col[n]) for col in logCols),
+								any(filled(col[n]) for col in actCols),
+								tuple(dif_seconds(col[n]) for col in difCols)))
+	return(subjects)
+
+
+## prefix sums of one subject's nights: sums[k][d] is statistic k added up over its first d days
+class Series(object):
+	def __init__(self, nights, agreeSecs):
+		self.first = min(night[0] for night in nights)
+		self.days = max(night[0] for night in nights) - self.first + 1
+		daily = [array.array('q', bytes(8 * self.days)) for k in range(STATS)]
+		for day, hasLog, hasAct, difs in nights:
+			d = day - self.first
+			# a day listed twice (an edited file) counts once, the later row winning
+			daily[0][d] = hasLog
+			daily[1][d] = hasAct
+			daily[2][d] = hasLog and hasAct
+			for n, secs in enumerate(difs):
+				k = 3 + (4 * n)
+				if secs is None:
+					daily[k][d] = daily[k + 1][d] = daily[k + 2][d] = daily[k + 3][d] = 0
+				else:
+					daily[k][d] = 1
+					daily[k + 1][d] = secs
+					daily[k + 2][d] = secs * secs
+					daily[k + 3][d] = secs <= agreeSecs
+		self.sums = [array.array('q', itertools.accumulate(values, initial=0)) for values in daily]
+
+
+	## statistics over days a to b (0 based, b not included): [days, then one value per STATS]
+	def window(self, a, b):
+		return([b - a] + [sums[b] - sums[a] for sums in self.sums])
+
+
+	## (label, start, statistics) for the 'all' window and each (length, step) window
+	def windows(self, windows):
+		yield(('all', 0, self.window(0, self.days)))
+		for length, step in windows:
+			label = window_label(length, step)
+			for a in range(0, self.days, step):
+				yield((label, a, self.window(a, min(a + length, self.days))))
+
+
+# one summary table row: subject, window, study days a to b (0 based, b not included), dates
+# (first is None for cohort rows) and the window statistics
+def summary_row(subject, label, a, b, first, stats):
+	days = stats[0]
+	hasLog, hasAct, both = stats[1:4]
+	row = [subject, label, a + 1, b]
+	if first is None:
+		row.extend(['', ''])
+	else:
+		row.extend([SleepEngine.format_date(first + a), SleepEngine.format_date(first + b - 1)])
+	row.extend([days, days - hasLog, days - hasAct, both])
+	for n in range(len(DIF_COLUMNS)):
+		count, total, squares, agree = stats[4 + (4 * n):8 + (4 * n)]
+		if count == 0:
+			row.extend([0, 'N/A', 'N/A', 'N/A'])
+			continue
+		row.append(count)
+		row.append('%.2f' % (total / count / 60.0))
+		if count > 1:
+			# exact integer numerator: n * sum(x^2) - sum(x)^2
+			row.append('%.2f' % (((count * squares) - (total * total)) / (count * (count - 1)) / 3600.0))
+		else:
+			row.append('N/A')
+		row.append('%.3f' % (agree / count))
+	return(row)
+
+
+## summary table (header, rows) of an output file.  windows are (length, step) pairs as from
+## parse_windows(); cohort rows are added when the file holds more than one subject
+def summarize(path, windows=DEFAULT_WINDOWS, agreeMinutes=AGREE_MINUTES):
+	subjects = read_nights(path)
+	rows = []
+	cohort = {}
+	order = []
+	for subject, nights in subjects.items():
+		series = Series(nights, agreeMinutes * 60)
+		for label, a, stats in series.windows(windows):
+			rows.append(summary_row(subject, label, a, a + stats[0], series.first, stats))
+			# cohort windows: days added up over the subjects, study days as far as the longest goes
+			key = (label, a)
+			if key not in cohort:
+				cohort[key] = (a + stats[0], stats)
+				order.append(key)
+			else:
+				end, total = cohort[key]
+				cohort[key] = (max(end, a + stats[0]), [x + y for x, y in zip(total, stats)])
+	if len(subjects) > 1:
+		for label, a in order:
+			end, stats = cohort[(label, a)]
+			rows.append(summary_row(COHORT_ID, label, a, end, None, stats))
+	return(list(SUMMARY_HEADER), rows)
+
+
+## writes the summary of an output file next to it.  Returns the summary file's path
+def write_summary(outPath, windows=DEFAULT_WINDOWS, agreeMinutes=AGREE_MINUTES):
+	header, rows = summarize(outPath, windows, agreeMinutes)
+	path = summary_path(outPath)
+	tmpPath = path + '.part'
+	with open(tmpPath, 'w', newline='') as fh:
+		w = csv.writer(fh)
+		w.writerow(header)
+		w.writerows(rows)
+	os.replace(tmpPath, path)
+	return(path)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Write multi-night summaries of aligned output files')
+	parser.add_argument('outputs', nargs='+', help='aligned output files (CSV, Parquet or Feather)')
+	parser.add_argument('--windows', type=parse_windows, default=DEFAULT_WINDOWS,
+						help="window lengths in days, 'LENGTH' or 'LENGTH/STEP' for rolling windows "
+						"(default: 7)")
+	parser.add_argument('--agree', type=float, default=AGREE_MINUTES,
+						help='minutes within which log and actigraphy times agree (default: %g)' %
+						AGREE_MINUTES)
+	args = parser.parse_args(argv)
+	failed = 0
+	for outPath in args.outputs:
+		try:
+			sys.stdout.write('%s\n' % write_summary(outPath, args.windows, args.agree))
+		except Exception as e:
+			failed += 1
+			sys.stdout.write('FAIL  %s  %s: %s\n' % (outPath, type(e).__name__, e))
+	return(1 if failed else 0)
+
+
+## runs program
+if __name__ == '__main__':
+	sys.exit(main())
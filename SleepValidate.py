@@ -0,0 +1,228 @@
+## Sleep Aligner input checks
+## Checks a pair of input files before they are parsed, from the top of each file only: the
+## actigraphy export needs its 'Full Name:' row and an 'Interval Type' statistics header with the
+## Start/End Date/Time columns, the sleep log a header with every column the alignment reads by name
+## and a readable date in its first row.  A wrong file (a sleep log picked as the actigraphy export,
+## a different CSV altogether) is then reported in a few milliseconds, with what is wrong, instead
+## of as a KeyError once both files have been read in full.
+
+## Each finding is a Problem with a code, a message and a severity.  'error' problems stop the
+## alignment; 'warning' problems (no 'Full Name:' row: SUBJ_ID is left blank) do not.
+##   code              file  meaning
+##   unreadable        both  the file can not be opened or read
+##   empty             both  the file has no data
+##   wrong_file        both  the file looks like the other kind of input
+##   no_statistics     act   no 'Interval Type' statistics header
+##   missing_columns   both  required columns are not in the header (Problem.columns)
+##   column_order      act   Start/End Date/Time are not columns 3 to 6, where the alignment reads them
+##   bad_date          log   the first row's date is not m/d/yyyy
+##   no_subject_id     act   no 'Full Name:' row (warning)
+
+## Usage:
+##   problems = SleepValidate.check_inputs(actFile, logFile)
+##   SleepValidate.validate(actFile, logFile)      # raises InputError on any 'error' problem
+
+
+import os
+import csv
+import mmap
+import itertools
+
+import SleepEngine
+import SleepExport
+
+
+# bytes read from the top of each file
+HEAD_BYTES = 65536
+
+# columns the alignment reads by name
+ACT_COLUMNS = ('Start Date', 'Start Time', 'End Date', 'End Time')
+LOG_COLUMNS = ('final_awake_time', 'bedtime_hr', 'bedtime_min', 'bedtime_am_pm', 'fall_asleep_hr',
+				'fall_asleep_min', 'try_sleep_hr', 'try_sleep_min', 'try_sleep_am_pm', 'awake_hr',
+				'awake_min', 'awake_am_pm', 'bed_out_hr', 'bed_out_min', 'bed_out_am_pm',
+				'sleep_quality')
+# where the alignment reads ACT_COLUMNS (interval_night() reads them by position)
+ACT_POSITIONS = (SleepEngine.ACT_DATE, SleepEngine.ACT_TIME, SleepEngine.ACT_END_DATE,
+					SleepEngine.ACT_END_TIME)
+
+
+## one finding about an input file.  role is 'act' or 'log'
+class Problem(object):
+	def __init__(self, role, path, code, message, severity='error', columns=None):
+		self.role = role
+		self.path = path
+		self.code = code
+		self.message = message
+		self.severity = severity
+		self.columns = columns or []
+
+
+	def __str__(self):
+		return('%s: %s' % (os.path.basename(self.path), self.message))
+
+
+	def as_dict(self):
+		return({'file': self.role, 'path': self.path, 'code': self.code, 'message': self.message,
+				'severity': self.severity, 'columns': self.columns})
+
+
+## raised by validate(); problems holds every Problem found, warnings included
+class InputError(ValueError):
+	def __init__(self, problems):
+		self.problems = problems
+		super().__init__('; '.join(str(p) for p in problems if p.severity == 'error'))
+
+
+# the first HEAD_BYTES of a file
+def read_head(path):
+	with open(path, 'rb') as fh:
+		return(fh.read(HEAD_BYTES))
+
+
+# the complete lines of a file's head, as CSV rows
+def head_rows(head):
+	lines = head.decode('utf-8', 'replace').splitlines()
+	if len(head) == HEAD_BYTES and len(lines) > 1:
+		# the last line was cut off by the read
+		lines.pop()
+	return(list(csv.reader(lines)))
+
+
+# required columns missing from header
+def missing_columns(header, required):
+	have = set(cell.strip() for cell in header)
+	return([name for name in required if name not in have])
+
+
+# "'a' column" / "'a', 'b' columns"
+def column_list(names):
+	return(', '.join(repr(name) for name in names) + (' columns' if len(names) > 1 else ' column'))
+
+
+## checks an actigraphy export.  Returns a list of Problems
+def check_actigraphy(path):
+	try:
+		head = read_head(path)
+	except OSError as e:
+		return([Problem('act', path, 'unreadable', 'Can not read the actigraphy file: %s' %
+						(e.strerror or e))])
+	if not head.strip():
+		return([Problem('act', path, 'empty', 'The actigraphy file is empty')])
+
+	pos = SleepExport.find_line(head, SleepExport.STATS_HEADER)
+	if pos != -1 and head.find(b'\n', pos) != -1:
+		header = SleepExport.split_line(head[pos:SleepExport.next_line(head, pos)])
+	else:
+		# the statistics usually start within the first few KB, but Actiware puts no limit on the
+		# rows above them: search the rest of the file's bytes (nothing is decoded)
+		header = stats_header(path)
+	if header is None:
+		rows = head_rows(head)
+		if rows and not missing_columns(rows[0], LOG_COLUMNS[:4]):
+			return([Problem('act', path, 'wrong_file', 'This looks like a sleep log, not an actigraphy '
+							'export')])
+		return([Problem('act', path, 'no_statistics', "No 'Interval Type' statistics header; is this "
+						'an Actiware export?')])
+
+	problems = []
+	if SleepExport.find_line(head, SleepExport.FULL_NAME) == -1:
+		problems.append(Problem('act', path, 'no_subject_id', "No 'Full Name:' row; SUBJ_ID will be "
+								'blank', 'warning'))
+	missing = missing_columns(header, ACT_COLUMNS)
+	if missing:
+		problems.append(Problem('act', path, 'missing_columns', 'Statistics header has no ' +
+								column_list(missing), columns=missing))
+	else:
+		cells = [cell.strip() for cell in header]
+		for name, col in zip(ACT_COLUMNS, ACT_POSITIONS):
+			if cells[col] != name:
+				problems.append(Problem('act', path, 'column_order', "'%s' must be column %d of the "
+										'statistics, not %d' % (name, col + 1, cells.index(name) + 1)))
+				break
+	return(problems)
+
+
+# statistics header row of an export, searched for in the whole file.  None if there is none
+def stats_header(path):
+	with open(path, 'rb') as fh:
+		try:
+			mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+		except (ValueError, OSError):
+			return(None)
+		with mm:
+			pos = SleepExport.find_line(mm, SleepExport.STATS_HEADER)
+			if pos == -1:
+				return(None)
+			return(SleepExport.split_line(mm[pos:SleepExport.next_line(mm, pos)]))
+
+
+# header and first data row of a sleep log (None for a missing row)
+def log_head(path):
+	# OSError for a missing file, before xlrd is looked for
+	os.stat(path)
+	if os.path.splitext(path)[1].lower() in SleepEngine.LOG_WORKBOOK_FORMATS:
+		import zipfile
+		import SleepWorkbook
+		if os.path.splitext(path)[1].lower() == '.xls':
+			rows = SleepWorkbook.xls_rows(path)
+			head = list(itertools.islice(rows, 2))
+			rows.close()
+		else:
+			with zipfile.ZipFile(path) as book:
+				rows = SleepWorkbook.XlsxReader(book).rows()
+				head = list(itertools.islice(rows, 2))
+				rows.close()
+		return(head + [None] * (2 - len(head)), None)
+	head = read_head(path)
+	rows = [row for row in head_rows(head) if row][:2]
+	return(rows + [None] * (2 - len(rows)), head)
+
+
+## checks a sleep log (CSV or workbook).  Returns a list of Problems
+def check_log(path):
+	try:
+		(header, first), head = log_head(path)
+	except OSError as e:
+		return([Problem('log', path, 'unreadable', 'Can not read the sleep log: %s' %
+						(e.strerror or e))])
+	except Exception as e:
+		# a damaged workbook, or xlrd missing for .xls
+		return([Problem('log', path, 'unreadable', 'Can not read the sleep log: %s' % e)])
+	if header is None or not any(cell.strip() for cell in header):
+		return([Problem('log', path, 'empty', 'The sleep log is empty')])
+	if head is not None and (SleepExport.find_line(head, SleepExport.STATS_HEADER) != -1 or
+								SleepExport.find_line(head, SleepExport.FULL_NAME) != -1):
+		return([Problem('log', path, 'wrong_file', 'This looks like an actigraphy export, not a '
+						'sleep log')])
+
+	missing = missing_columns(header, LOG_COLUMNS)
+	if len(missing) == len(LOG_COLUMNS):
+		return([Problem('log', path, 'missing_columns', 'Header has none of the sleep log columns '
+						"(final_awake_time, bedtime_hr, ...); is this a sleep log?", columns=missing)])
+	problems = []
+	if missing:
+		problems.append(Problem('log', path, 'missing_columns', 'Header has no ' +
+								column_list(missing), columns=missing))
+	if first is not None and len(first) > SleepEngine.LOG_DATE and first[SleepEngine.LOG_DATE].strip():
+		try:
+			SleepEngine.date_ordinal(first[SleepEngine.LOG_DATE].strip())
+		except ValueError:
+			problems.append(Problem('log', path, 'bad_date', "Column %d ('%s') should hold m/d/yyyy "
+									"dates; the first row has '%s'" % (SleepEngine.LOG_DATE + 1,
+									header[SleepEngine.LOG_DATE] if len(header) > SleepEngine.LOG_DATE
+									else '', first[SleepEngine.LOG_DATE])))
+	return(problems)
+
+
+## checks both input files.  Returns every Problem found (empty if the pair looks right)
+def check_inputs(actFile, logFile):
+	return(check_actigraphy(actFile) + check_log(logFile))
+
+
+## checks both input files and raises InputError if any 'error' problem is found.  Returns the
+## warnings
+def validate(actFile, logFile):
+	problems = check_inputs(actFile, logFile)
+	if any(p.severity == 'error' for p in problems):
+		raise InputError(problems)
+	return(problems)
@@ -0,0 +1,232 @@
+## Sleep Aligner watch mode
+## Watches one or more folders for actigraphy exports and sleep log CSVs and aligns each subject
+## as soon as both of its files are there, and again whenever one of them changes.
+
+## Usage:
+##   python SleepWatch.py --dir ACT_FOLDER --dir LOG_FOLDER --out OUTPUT_FOLDER [--jobs N]
+
+## Files are paired by subject key and told apart as in SleepBatch.py (directory mode).  Folders
+## are polled every --interval seconds; a file is only used once its size and modification time
+## have not changed for --settle seconds, so files still being copied or synced are left alone.
+## Jobs go to a process pool with at most --jobs subjects aligning at once.  A small state file
+## (OUTPUT_FOLDER/.sleepwatch.json) records the inputs each subject was last aligned from, so
+## unchanged subjects are never aligned twice, also across restarts.  A failed subject is retried
+## when one of its files changes.  --once processes what is ready and exits (e.g. from cron).
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import SleepBatch
+import SleepCache
+
+
+STATE_FILE = '.sleepwatch.json'
+
+# seconds a file must stay unchanged before it is used
+SETTLE_SECONDS = 5.0
+# seconds between folder scans
+POLL_SECONDS = 2.0
+
+# names of files that are still being written by common copy and sync tools
+PARTIAL_SUFFIXES = ('.part', '.tmp', '.crdownload', '.partial', '~')
+
+
+class Watcher(object):
+	def __init__(self, folders, outDir, workers=2, settle=SETTLE_SECONDS, fmt='csv', cacheDir=None,
+					incremental=False, scoring=None, stream=sys.stdout):
+		self.folders = folders
+		self.outDir = outDir
+		self.workers = workers
+		self.settle = settle
+		self.fmt = fmt
+		self.cacheDir = cacheDir
+		self.incremental = incremental
+		self.scoring = scoring
+		self.stream = stream
+		os.makedirs(outDir, exist_ok=True)
+		self.realOut = os.path.realpath(outDir)
+		self.statePath = os.path.join(outDir, STATE_FILE)
+		self.state = self.load_state()
+		# path -> ((size, mtime_ns), time that signature was first seen)
+		self.seen = {}
+		# (path, size, mtime_ns) -> True for actigraphy, False for sleep log
+		self.kinds = {}
+		# future -> (key, input signature)
+		self.running = {}
+
+
+	def load_state(self):
+		try:
+			with open(self.statePath, 'r') as fh:
+				return(json.load(fh))
+		except (OSError, ValueError):
+			return({})
+
+
+	# written through a temporary file, like SleepCache entries
+	def save_state(self):
+		tmpPath = self.statePath + '.tmp'
+		with open(tmpPath, 'w') as fh:
+			json.dump(self.state, fh, indent=1, sort_keys=True)
+		os.replace(tmpPath, self.statePath)
+
+
+	## {key: {'act': (path, size, mtime_ns), 'log': (...)}} of the settled files in the folders.
+	## once=True judges settling by modification time alone (no earlier scan to compare with)
+	def scan(self, once=False):
+		now = time.time()
+		found = {}
+		present = set()
+		for folder in self.folders:
+			try:
+				entries = list(os.scandir(folder))
+			except OSError:
+				continue
+			# our own outputs (<key>.csv) when the output folder is watched too
+			isOut = os.path.realpath(folder) == self.realOut
+			for entry in entries:
+				name = entry.name
+				# ~$name.xlsx is the lock file of a workbook open in Excel
+				if (name.startswith(('.', '~$')) or name.endswith(PARTIAL_SUFFIXES) or
+						os.path.splitext(name)[1].lower() not in SleepBatch.INPUT_FORMATS):
+					continue
+				if isOut and os.path.splitext(name)[0] == SleepBatch.subject_key(name):
+					continue
+				try:
+					if not entry.is_file():
+						continue
+					st = entry.stat()
+				except OSError:
+					continue
+				path = entry.path
+				present.add(path)
+				sig = (st.st_size, st.st_mtime_ns)
+				if path not in self.seen or self.seen[path][0] != sig:
+					self.seen[path] = (sig, now)
+				since = st.st_mtime if once else max(st.st_mtime, self.seen[path][1])
+				if now - since < self.settle or st.st_size == 0:
+					continue
+				kind = self.kind(path, sig)
+				if kind is None:
+					continue
+				key = SleepBatch.subject_key(name)
+				slot = found.setdefault(key, {})
+				side = 'act' if kind else 'log'
+				# with several files for one subject, the newest wins
+				if side not in slot or slot[side][2] < sig[1]:
+					slot[side] = (path, sig[0], sig[1])
+		for path in list(self.seen):
+			if path not in present:
+				del self.seen[path]
+		return(dict((key, slot) for key, slot in found.items() if len(slot) == 2))
+
+
+	# True for actigraphy, False for sleep log, None if unreadable or an aligned output; looked at
+	# once per version
+	def kind(self, path, sig):
+		known = (path,) + sig
+		if known not in self.kinds:
+			try:
+				if SleepBatch.is_output(path):
+					self.kinds[known] = None
+				else:
+					self.kinds[known] = SleepBatch.is_actigraphy(path)
+			except OSError:
+				return(None)
+		return(self.kinds[known])
+
+
+	## starts jobs for subjects whose inputs changed since they were last aligned, while fewer than
+	## workers are running.  Returns the number started
+	def submit(self, pool, pairs):
+		busy = set(key for key, sig in self.running.values())
+		started = 0
+		for key in sorted(pairs):
+			if len(self.running) >= self.workers:
+				break
+			sig = [list(pairs[key]['act']), list(pairs[key]['log'])]
+			if key in busy or self.state.get(key, {}).get('inputs') == sig:
+				continue
+			out = os.path.join(self.outDir, key + '.' + self.fmt)
+			job = (key, sig[0][0], sig[1][0], out, self.cacheDir, self.incremental, False, self.scoring)
+			self.running[pool.submit(SleepBatch.align_job, job)] = (key, sig)
+			started += 1
+		return(started)
+
+
+	## records finished jobs in the state store.  Returns the number collected
+	def collect(self):
+		done = [future for future in self.running if future.done()]
+		for future in done:
+			key, sig = self.running.pop(future)
+			try:
+				key, ok, msg, secs, report = future.result()
+			except Exception as e:
+				ok, msg, secs = False, '%s: %s' % (type(e).__name__, e), 0.0
+			self.state[key] = {'inputs': sig, 'ok': ok, 'message': msg, 'time': time.time()}
+			self.stream.write('%s  %s  %-20s %7.2fs  %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'),
+								'OK  ' if ok else 'FAIL', key, secs, msg))
+			self.stream.flush()
+		if done:
+			self.save_state()
+		return(len(done))
+
+
+	## polls until interrupted.  once=True stops when nothing is left to do
+	def run(self, interval=POLL_SECONDS, once=False):
+		with ProcessPoolExecutor(max_workers=self.workers) as pool:
+			try:
+				while True:
+					self.collect()
+					started = self.submit(pool, self.scan(once))
+					if once and not started and not self.running:
+						break
+					time.sleep(interval if not once else 0.1)
+			except KeyboardInterrupt:
+				self.stream.write('Stopping, waiting for %d running job(s)\n' % len(self.running))
+				pool.shutdown(wait=True)
+				self.collect()
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Align actigraphy and sleep log files as they arrive')
+	parser.add_argument('--dir', action='append', required=True,
+						help='folder to watch (give more than once for separate actigraphy/log folders)')
+	parser.add_argument('--out', required=True, help='destination folder for aligned files')
+	parser.add_argument('--jobs', type=int, default=2, help='subjects aligned at once (default: 2)')
+	parser.add_argument('--interval', type=float, default=POLL_SECONDS,
+						help='seconds between folder scans (default: %g)' % POLL_SECONDS)
+	parser.add_argument('--settle', type=float, default=SETTLE_SECONDS,
+						help='seconds a file must be unchanged before it is used (default: %g)' %
+						SETTLE_SECONDS)
+	parser.add_argument('--format', choices=('csv', 'parquet', 'feather'), default='csv',
+						help='output file type (parquet and feather need pyarrow)')
+	parser.add_argument('--cache', nargs='?', const=SleepCache.DEFAULT_FOLDER, default=None,
+						help='reuse parsed input files from this cache folder (default: %s)' %
+						SleepCache.DEFAULT_FOLDER)
+	parser.add_argument('--incremental', action='store_true',
+						help='only align nights missing from existing output files')
+	parser.add_argument('--scoring', choices=('fill', 'replace'), default=None,
+						help='score sleep/wake from epoch data (see SleepBatch.py --scoring)')
+	parser.add_argument('--once', action='store_true', help='process what is ready, then exit')
+	args = parser.parse_args(argv)
+
+	watcher = Watcher(args.dir, args.out, max(1, args.jobs), args.settle, args.format, args.cache,
+						args.incremental, args.scoring)
+	if not args.once:
+		sys.stdout.write('Watching %s, writing to %s\n' % (', '.join(args.dir), args.out))
+		sys.stdout.flush()
+	watcher.run(args.interval, args.once)
+	return(0)
+
+
+## runs program
+if __name__ == '__main__':
+	multiprocessing.freeze_support()
+	sys.exit(main())
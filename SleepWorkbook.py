@@ -0,0 +1,264 @@
+## Sleep Aligner workbook sleep logs
+## Reads sleep logs straight from Excel workbooks (.xlsx/.xlsm, and .xls when the xlrd package is
+## installed), so they no longer have to be saved as CSV first.  The first worksheet is read, one
+## row at a time, and each cell is turned into the text Excel would have written to a CSV file:
+##   date cells           m/d/yyyy
+##   time cells           h:mm AM (h:mm:ss AM when the format shows seconds)
+##   date and time cells  m/d/yyyy h:mm AM
+##   whole numbers        without a decimal point (hour and minute fields: 10, not 10.0)
+## The rows then go through SleepEngine.split_log() like the rows of a CSV sleep log, so the
+## header names are looked up the same way (bedtime_hr, try_sleep_min, final_awake_time, ...).
+
+## .xlsx files are read with the standard library: the worksheet XML is parsed incrementally and
+## each row is dropped once converted.  xlrd is an optional dependency, only imported for .xls.
+
+## Usage:
+##   logHeader, logData = SleepEngine.read_log('1001_sleeplog.xlsx')
+##   rows = SleepWorkbook.read_rows('1001_sleeplog.xlsx')
+
+
+import os
+import re
+import datetime
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+import SleepEngine
+
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Excel's built in number formats that show dates and/or times
+BUILTIN_DATES = set([14, 15, 16, 17, 27, 28, 29, 30, 31, 34, 35, 36, 50, 51, 52, 53, 54, 55, 56,
+						57, 58])
+BUILTIN_TIMES = set([18, 19, 20, 21, 32, 33, 45, 46, 47])
+BUILTIN_STAMPS = set([22])
+BUILTIN_SECONDS = set([19, 21, 46, 47])
+
+# day 0 of Excel's two date systems
+EPOCH_1900 = datetime.date(1899, 12, 30).toordinal()
+EPOCH_1904 = datetime.date(1904, 1, 1).toordinal()
+
+
+class WorkbookUnavailable(Exception):
+	pass
+
+
+# what a number format shows: (kind, seconds) with kind None, 'date', 'time' or 'stamp'
+def format_kind(code):
+	# quoted text, [color]/[$-409] sections and escaped characters say nothing about the value;
+	# elapsed time sections ([h], [mm], [ss]) do
+	code = re.sub(r'"[^"]*"|\[(?![hms]+\])[^\]]*\]|\\.', '', code.lower())
+	hasDate = 'd' in code or 'y' in code
+	hasTime = 'h' in code or 's' in code
+	if hasDate and hasTime:
+		return('stamp', 's' in code)
+	if hasDate or (not hasTime and 'm' in code and 'general' not in code and '0' not in code):
+		return('date', False)
+	if hasTime:
+		return('time', 's' in code)
+	return(None, False)
+
+
+## CSV text of a date/time cell: day (days since 1/1/0001) and secs (seconds since midnight)
+def stamp_text(kind, day, secs, seconds=False):
+	if kind == 'date':
+		return(SleepEngine.format_date(day))
+	if kind == 'time':
+		return(SleepEngine.format_clock(secs, seconds))
+	return(SleepEngine.format_date(day) + ' ' + SleepEngine.format_clock(secs, seconds))
+
+
+## CSV text of a number cell
+def number_text(value):
+	if value == int(value):
+		return(str(int(value)))
+	return('%.15g' % value)
+
+
+# column number (0 based) of a cell reference like 'AB12'
+def column_index(ref):
+	col = 0
+	for ch in ref:
+		if ch.isdigit():
+			break
+		col = (col * 26) + (ord(ch.upper()) - 64)
+	return(col - 1)
+
+
+# rows with blank cells filled in to the header's width, without rows that are entirely empty
+def fill_rows(rows):
+	out = []
+	width = len(rows[0]) if rows else 0
+	for row in rows:
+		if any(cell.strip() for cell in row):
+			out.append(row + [''] * (width - len(row)))
+	return(out)
+
+
+## rows of the first worksheet of an .xlsx/.xlsm/.xls workbook as lists of strings
+def read_rows(path):
+	if os.path.splitext(path)[1].lower() == '.xls':
+		return(fill_rows(list(xls_rows(path))))
+	with zipfile.ZipFile(path) as book:
+		return(fill_rows(list(XlsxReader(book).rows())))
+
+
+class XlsxReader(object):
+	def __init__(self, book):
+		self.book = book
+		self.strings = self.shared_strings()
+		self.styles = self.cell_styles()
+		self.sheetPath, self.epoch = self.first_sheet()
+
+
+	# path of the first worksheet and the workbook's date system
+	def first_sheet(self):
+		workbook = ET.fromstring(self.book.read('xl/workbook.xml'))
+		props = workbook.find(MAIN_NS + 'workbookPr')
+		epoch = EPOCH_1900
+		if props is not None and props.get('date1904', '0').lower() in ('1', 'true'):
+			epoch = EPOCH_1904
+		sheets = workbook.find(MAIN_NS + 'sheets')
+		if sheets is None or len(sheets) == 0:
+			raise ValueError('Workbook has no worksheets')
+		relId = sheets[0].get(REL_NS + 'id')
+
+		rels = ET.fromstring(self.book.read('xl/_rels/workbook.xml.rels'))
+		for rel in rels.iter(PKG_REL_NS + 'Relationship'):
+			if rel.get('Id') == relId:
+				target = rel.get('Target')
+				if target.startswith('/'):
+					return(target.lstrip('/'), epoch)
+				return(posixpath.normpath(posixpath.join('xl', target)), epoch)
+		raise ValueError('Workbook has no worksheets')
+
+
+	# the shared string table
+	def shared_strings(self):
+		strings = []
+		try:
+			fh = self.book.open('xl/sharedStrings.xml')
+		except KeyError:
+			return(strings)
+		with fh:
+			for event, elem in ET.iterparse(fh):
+				if elem.tag == MAIN_NS + 'si':
+					# plain text, or the runs of rich text; phonetic hints (rPh) are left out
+					parts = [elem.findtext(MAIN_NS + 't') or '']
+					parts.extend(run.findtext(MAIN_NS + 't') or '' for run in elem.iter(MAIN_NS + 'r'))
+					strings.append(''.join(parts))
+					elem.clear()
+		return(strings)
+
+
+	# format_kind() of each cell style
+	def cell_styles(self):
+		try:
+			styles = ET.fromstring(self.book.read('xl/styles.xml'))
+		except KeyError:
+			return([])
+		codes = {}
+		numFmts = styles.find(MAIN_NS + 'numFmts')
+		if numFmts is not None:
+			for fmt in numFmts:
+				codes[int(fmt.get('numFmtId'))] = fmt.get('formatCode', '')
+		kinds = []
+		cellXfs = styles.find(MAIN_NS + 'cellXfs')
+		for xf in (cellXfs if cellXfs is not None else []):
+			fmtId = int(xf.get('numFmtId', '0'))
+			if fmtId in codes:
+				kinds.append(format_kind(codes[fmtId]))
+			elif fmtId in BUILTIN_DATES:
+				kinds.append(('date', False))
+			elif fmtId in BUILTIN_TIMES:
+				kinds.append(('time', fmtId in BUILTIN_SECONDS))
+			elif fmtId in BUILTIN_STAMPS:
+				kinds.append(('stamp', False))
+			else:
+				kinds.append((None, False))
+		return(kinds)
+
+
+	# CSV text of one <c> element
+	def cell_text(self, cell):
+		kind = cell.get('t', 'n')
+		if kind == 'inlineStr':
+			return(''.join(t.text or '' for t in cell.iter(MAIN_NS + 't')))
+		value = cell.findtext(MAIN_NS + 'v')
+		if value is None:
+			return('')
+		if kind == 's':
+			return(self.strings[int(value)])
+		if kind == 'b':
+			return('TRUE' if value == '1' else 'FALSE')
+		if kind != 'n':
+			# str (formula text), e (error) and d (ISO date text) cells as written
+			return(value)
+
+		number = float(value)
+		style = int(cell.get('s', '0'))
+		stampKind, seconds = self.styles[style] if style < len(self.styles) else (None, False)
+		if stampKind is None:
+			return(number_text(number))
+		day = int(number)
+		secs = int(round((number - day) * 86400))
+		if secs == 86400:
+			day += 1
+			secs = 0
+		return(stamp_text(stampKind, self.epoch + day, secs, seconds))
+
+
+	## the worksheet's rows, read incrementally
+	def rows(self):
+		with self.book.open(self.sheetPath) as fh:
+			for event, elem in ET.iterparse(fh):
+				if elem.tag != MAIN_NS + 'row':
+					continue
+				row = []
+				for cell in elem.iter(MAIN_NS + 'c'):
+					ref = cell.get('r')
+					if ref:
+						col = column_index(ref)
+						if col > len(row):
+							row.extend([''] * (col - len(row)))
+					row.append(self.cell_text(cell))
+				elem.clear()
+				yield(row)
+
+
+# rows of the first sheet of an .xls workbook, through xlrd
+def xls_rows(path):
+	try:
+		import xlrd
+	except ImportError:
+		raise WorkbookUnavailable('.xls sleep logs need the xlrd package (pip install xlrd), or '
+									'save the log as .xlsx')
+	book = xlrd.open_workbook(path, on_demand=True)
+	try:
+		sheet = book.sheet_by_index(0)
+		for r in range(sheet.nrows):
+			row = []
+			for cell in sheet.row(r):
+				if cell.ctype == xlrd.XL_CELL_DATE:
+					y, mo, d, h, mi, s = xlrd.xldate_as_tuple(cell.value, book.datemode)
+					secs = (h * 3600) + (mi * 60) + s
+					if y == 0:
+						row.append(stamp_text('time', 0, secs))
+					else:
+						day = datetime.date(y, mo, d).toordinal()
+						row.append(stamp_text('stamp' if secs else 'date', day, secs))
+				elif cell.ctype == xlrd.XL_CELL_NUMBER:
+					row.append(number_text(cell.value))
+				elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+					row.append('TRUE' if cell.value else 'FALSE')
+				elif cell.ctype == xlrd.XL_CELL_ERROR:
+					row.append(xlrd.error_text_from_code.get(cell.value, '#ERROR'))
+				else:
+					row.append(str(cell.value))
+			yield(row)
+	finally:
+		book.release_resources()
@@ -12,11 +12,31 @@ executables = [
     Executable('SleepAligner.py', base=base, shortcutName='SleepAligner',shortcutDir='DesktopFolder',icon='sleep_icon.ico')
 ]
 
+# Qt modules and standard library packages the aligner never uses.  Leaving them out keeps the
+# build small and keeps their DLLs and plugins from being loaded at start up.
+# (numpy and pyarrow stay in: scoring and Parquet/Feather output import them when used)
+excludes = [
+    "tkinter", "unittest", "pydoc", "pydoc_data", "doctest", "test", "lib2to3", "distutils",
+    "email", "http", "xmlrpc", "sqlite3", "curses", "asyncio",
+    "PyQt5.QtNetwork", "PyQt5.QtOpenGL", "PyQt5.QtPrintSupport", "PyQt5.QtSql", "PyQt5.QtSvg",
+    "PyQt5.QtTest", "PyQt5.QtXml", "PyQt5.QtXmlPatterns", "PyQt5.QtQml", "PyQt5.QtQuick",
+    "PyQt5.QtQuickWidgets", "PyQt5.QtMultimedia", "PyQt5.QtMultimediaWidgets", "PyQt5.QtBluetooth",
+    "PyQt5.QtNfc", "PyQt5.QtPositioning", "PyQt5.QtLocation", "PyQt5.QtSensors",
+    "PyQt5.QtSerialPort", "PyQt5.QtWebChannel", "PyQt5.QtWebSockets", "PyQt5.QtWebEngine",
+    "PyQt5.QtWebEngineCore", "PyQt5.QtWebEngineWidgets", "PyQt5.QtDesigner", "PyQt5.QtHelp",
+    "PyQt5.QtDBus", "PyQt5.QtRemoteObjects", "PyQt5.Qt3DCore", "PyQt5.QtChart",
+]
+
 buildOptions = dict(
     packages = [],
-    excludes = [],
+    excludes = excludes,
     includes = ["atexit"],
-    include_files = []
+    include_files = [],
+    # pure Python modules load from one zip file, which starts faster than many small files;
+    # packages with extension modules and data files stay as folders
+    zip_include_packages = ["*"],
+    zip_exclude_packages = ["PyQt5", "numpy", "pyarrow"],
+    optimize = 1,
 )
 
 bdist_msi_options = dict(
@@ -0,0 +1,59 @@
+## cohort datasets: writing several subjects into one file and reading them back by index
+
+## Usage:
+##   python -m pytest tests
+
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SleepCohort
+
+from test_engine import ACT_CSV, LOG_CSV, DATES, write
+
+
+class CohortTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.jobs = []
+		for subject in ('S001', 'S002', 'S003'):
+			actPath = os.path.join(self.folder, subject + '_act.csv')
+			logPath = os.path.join(self.folder, subject + '_log.csv')
+			write(actPath, ACT_CSV.replace('Full Name:,S001', 'Full Name:,' + subject))
+			log = LOG_CSV
+			if subject == 'S002':
+				# a blank bedtime_hr can not be parsed
+				log = log.replace('S001,2,6/13/17,6:40 AM,10,', 'S001,2,6/13/17,6:40 AM,,')
+			write(logPath, log)
+			self.jobs.append((subject, actPath, logPath))
+		self.outPath = os.path.join(self.folder, 'cohort.csv')
+
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+
+	def test_write_and_lookup(self):
+		for depth in (0, 2):
+			rows, failed = SleepCohort.write_cohort(self.jobs, self.outPath, depth=depth)
+			self.assertEqual(rows, 2 * len(DATES))
+			self.assertEqual([key for key, error in failed], ['S002'])
+
+			index = SleepCohort.load_index(self.outPath)
+			self.assertEqual(sorted(index), ['S001', 'S003'])
+			for subject in ('S001', 'S003'):
+				nights = SleepCohort.lookup(self.outPath, subject, index=index)
+				self.assertEqual([row[1] for row in nights], DATES)
+				self.assertTrue(all(row[0] == subject for row in nights))
+			night = SleepCohort.lookup(self.outPath, 'S003', '6/14/2017', index)
+			self.assertEqual([row[:2] for row in night], [['S003', '6/14/2017']])
+			self.assertEqual(SleepCohort.lookup(self.outPath, 'S002', index=index), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
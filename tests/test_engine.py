@@ -0,0 +1,160 @@
+## alignment of sleep log and actigraphy rows: the noon-to-noon night join, the last sleep log
+## row and incremental updates
+
+## Usage:
+##   python -m pytest tests
+
+
+import io
+import os
+import sys
+import csv
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SleepEngine
+
+
+# four nights from 6/12/2017; on the night of 6/14 the subject went to bed after midnight
+ACT_CSV = '''Actiware Data Export
+Full Name:,S001
+
+-------------------- Statistics --------------------
+Interval Type,Interval#,Start Date,Start Time,End Date,End Time,Duration,Sleep Time
+ACTIVE,1,6/12/2017,7:00:00 AM,6/12/2017,10:30:00 PM,930,0
+ACTIVE,2,6/13/2017,6:40:00 AM,6/13/2017,10:50:00 PM,970,0
+ACTIVE,3,6/14/2017,6:20:00 AM,6/15/2017,12:10:00 AM,1070,0
+ACTIVE,4,6/15/2017,7:45:00 AM,6/15/2017,10:15:00 PM,870,0
+REST,1,6/12/2017,10:30:00 PM,6/13/2017,6:40:00 AM,490,0
+REST,2,6/13/2017,10:50:00 PM,6/14/2017,6:20:00 AM,450,0
+REST,3,6/15/2017,12:10:00 AM,6/15/2017,7:45:00 AM,455,0
+REST,4,6/15/2017,10:15:00 PM,6/16/2017,6:30:00 AM,495,0
+SLEEP,1,6/12/2017,10:45:00 PM,6/13/2017,6:30:00 AM,465,450
+SLEEP,2,6/13/2017,11:05:00 PM,6/14/2017,6:10:00 AM,425,400
+SLEEP,3,6/15/2017,12:30:00 AM,6/15/2017,7:30:00 AM,420,410
+SLEEP,4,6/15/2017,10:30:00 PM,6/16/2017,6:20:00 AM,470,455
+
+-------------------- Marker/Score List --------------------
+'''
+
+LOG_CSV = '''subject,entry,date,final_awake_time,bedtime_hr,bedtime_min,bedtime_am_pm,fall_asleep_hr,fall_asleep_min,try_sleep_hr,try_sleep_min,try_sleep_am_pm,awake_hr,awake_min,awake_am_pm,bed_out_hr,bed_out_min,bed_out_am_pm,sleep_quality
+S001,1,6/12/17,7:00 AM,10,30,1,0,15,10,40,1,6,30,0,6,40,0,4
+S001,2,6/13/17,6:40 AM,10,50,1,0,10,11,0,1,6,10,0,6,20,0,3
+S001,3,6/14/17,6:20 AM,12,10,0,0,15,12,20,0,7,30,0,7,45,0,2
+S001,4,6/15/17,7:45 AM,10,15,1,0,10,10,20,1,6,20,0,6,30,0,4
+'''
+
+DATES = ['6/12/2017', '6/13/2017', '6/14/2017', '6/15/2017']
+
+
+def rows(text):
+	return(list(csv.reader(io.StringIO(text))))
+
+
+# log rows as a CSV export has them, ending with an empty row
+def log_rows():
+	return(rows(LOG_CSV) + [[''] * 19])
+
+
+def write(path, text):
+	with open(path, 'w', newline='') as fh:
+		fh.write(text)
+
+
+def read_output(path):
+	with open(path, newline='') as fh:
+		return(list(csv.DictReader(fh)))
+
+
+class LinkNightsTest(unittest.TestCase):
+	def setUp(self):
+		ID, actHeader, self.rest, self.active, self.sleep, self.daily = SleepEngine.split_actigraphy(
+			rows(ACT_CSV))
+		self.logHeader, self.logData = SleepEngine.split_log(log_rows())
+
+
+	def test_after_midnight_night(self):
+		nights = SleepEngine.link_nights(self.logData, self.rest, self.active, self.sleep, self.daily)
+		self.assertEqual([SleepEngine.format_date(night.day) for night in nights], DATES)
+		night = nights[2]
+		self.assertEqual(night.log[SleepEngine.LOG_DATE], '6/14/2017')
+		self.assertEqual(night.sleep[1], '3')
+		self.assertEqual(night.rest[1], '3')
+		self.assertEqual(night.active[1], '3')
+
+
+	def test_missing_rest_only_leaves_its_night(self):
+		rest = [row for row in self.rest if row[1] != '2']
+		nights = SleepEngine.link_nights(self.logData, rest, self.active, self.sleep, self.daily)
+		self.assertIs(nights[1].rest, SleepEngine.NA_ROW)
+		self.assertEqual([night.rest[1] for night in nights[2:]], ['3', '4'])
+		self.assertEqual([night.sleep[1] for night in nights], ['1', '2', '3', '4'])
+
+
+class LastLogRowTest(unittest.TestCase):
+	# LOG_BED_START of each night of align()
+	def bed_starts(self, logRows):
+		outHeader, outList = SleepEngine.align(rows(ACT_CSV), logRows)
+		col = outHeader.index('LOG_BED_START')
+		return([row[col] for row in outList])
+
+
+	def test_last_row_without_blank_row(self):
+		starts = self.bed_starts(rows(LOG_CSV))
+		self.assertEqual(len(starts), len(DATES))
+		self.assertEqual(starts[-1], '6/15/2017 10:15 PM')
+
+
+	def test_blank_last_row_dropped(self):
+		self.assertEqual(self.bed_starts(log_rows()), self.bed_starts(rows(LOG_CSV)))
+
+
+class IncrementalTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.actPath = os.path.join(self.folder, 'S001_act.csv')
+		self.logPath = os.path.join(self.folder, 'S001_log.csv')
+		write(self.actPath, ACT_CSV)
+		write(self.logPath, LOG_CSV)
+		self.fullPath = os.path.join(self.folder, 'full.csv')
+		SleepEngine.align_files(self.actPath, self.logPath, self.fullPath)
+
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+
+	def read_bytes(self, path):
+		with open(path, 'rb') as fh:
+			return(fh.read())
+
+
+	# output of the first nights only, as an earlier run left it
+	def partial_output(self, nights):
+		path = os.path.join(self.folder, 'inc.csv')
+		with open(self.fullPath, 'rb') as fh:
+			lines = fh.readlines()
+		with open(path, 'wb') as fh:
+			fh.writelines(lines[:nights + 1])
+		return(path)
+
+
+	def test_matches_full_alignment(self):
+		for nights in range(len(DATES)):
+			path = self.partial_output(nights)
+			SleepEngine.align_incremental(self.actPath, self.logPath, path)
+			self.assertEqual(self.read_bytes(path), self.read_bytes(self.fullPath), nights)
+			self.assertFalse(os.path.exists(path + '.part'))
+
+
+	def test_nothing_new(self):
+		path = self.partial_output(len(DATES))
+		self.assertEqual(SleepEngine.align_incremental(self.actPath, self.logPath, path), 0)
+		self.assertEqual(self.read_bytes(path), self.read_bytes(self.fullPath))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,82 @@
+## SleepPipeline stages stop when the code feeding them fails
+
+## Usage:
+##   python -m pytest tests
+
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SleepPipeline
+
+
+# seconds a stage gets to stop before the test counts it as hung
+STOP_SECONDS = 5
+
+
+class StageTest(unittest.TestCase):
+	# runs func on a thread and fails if it does not return within STOP_SECONDS
+	def returns(self, func):
+		thread = threading.Thread(target=func, daemon=True)
+		thread.start()
+		thread.join(STOP_SECONDS)
+		self.assertFalse(thread.is_alive(), 'stage did not stop')
+
+
+	def test_error_in_block_stops_idle_stage(self):
+		raised = []
+		ran = threading.Event()
+
+		def body():
+			try:
+				with SleepPipeline.Stage(2) as stage:
+					stage.put(ran.set)
+					# the stage is now waiting for its next call
+					ran.wait(STOP_SECONDS)
+					raise RuntimeError('fails')
+			except RuntimeError as e:
+				raised.append(e)
+		self.returns(body)
+		self.assertEqual(len(raised), 1)
+
+
+	def test_error_in_block_stops_full_stage(self):
+		release = threading.Event()
+
+		def body():
+			try:
+				with SleepPipeline.Stage(1) as stage:
+					# one call running, one waiting: the queue is full
+					stage.put(release.wait, STOP_SECONDS)
+					stage.put(len, 'x')
+					release.set()
+					raise RuntimeError('fails')
+			except RuntimeError:
+				pass
+		self.returns(body)
+
+
+	def test_error_in_call_raised_from_close(self):
+		def fail():
+			raise ValueError('call fails')
+
+		stage = SleepPipeline.Stage(2)
+		stage.put(fail)
+		with self.assertRaises(ValueError):
+			stage.close()
+
+
+	def test_calls_run_in_order(self):
+		done = []
+		with SleepPipeline.Stage(2) as stage:
+			for n in range(10):
+				stage.put(done.append, n)
+		self.assertEqual(done, list(range(10)))
+
+
+if __name__ == '__main__':
+	unittest.main()
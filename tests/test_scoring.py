@@ -0,0 +1,128 @@
+## scored intervals are matched to nights by their noon-to-noon night, so a sleep starting after
+## midnight is still the evening's night
+
+## Usage:
+##   python -m pytest tests
+
+
+import os
+import sys
+import csv
+import shutil
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SleepBench
+import SleepEngine
+import SleepScore
+
+
+START = datetime.date(2017, 6, 12)
+
+# (sleep start, sleep end) of each night, from the evening's midnight; night 1 falls asleep at 1 AM
+SLEEP_HOURS = ((23, 30), (25, 31), (23, 30))
+
+# nights the export itself has intervals for
+EXPORTED = (0, 2)
+
+EPOCH = 60
+
+
+def stamp(night, hours):
+	return(datetime.datetime.combine(START + datetime.timedelta(days=night), datetime.time(0)) +
+			datetime.timedelta(hours=hours))
+
+
+# statistics row in SleepBench.ACT_HEADER layout
+def stats_row(kind, n, s, e):
+	row = [kind, str(n), SleepBench.act_date(s), SleepBench.act_time(s), SleepBench.act_date(e),
+			SleepBench.act_time(e)]
+	return(row + ['0'] * (len(SleepBench.ACT_HEADER) - len(row)))
+
+
+# export with epochs for every night in SLEEP_HOURS and statistics only for the EXPORTED ones
+def write_export(path):
+	asleep = [(stamp(k, s), stamp(k, e)) for k, (s, e) in enumerate(SLEEP_HOURS)]
+	stats = {'ACTIVE': [], 'REST': [], 'SLEEP': []}
+	wake = stamp(0, 7)
+	for n, k in enumerate(EXPORTED):
+		s, e = asleep[k]
+		stats['ACTIVE'].append(stats_row('ACTIVE', n + 1, wake, s))
+		stats['REST'].append(stats_row('REST', n + 1, s, e))
+		stats['SLEEP'].append(stats_row('SLEEP', n + 1, s, e))
+		wake = e
+
+	with open(path, 'w', newline='') as fh:
+		w = csv.writer(fh)
+		w.writerows([['Actiware Data Export'], ['Full Name:', 'S001'], ['Epoch Length:', str(EPOCH)], [],
+						['-------------------- Statistics --------------------'], SleepBench.ACT_HEADER])
+		for kind in ('ACTIVE', 'REST', 'SLEEP'):
+			w.writerows(stats[kind])
+		w.writerows([[], ['-------------------- Epoch-by-Epoch Data --------------------'],
+						SleepBench.EPOCH_HEADER])
+		t = datetime.datetime.combine(START, datetime.time(12))
+		end = stamp(len(SLEEP_HOURS), 12)
+		line = 0
+		while t < end:
+			line += 1
+			activity = 0 if any(s <= t < e for s, e in asleep) else 200
+			w.writerow([line, SleepBench.act_date(t), SleepBench.act_time(t), 0, activity] + [''] * 7)
+			t += datetime.timedelta(seconds=EPOCH)
+
+
+class ScoredNightsTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.actPath = os.path.join(self.folder, 'S001_actigraphy.csv')
+		self.logPath = SleepBench.make_subject(self.folder, 'S001', len(SLEEP_HOURS), START,
+												epochSeconds=0)[1]
+		write_export(self.actPath)
+
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+
+	# {DATE_START: ACT_SLEEP_END in seconds} of an aligned output
+	def sleep_ends(self, scoring):
+		outPath = os.path.join(self.folder, scoring + '.csv')
+		SleepEngine.align_files(self.actPath, self.logPath, outPath, scoring=scoring)
+		ends = {}
+		with open(outPath, newline='') as fh:
+			for row in csv.DictReader(fh):
+				self.assertNotEqual(row['ACT_SLEEP_END'], 'N/A', row['DATE_START'])
+				date, clock = row['ACT_SLEEP_END'].split(' ', 1)
+				ends[row['DATE_START']] = SleepEngine.stamp_seconds(date, clock)
+		return(ends)
+
+
+	# checks every night's sleep end against SLEEP_HOURS, exactly for the nights in exact
+	def check_ends(self, ends, exact=()):
+		self.assertEqual(len(ends), len(SLEEP_HOURS))
+		for k, (s, e) in enumerate(SLEEP_HOURS):
+			secs = ends[SleepBench.act_date(START + datetime.timedelta(days=k))]
+			expected = SleepEngine.stamp_seconds(SleepBench.act_date(stamp(k, e)),
+													SleepBench.act_time(stamp(k, e)))
+			self.assertLessEqual(abs(secs - expected), 0 if k in exact else 2 * EPOCH, k)
+
+
+	def test_sleep_periods_night(self):
+		epoch, start, counts = SleepScore.read_epochs(self.actPath)
+		periods = SleepScore.sleep_periods(SleepScore.score(counts, epoch), epoch, start)
+		first = START.toordinal()
+		self.assertEqual([period[0] for period in periods], [first, first + 1, first + 2])
+
+
+	def test_fill_after_midnight(self):
+		self.check_ends(self.sleep_ends('fill'), EXPORTED)
+
+
+	def test_replace_keeps_every_night(self):
+		self.check_ends(self.sleep_ends('replace'))
+
+
+if __name__ == '__main__':
+	unittest.main()